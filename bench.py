@@ -0,0 +1,536 @@
+"""Offline benchmarks for the MediaFetch download engine.
+
+Everything runs against a local HTTP server serving synthetic media
+(progressive range-capable files, HLS playlists and DASH fragments) through
+a stub extractor, so no network access is needed and runs are repeatable:
+
+    python bench.py                             # all benchmarks
+    python bench.py throughput hooks            # selected benchmarks
+    python bench.py --save-baseline             # record bench_baseline.json
+    python bench.py --compare                   # fail on regressions vs. the baseline
+
+The server caps every connection at a fixed rate, like many CDNs do.
+History, queue, archive and cache files go to a temporary directory.
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import main
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MIB = 1024 * 1024
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, 'bench_baseline.json')
+FRAGMENT_SIZE = 256 * 1024
+SEED = 1234
+
+
+def synthetic_payload(size, seed=SEED):
+    """Deterministic pseudo-random bytes (incompressible, same on every run)"""
+    return random.Random(seed).randbytes(size)
+
+
+# ------------------ Local media server ------------------
+
+class MediaServer(http.server.ThreadingHTTPServer):
+    """Serves one in-memory payload as synthetic media, rate-limited per connection.
+
+    /media/<id>.mp4           progressive file, honours byte ranges
+    /hls/<id>/index.m3u8      HLS playlist of /hls/<id>/<n>.ts fragments
+    /dash/<id>/<n>.m4s        DASH fragments (listed by the stub extractor)
+    /watch/<kind>/<id>        page handled by StubIE (kind: progressive, hls, dash)
+
+    Any other path serves the payload as a plain file.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, payload, per_connection_rate=None):
+        self.payload = payload
+        self.per_connection_rate = per_connection_rate
+        super().__init__(('127.0.0.1', 0), MediaHandler)
+
+    @property
+    def base(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    @property
+    def url(self):
+        return f'{self.base}/video.mp4'
+
+    def watch_url(self, kind, video_id):
+        return f'{self.base}/watch/{kind}/{video_id}'
+
+    @property
+    def fragments(self):
+        return -(-len(self.payload) // FRAGMENT_SIZE)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class MediaHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        payload = memoryview(self.server.payload)
+        path = self.path.split('?', 1)[0]
+        if path.endswith('/index.m3u8'):
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+            for n in range(self.server.fragments):
+                lines += ['#EXTINF:2.0,', f'{n}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            return self._send_whole(('\n'.join(lines) + '\n').encode(), 'application/vnd.apple.mpegurl', send_body)
+        fragment = re.search(r'/(\d+)\.(?:ts|m4s)$', path)
+        if fragment:
+            start = int(fragment.group(1)) * FRAGMENT_SIZE
+            return self._send_whole(payload[start:start + FRAGMENT_SIZE], 'video/mp2t', send_body)
+        if path.startswith('/watch/'):
+            return self._send_whole(b'<html><title>bench</title></html>', 'text/html', send_body)
+
+        start, end = 0, len(payload) - 1
+        ranged = self.headers.get('Range', '').startswith('bytes=')
+        if ranged:
+            first, _, last = self.headers['Range'][6:].partition('-')
+            start = int(first or 0)
+            end = min(int(last), end) if last else end
+        self.send_response(206 if ranged else 200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if ranged:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(payload)}')
+        self.end_headers()
+        if send_body:
+            self._send(payload[start:end + 1])
+
+    def _send_whole(self, body, content_type, send_body):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self._send(body)
+
+    def _send(self, body, block=64 * 1024):
+        rate = self.server.per_connection_rate
+        started = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(0, len(body), block):
+                chunk = body[offset:offset + block]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+# ------------------ Stub extractor ------------------
+
+def install_stub_extractor():
+    """Make every YoutubeDL instance resolve /watch/<kind>/<id> pages on the bench server"""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+
+    if getattr(yt_dlp.YoutubeDL, '_bench_stub', False):
+        return
+
+    class StubIE(InfoExtractor):
+        IE_NAME = 'bench'
+        _VALID_URL = r'https?://127\.0\.0\.1:(?P<port>\d+)/watch/(?P<kind>progressive|hls|dash)/(?P<id>[\w-]+)'
+
+        def _real_extract(self, url):
+            port, kind, video_id = self._match_valid_url(url).group('port', 'kind', 'id')
+            base = f'http://127.0.0.1:{port}'
+            size = int(self._downloader.params.get('bench_payload_size') or 0)
+            if kind == 'progressive':
+                fmt = {'url': f'{base}/media/{video_id}.mp4', 'ext': 'mp4', 'filesize': size or None}
+            elif kind == 'hls':
+                fmt = {'url': f'{base}/hls/{video_id}/index.m3u8', 'ext': 'ts', 'protocol': 'm3u8_native'}
+            else:
+                fmt = {
+                    'url': f'{base}/dash/{video_id}/manifest.mpd',
+                    'ext': 'mp4',
+                    'protocol': 'http_dash_segments',
+                    'fragment_base_url': f'{base}/dash/{video_id}/',
+                    'fragments': [{'path': f'{n}.m4s', 'duration': 2.0}
+                                  for n in range(-(-size // FRAGMENT_SIZE))],
+                }
+            fmt.update({'format_id': kind, 'vcodec': 'avc1.4d401f', 'acodec': 'mp4a.40.2', 'width': 1280, 'height': 720})
+            return {'id': video_id, 'title': f'{kind} {video_id}', 'duration': 60, 'formats': [fmt]}
+
+    add_default = yt_dlp.YoutubeDL.add_default_info_extractors
+
+    def add_default_info_extractors(self):
+        self.add_info_extractor(StubIE())
+        add_default(self)
+
+    yt_dlp.YoutubeDL.add_default_info_extractors = add_default_info_extractors
+    yt_dlp.YoutubeDL._bench_stub = True
+
+
+# ------------------ Helpers ------------------
+
+class Sandbox:
+    """Points MediaFetch's history, queue, archive, metrics, subscriptions and caches at a temporary directory"""
+
+    NAMES = ('HISTORY_PATH', 'LEGACY_HISTORY_PATH', 'QUEUE_PATH', 'ARCHIVE_PATH', 'METRICS_PATH',
+             'SUBSCRIPTIONS_PATH', 'CACHE_DIR')
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='mediafetch-bench-')
+        self.saved = {name: getattr(main, name) for name in self.NAMES}
+        for name in self.NAMES:
+            setattr(main, name, main.Path(self.directory) / self.saved[name].name)
+        return self
+
+    def path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(main, name, value)
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def run_engine(urls, directory, max_workers=4, connections=1, payload_size=0, on_progress=None):
+    """Download urls with a fresh DownloadEngine, return (seconds, jobs)"""
+    install_stub_extractor()
+    idle = threading.Event()
+    engine = main.DownloadEngine({'max_workers': max_workers, 'per_host_limit': max_workers}, on_idle=idle.set)
+    if on_progress:
+        hook = engine.progress_hook
+
+        def progress_hook(job, d):
+            on_progress(job, d)
+            hook(job, d)
+
+        engine.progress_hook = progress_hook
+    options = {
+        'format': 'Video (MP4)',
+        'path': directory,
+        'connections': connections,
+        'quiet': True,
+        'redownload': True,
+    }
+    jobs = [main.DownloadJob(url, options) for url in urls]
+    # The stub extractor needs the payload size to list DASH fragments
+    build_ydl_opts = main.build_ydl_opts
+    main.build_ydl_opts = lambda opts: {**build_ydl_opts(opts), 'bench_payload_size': payload_size}
+    try:
+        started = time.perf_counter()
+        engine.submit(jobs)
+        idle.wait(600)
+        elapsed = time.perf_counter() - started
+    finally:
+        main.build_ydl_opts = build_ydl_opts
+        engine.close()
+    failed = [job for job in jobs if job.status != 'done']
+    if failed:
+        raise RuntimeError(f'{len(failed)} bench download(s) failed: {failed[0].error}')
+    return elapsed, jobs
+
+
+def metric(value, unit, better='lower'):
+    return {'value': round(value, 4), 'unit': unit, 'better': better}
+
+
+# ------------------ Benchmarks ------------------
+# Each benchmark prints a short report and returns {name: metric(...)}
+
+def bench_startup(args):
+    """Module import and headless start-to-exit time (median of several runs)"""
+    results = {}
+    with Sandbox() as sandbox:
+        env = dict(os.environ, HOME=sandbox.directory, USERPROFILE=sandbox.directory)
+        empty = sandbox.path('empty.txt')
+        open(empty, 'w').close()
+        commands = {
+            'startup_import_ms': [sys.executable, '-c', 'import main'],
+            'startup_headless_ms': [sys.executable, 'main.py', '--batch', empty, '--output', sandbox.directory],
+        }
+        for name, command in commands.items():
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                subprocess.run(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, check=True)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = metric(statistics.median(samples), 'ms')
+            print(f'  {name}: {results[name]["value"]:.0f} ms')
+    return results
+
+
+def bench_ttfb(args):
+    """Submit-to-first-byte latency for progressive, HLS and DASH media"""
+    results = {}
+    size = 2 * MIB
+    with Sandbox() as sandbox, MediaServer(synthetic_payload(size)) as server:
+        for kind in ('progressive', 'hls', 'dash'):
+            samples = []
+            for n in range(args.repeat):
+                first = []
+
+                def on_progress(job, d):
+                    if d.get('downloaded_bytes') and not first:
+                        first.append(time.perf_counter())
+
+                submitted = time.perf_counter()
+                run_engine([server.watch_url(kind, f'ttfb{n}')], sandbox.path(kind),
+                           payload_size=size, on_progress=on_progress)
+                samples.append((first[0] - submitted) * 1000)
+            name = f'ttfb_{kind}_ms'
+            results[name] = metric(statistics.median(samples), 'ms')
+            print(f'  {kind:>11}: {results[name]["value"]:.1f} ms to first byte')
+    return results
+
+
+def bench_throughput(args):
+    """Batch throughput at several concurrency levels"""
+    results = {}
+    size = args.item_size * MIB
+    with Sandbox() as sandbox, MediaServer(synthetic_payload(size), args.per_connection_rate * MIB) as server:
+        for kind in ('progressive', 'hls'):
+            for workers in args.concurrency:
+                directory = sandbox.path(f'{kind}{workers}')
+                urls = [server.watch_url(kind, f'{kind}{workers}x{n}') for n in range(args.items)]
+                elapsed, _ = run_engine(urls, directory, max_workers=workers, payload_size=size)
+                rate = args.items * args.item_size / elapsed
+                results[f'throughput_{kind}_c{workers}_mibs'] = metric(rate, 'MiB/s', 'higher')
+                print(f'  {kind:>11} x{workers}: {rate:7.1f} MiB/s ({elapsed:.2f} s for {args.items} items)')
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_segmented(args):
+    """Progressive download throughput by number of connections"""
+    payload = synthetic_payload(args.size * MIB)
+    digest = hashlib.sha256(payload).hexdigest()
+    print(f'  {args.size} MiB payload, server caps each connection at {args.per_connection_rate:g} MiB/s')
+    results = {}
+    with Sandbox() as sandbox, MediaServer(payload, args.per_connection_rate * MIB) as server:
+        baseline = None
+        for connections in args.connections:
+            directory = sandbox.path(f'segmented{connections}')
+            elapsed, _ = run_engine([server.url], directory, connections=connections)
+            with open(os.path.join(directory, os.listdir(directory)[0]), 'rb') as f:
+                if hashlib.sha256(f.read()).hexdigest() != digest:
+                    raise RuntimeError(f'corrupt download with {connections} connection(s)')
+            baseline = baseline or elapsed
+            results[f'segmented_{connections}conn_mibs'] = metric(args.size / elapsed, 'MiB/s', 'higher')
+            print(f'  {connections:>2} connection(s): {elapsed:6.2f} s  '
+                  f'{args.size / elapsed:7.1f} MiB/s  x{baseline / elapsed:4.1f}')
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def bench_hooks(args):
+    """Cost of one progress-hook call on a download worker"""
+    with Sandbox():
+        engine = main.DownloadEngine({})
+        job = main.DownloadJob('http://127.0.0.1/hook', {})
+        engine.bandwidth.start(job)
+        calls = 200_000
+        d = {'status': 'downloading', 'total_bytes': calls * 1024, 'speed': 1e6, 'eta': 10}
+        started = time.perf_counter()
+        for n in range(calls):
+            d['downloaded_bytes'] = n * 1024
+            engine.progress_hook(job, d)
+        per_call = (time.perf_counter() - started) / calls * 1e6
+        engine.close()
+    print(f'  progress_hook: {per_call:.2f} us per call')
+    return {'progress_hook_us': metric(per_call, 'us')}
+
+
+def bench_history(args):
+    """History write latency, and the latency of the first history page"""
+    with Sandbox():
+        store = main.HistoryStore(main.HISTORY_PATH)
+        samples = []
+        for n in range(args.history_writes):
+            entry = {'url': f'https://example.com/v/{n}', 'time': int(time.time()), 'status': 'success',
+                     'path': '/tmp', 'format': 'Video (MP4)', 'quality': 'Best'}
+            started = time.perf_counter()
+            store.add(entry)
+            samples.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        store.query(limit=main.HISTORY_PAGE_SIZE)
+        page = (time.perf_counter() - started) * 1000
+        store.close()
+    results = {
+        'history_write_p50_ms': metric(main.percentile(samples, 0.5), 'ms'),
+        'history_write_p95_ms': metric(main.percentile(samples, 0.95), 'ms'),
+        'history_page_ms': metric(page, 'ms'),
+    }
+    print(f'  write p50 {results["history_write_p50_ms"]["value"]:.3f} ms, '
+          f'p95 {results["history_write_p95_ms"]["value"]:.3f} ms, first page {page:.2f} ms')
+    return results
+
+
+def bench_preview(args):
+    """Metadata lookup behind the preview: cold extraction vs. cache hit"""
+    install_stub_extractor()
+    with Sandbox(), MediaServer(synthetic_payload(MIB)) as server:
+        engine = main.DownloadEngine({})
+        engine.metadata.warm_up()
+        cold, cached = [], []
+        for n in range(args.repeat):
+            url = server.watch_url('progressive', f'preview{n}')
+            started = time.perf_counter()
+            engine.metadata.extract(url)
+            cold.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            engine.metadata.extract(url)
+            cached.append((time.perf_counter() - started) * 1000)
+        engine.close()
+    results = {
+        'preview_extract_cold_ms': metric(statistics.median(cold), 'ms'),
+        'preview_extract_cached_ms': metric(statistics.median(cached), 'ms'),
+    }
+    print(f'  extract cold {results["preview_extract_cold_ms"]["value"]:.1f} ms, '
+          f'cached {results["preview_extract_cached_ms"]["value"]:.2f} ms')
+    return results
+
+
+def bench_memory(args):
+    """Peak RSS of a headless batch run (separate process)"""
+    if resource is None or not hasattr(os, 'wait4'):
+        print('  skipped: needs os.wait4 and the resource module (not available on Windows)')
+        return {}
+    size = args.item_size * MIB
+    with Sandbox() as sandbox, MediaServer(synthetic_payload(size)) as server:
+        urls = sandbox.path('urls.txt')
+        with open(urls, 'w') as f:
+            f.write('\n'.join(f'{server.base}/media/rss{n}.mp4' for n in range(args.items)))
+        env = dict(os.environ, HOME=sandbox.directory)
+        command = [sys.executable, 'main.py', '--batch', urls, '--output', sandbox.path('out'), '--jobs', '4']
+        process = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        exit_code = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = usage.ru_maxrss / (MIB if sys.platform == 'darwin' else 1024)
+    print(f'  peak RSS {peak:.1f} MiB for {args.items} downloads (exit code {exit_code})')
+    return {'peak_rss_batch_mib': metric(peak, 'MiB')}
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'ttfb': bench_ttfb,
+    'throughput': bench_throughput,
+    'segmented': bench_segmented,
+    'hooks': bench_hooks,
+    'history': bench_history,
+    'preview': bench_preview,
+    'memory': bench_memory,
+}
+
+
+# ------------------ Baseline ------------------
+
+def compare(results, baseline, tolerance):
+    """Print changes against a baseline and return the names of regressed metrics"""
+    regressions = []
+    print(f'\nCompared with baseline (tolerance {tolerance:.0%}):')
+    for name, current in sorted(results.items()):
+        previous = baseline.get('metrics', {}).get(name)
+        if not previous or not previous['value']:
+            print(f'  {name:<32} {current["value"]:>10.3f} {current["unit"]:<6} (new)')
+            continue
+        change = (current['value'] - previous['value']) / previous['value']
+        worse = change > tolerance if current['better'] == 'lower' else change < -tolerance
+        if worse:
+            regressions.append(name)
+        print(f'  {name:<32} {current["value"]:>10.3f} {current["unit"]:<6} '
+              f'{change:+7.1%} vs {previous["value"]:.3f}{"  REGRESSION" if worse else ""}')
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='MediaFetch offline benchmarks')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--repeat', type=int, default=5, help='samples for latency benchmarks')
+    parser.add_argument('--items', type=int, default=8, help='downloads per throughput run')
+    parser.add_argument('--item-size', type=int, default=2, help='size of each download in MiB')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='parallel downloads to compare')
+    parser.add_argument('--size', type=int, default=32, help='payload size in MiB for the segmented benchmark')
+    parser.add_argument('--per-connection-rate', type=float, default=8.0,
+                        help='server-side cap per connection in MiB/s')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='connection counts to compare')
+    parser.add_argument('--history-writes', type=int, default=2000, help='history entries to write')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE, metavar='FILE',
+                        help='save the results as the baseline (default: bench_baseline.json)')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, metavar='FILE',
+                        help='compare with a saved baseline and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative change counted as a regression (default: 0.2)')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark: {name}')
+    return args
+
+
+def run(args):
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        print(f'{name}: {BENCHMARKS[name].__doc__}')
+        results.update(BENCHMARKS[name](args))
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f'\n{len(regressions)} regression(s): {", ".join(regressions)}')
+            exit_code = 1
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': main.VERSION,
+                'python': sys.version.split()[0],
+                'platform': sys.platform,
+                'time': int(time.time()),
+                'metrics': results,
+            }, f, indent=2)
+        print(f'\nBaseline saved to {args.save_baseline}')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(run(parse_args()))
@@ -1,45 +1,3320 @@
-import customtkinter as ctk
-import tkinter as tk
-from tkinter import filedialog, messagebox
+import time
+_STARTUP_T0 = time.perf_counter()
 import threading
 import os
 from pathlib import Path
-import yt_dlp
 import json
-import time
 import urllib.request
 import urllib.error
-from PIL import Image, ImageTk
+import urllib.parse
 import io
+import collections
+import functools
+import itertools
+import hashlib
+import contextlib
+import concurrent.futures
+import sqlite3
+import argparse
+import queue
+import random
+import sys
+
+# App version
+VERSION = "0.1.3"
+# Accent color: try to derive from `icon.ico` if available, else fallback
+def _hex_from_rgb(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(*rgb)
+
+def _darken(hex_color, amount=0.2):
+    # Darken a hex color by amount (0..1)
+    hex_color = hex_color.lstrip('#')
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    r = max(0, int(r * (1 - amount)))
+    g = max(0, int(g * (1 - amount)))
+    b = max(0, int(b * (1 - amount)))
+    return _hex_from_rgb((r, g, b))
+
+ACCENT_COLOR = "#b30000"
+HOVER_COLOR = _darken(ACCENT_COLOR, 0.2)
+
+# Per-user state
+CONFIG_PATH = Path.home() / ".mediafetch_config.json"
+HISTORY_PATH = Path.home() / ".mediafetch_history.db"
+LEGACY_HISTORY_PATH = Path.home() / ".mediafetch_history.json"
+QUEUE_PATH = Path.home() / ".mediafetch_queue.db"
+ARCHIVE_PATH = Path.home() / ".mediafetch_archive.db"
+# Aggregated job metrics in Prometheus text format (node_exporter textfile)
+METRICS_PATH = Path.home() / ".mediafetch_metrics.prom"
+SUBSCRIPTIONS_PATH = Path.home() / ".mediafetch_subscriptions.db"
+# Finished jobs are kept in the queue journal this long
+QUEUE_RETENTION = 7 * 24 * 60 * 60
+CACHE_DIR = Path.home() / ".mediafetch_cache"
+
+# Startup budget: the main window should be painted within this many
+# seconds of process start (check with --trace-startup)
+STARTUP_TARGET_SECONDS = 1.0
+
+# Worker pool defaults (overridable via config)
+DEFAULT_MAX_WORKERS = 3
+DEFAULT_PER_HOST_LIMIT = 2
+# UI refresh rate for download progress
+PROGRESS_FPS = 15
+
+# Parallel connections per download: byte ranges of progressive HTTP files,
+# or fragments of HLS/DASH streams
+DEFAULT_CONNECTIONS = 4
+CONNECTION_CHOICES = ["1", "2", "4", "8", "16"]
+# Progressive files are only split when every range gets at least this much
+SEGMENT_MIN_SIZE = 4 * 1024 * 1024
+SEGMENT_BLOCK_SIZE = 256 * 1024
+# Seconds between checkpoints of per-range progress (for resuming)
+SEGMENT_CHECKPOINT_INTERVAL = 1.0
+
+# FFmpeg postprocessing (merges, audio extraction) runs in its own stage:
+# this many files at once, with at most POSTPROCESS_QUEUE more waiting before
+# download workers are held back
+POSTPROCESS_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+POSTPROCESS_QUEUE = 2
+
+# Bandwidth limits offered in the menu, in Mbit/s (shared by all downloads)
+BANDWIDTH_CHOICES = ["Unlimited", "5", "10", "20", "50", "100"]
+# A job that has not transferred anything for this long gives up its share
+BANDWIDTH_IDLE_SECONDS = 2.0
+# Longest single throttling sleep, so shares are re-balanced promptly
+BANDWIDTH_MAX_SLEEP = 0.25
+
+# Metadata cache: entries live at most INFO_CACHE_TTL, and never past the
+# expiry of the signed stream URLs they contain (minus a safety margin)
+INFO_CACHE_TTL = 3 * 60 * 60
+INFO_CACHE_MAX_BYTES = 200 * 1024 * 1024
+STREAM_EXPIRY_MARGIN = 10 * 60
+TRACKING_PARAMS = {'si', 'feature', 'fbclid', 'gclid', 'igshid', 'ref', 'ref_src'}
+# YouTube link variants (youtu.be, shorts, embeds, ...) are folded into watch?v=
+YOUTUBE_HOSTS = {'youtube.com', 'music.youtube.com', 'youtube-nocookie.com'}
+YOUTUBE_ID_PATHS = ('/shorts/', '/embed/', '/live/', '/v/')
+YOUTUBE_IGNORED_PARAMS = {'t', 'start', 'index', 'pp', 'ab_channel', 'start_radio'}
+
+# Daemon mode: local HTTP/JSON API port, finished jobs it keeps listing,
+# events buffered per SSE client, and seconds between SSE keep-alives
+DAEMON_PORT = 9120
+DAEMON_MAX_JOBS = 1000
+DAEMON_EVENT_QUEUE = 1000
+DAEMON_KEEPALIVE = 15.0
+
+# Subscriptions: default seconds between syncs of one channel/playlist, how
+# often the app and daemon look for due ones, and how many are synced at once
+SUBSCRIPTION_INTERVAL = 24 * 60 * 60
+SUBSCRIPTION_POLL = 5 * 60
+SUBSCRIPTION_WORKERS = 8
+# Newest item IDs remembered per newest-first source; entries listed by the
+# first sync (which only records them); most new entries taken by one sync
+SUBSCRIPTION_KNOWN_IDS = 500
+SUBSCRIPTION_BASELINE = 50
+SUBSCRIPTION_MAX_NEW = 200
+# Channel URLs (listed newest first) and their Atom feed of recent uploads
+YOUTUBE_CHANNEL_PATHS = ('/@', '/channel/', '/c/', '/user/')
+YOUTUBE_FEED_URL = 'https://www.youtube.com/feeds/videos.xml'
+
+# Failed jobs: transient errors and rate limits are retried this many times,
+# after an exponential, jittered delay (or as long as Retry-After asks, up
+# to RETRY_MAX_DELAY); retries inside one download back off from
+# DOWNLOAD_RETRY_DELAY
+JOB_RETRIES = 3
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 15 * 60
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_RETRY_DELAY = 0.5
+DOWNLOAD_RETRY_MAX_DELAY = 10.0
+# Circuit breaker: a host that rate-limits, or fails this many times in a
+# row, has its jobs parked for CIRCUIT_COOLDOWN (doubling while it keeps
+# failing) while other hosts carry on
+CIRCUIT_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 60.0
+# Failure messages (lowercase) that mark an error as a rate limit or as transient
+RATE_LIMIT_MESSAGES = ('too many requests', 'rate limit', 'rate-limit', "confirm you're not a bot",
+                       'confirm you’re not a bot')
+TRANSIENT_MESSAGES = ('timed out', 'connection reset', 'connection aborted', 'connection refused',
+                      'remote end closed', 'temporary failure in name resolution', 'network is unreachable',
+                      'incompleteread', 'incomplete read')
+# Lines of the failure summary shown after a batch
+FAILURE_SUMMARY_LINES = 8
+
+# Job states after which a job will not run again
+FINISHED_STATES = ('done', 'failed', 'skipped', 'cancelled')
+# Phases a job's time is split into, in the order they are entered
+JOB_PHASES = ('queued', 'backoff', 'extracting', 'downloading', 'merging', 'waiting', 'postprocessing')
+# Latency samples kept per extractor for quantiles, and the minimum time
+# between rewrites of the metrics file
+METRICS_SAMPLES = 1000
+METRICS_WRITE_INTERVAL = 5.0
+
+# Output formats offered in the format menu
+FORMAT_CHOICES = [
+    "Video (MP4)",
+    "Video (MKV)",
+    "Audio (MP3)",
+    "Audio (FLAC)",
+    "Audio (WAV)",
+    "Audio (M4A)"
+]
+# Short names accepted by the command line
+FORMAT_ALIASES = {
+    'mp4': "Video (MP4)",
+    'mkv': "Video (MKV)",
+    'mp3': "Audio (MP3)",
+    'flac': "Audio (FLAC)",
+    'wav': "Audio (WAV)",
+    'm4a': "Audio (M4A)",
+}
+# Multi-format downloads: extension of each output format, and the codecs an
+# MP4 can take over from the source without re-encoding
+OUTPUT_EXTENSIONS = {
+    "Video (MP4)": 'mp4',
+    "Video (MKV)": 'mkv',
+    "Audio (MP3)": 'mp3',
+    "Audio (FLAC)": 'flac',
+    "Audio (WAV)": 'wav',
+    "Audio (M4A)": 'm4a',
+}
+MP4_VIDEO_CODECS = ('avc1', 'avc3', 'h264', 'hev1', 'hvc1', 'hevc', 'av01')
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3', 'ac-3', 'ec-3')
+# Per-job rows kept in the jobs panel (finished rows beyond this are dropped)
+MAX_JOB_ROWS = 100
+# Search resolves the links of a multi-link batch this many at a time
+PREFETCH_WORKERS = 4
+# Playlist entries are streamed to the UI in batches of this size (or sooner)
+PLAYLIST_BATCH_SIZE = 50
+PLAYLIST_TYPES = ('playlist', 'multi_video')
+
+# History window page size (rows fetched per scroll step)
+HISTORY_PAGE_SIZE = 200
+
+# Preview thumbnails are cached already downscaled to this size
+THUMBNAIL_SIZE = (160, 90)
+
+
+# ------------------ Startup tracing ------------------
+class StartupTrace:
+    """Records named startup milestones relative to process start"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.marks = []
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        if self.enabled:
+            with self._lock:
+                self.marks.append((name, time.perf_counter() - _STARTUP_T0))
+
+    def elapsed(self, name):
+        for mark, t in self.marks:
+            if mark == name:
+                return t
+        return None
+
+    def report(self, stream=None):
+        if not self.enabled:
+            return
+        stream = stream or sys.stderr
+        with self._lock:
+            marks = sorted(self.marks, key=lambda m: m[1])
+        stream.write("MediaFetch startup trace (seconds since start):\n")
+        previous = 0.0
+        for name, t in marks:
+            stream.write(f"  {t:7.3f}  (+{t - previous:6.3f})  {name}\n")
+            previous = t
+        painted = self.elapsed('first paint')
+        if painted is not None:
+            verdict = 'OK' if painted <= STARTUP_TARGET_SECONDS else 'OVER BUDGET'
+            stream.write(f"  first paint {painted:.3f}s, target {STARTUP_TARGET_SECONDS:.3f}s: {verdict}\n")
+        stream.flush()
+
+
+STARTUP_TRACE = StartupTrace(
+    os.environ.get('MEDIAFETCH_TRACE_STARTUP') == '1' or '--trace-startup' in sys.argv
+)
+
+
+# ------------------ Download engine ------------------
+def build_ydl_opts(options):
+    """Translate resolved download options into yt-dlp parameters"""
+    format_choice = options.get('format', 'Video (MP4)')
+    quality = options.get('quality', 'Best')
+
+    # Base options
+    ydl_opts = {
+        'outtmpl': os.path.join(options.get('path', '.'), '%(title)s.%(ext)s'),
+        'quiet': False,
+        'no_warnings': False,
+    }
+    if options.get('quiet'):
+        # Headless mode owns stdout; yt-dlp's own errors still go to stderr
+        ydl_opts.update({'quiet': True, 'no_warnings': True, 'noprogress': True})
+
+    # Subtitles
+    if options.get('subs'):
+        lang = (options.get('subs_lang') or '').strip() or 'en'
+        ydl_opts['writesubtitles'] = True
+        ydl_opts['subtitleslangs'] = [lang]
+        ydl_opts['writeautomaticsub'] = True
+
+    # Thumbnail
+    if options.get('thumbnail'):
+        ydl_opts['writethumbnail'] = True
+
+    # Playlists start downloading their first entry while later ones are enumerated
+    ydl_opts['lazy_playlist'] = True
+    # A video opened from a playlist (watch?v=...&list=...) is that video,
+    # as its archive key says; playlist links still get the whole list
+    ydl_opts['noplaylist'] = True
+
+    # Retries inside a download (delays: DownloadEngine._retry_sleep); a job
+    # that still fails may be retried as a whole (see RetryPolicy)
+    ydl_opts['retries'] = DOWNLOAD_RETRIES
+    ydl_opts['fragment_retries'] = DOWNLOAD_RETRIES
+    ydl_opts['extractor_retries'] = DOWNLOAD_RETRIES
+
+    # Interrupted jobs are resubmitted with the same options, so the same
+    # output name picks up the existing .part file
+    ydl_opts['continuedl'] = True
+
+    # Parallel connections: byte ranges (SegmentedDownload) and HLS/DASH fragments
+    connections = max(1, int(options.get('connections') or DEFAULT_CONNECTIONS))
+    ydl_opts['http_connections'] = connections
+    ydl_opts['concurrent_fragment_downloads'] = connections
+
+    # Format-specific options (audio/video)
+    if "Audio" in format_choice:
+        audio_quality = '320'
+        if 'kbps' in quality:
+            audio_quality = quality.split()[0]
+
+        if "MP3" in format_choice:
+            ydl_opts.update({
+                'format': 'bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'mp3',
+                    'preferredquality': audio_quality,
+                }],
+            })
+        elif "FLAC" in format_choice:
+            ydl_opts.update({
+                'format': 'bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'flac',
+                }],
+            })
+        elif "WAV" in format_choice:
+            ydl_opts.update({
+                'format': 'bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'wav',
+                }],
+            })
+        elif "M4A" in format_choice:
+            ydl_opts.update({
+                'format': 'bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'm4a',
+                    'preferredquality': audio_quality,
+                }],
+            })
+    else:
+        # Video download with fps handling
+        if quality == "Best":
+            ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+        elif "60fps" in quality:
+            if "4K" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=2160][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]'
+            elif "1440p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=1440][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]'
+            elif "1080p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=1080][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]'
+            elif "720p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=720][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]'
+        else:
+            if "4K" in quality or "2160p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]/best[height<=2160]'
+            elif "1440p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]/best[height<=1440]'
+            elif "1080p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080]'
+            elif "720p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720]'
+            elif "480p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480]'
+            elif "360p" in quality:
+                ydl_opts['format'] = 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[height<=360]'
+
+        if "MKV" in format_choice:
+            ydl_opts['merge_output_format'] = 'mkv'
+        else:
+            ydl_opts['merge_output_format'] = 'mp4'
+
+    return ydl_opts
+
+
+def output_formats(options):
+    """Output formats requested by a job: the main format, then any extra ones"""
+    formats = [options.get('format', 'Video (MP4)')]
+    for extra in options.get('extra_formats') or []:
+        if extra in OUTPUT_EXTENSIONS and extra not in formats:
+            formats.append(extra)
+    return formats
+
+
+def build_source_opts(options, formats):
+    """yt-dlp parameters for one source download every format in `formats` can be derived from"""
+    video = [f for f in formats if "Video" in f]
+    if not video:
+        # Best audio as served; every audio format is derived from it
+        ydl_opts = build_ydl_opts(options)
+        ydl_opts.pop('postprocessors', None)
+        return ydl_opts
+    # Best streams in any codec, merged into MKV (which can hold them all)
+    ydl_opts = build_ydl_opts({**options, 'format': video[0]})
+    ydl_opts['format'] = ydl_opts['format'].replace('[ext=mp4]', '').replace('[ext=m4a]', '')
+    ydl_opts['merge_output_format'] = 'mkv'
+    return ydl_opts
+
+
+def derive_output(ydl, source, format_choice, quality='Best'):
+    """Derive one output format from a downloaded source and return its path.
+
+    `source` is the source's final info dict. Streams the target container
+    can hold are copied; only the others are re-encoded.
+    """
+    from yt_dlp.postprocessor import FFmpegExtractAudioPP, FFmpegPostProcessor
+    ext = OUTPUT_EXTENSIONS[format_choice]
+    path = source['filepath']
+    base, source_ext = os.path.splitext(path)
+    if source_ext[1:] == ext:
+        return path
+    if "Audio" in format_choice:
+        bitrate = quality.split()[0] if 'kbps' in quality else '320'
+        pp = FFmpegExtractAudioPP(
+            ydl, preferredcodec=ext, preferredquality=bitrate if ext in ('mp3', 'm4a') else None
+        )
+        # Copies the audio stream when it already has the target codec
+        _, result = pp.run({**source, 'ext': source_ext[1:], '__files_to_move': {}})
+        return result['filepath']
+
+    vcodec = (source.get('vcodec') or '').lower()
+    acodec = (source.get('acodec') or '').lower()
+    copy_video = ext == 'mkv' or vcodec.startswith(MP4_VIDEO_CODECS)
+    copy_audio = ext == 'mkv' or acodec in ('', 'none') or acodec.startswith(MP4_AUDIO_CODECS)
+    target = f'{base}.{ext}'
+    ffmpeg_opts = [
+        '-map', '0:v?', '-map', '0:a?',
+        '-c:v', 'copy' if copy_video else 'libx264',
+        '-c:a', 'copy' if copy_audio else 'aac',
+    ]
+    if ext == 'mp4':
+        ffmpeg_opts += ['-movflags', '+faststart']
+    FFmpegPostProcessor(ydl).run_ffmpeg(path, target, ffmpeg_opts)
+    return target
+
+
+def gather_futures(futures):
+    """Future for the list of results of `futures`, set once all of them are done.
+
+    Fails with the first error, or is cancelled if any of them was.
+    """
+    combined = concurrent.futures.Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if any(f.cancelled() for f in futures):
+            combined.cancel()
+            combined.set_running_or_notify_cancel()
+            return
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            combined.set_exception(errors[0])
+        else:
+            combined.set_result([f.result() for f in futures])
+
+    if not futures:
+        combined.set_result([])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+def host_of(url):
+    """Return the host name used to group jobs for per-host limits"""
+    host = (urllib.parse.urlsplit(url).hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    return host
+
+
+def canonical_url(url):
+    """Normalize a URL so equivalent links share one cache/queue key"""
+    parts = urllib.parse.urlsplit(url.strip())
+    host = host_of(url)
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k not in TRACKING_PARAMS and not k.startswith('utm_')
+    ]
+    path = parts.path.rstrip('/') or '/'
+    if host == 'youtu.be' and path != '/':
+        host, path, query = 'youtube.com', '/watch', [('v', path[1:])] + query
+    elif host in YOUTUBE_HOSTS:
+        host = 'youtube.com'
+        for prefix in YOUTUBE_ID_PATHS:
+            if path.startswith(prefix):
+                path, query = '/watch', [('v', path[len(prefix):])] + query
+                break
+    if host == 'youtube.com':
+        query = [(k, v) for k, v in query if k not in YOUTUBE_IGNORED_PARAMS]
+    query.sort()
+    return urllib.parse.urlunsplit(('https', host, path, urllib.parse.urlencode(query), ''))
+
+
+def subscription_url(url):
+    """Canonical URL a subscription is stored under; bare YouTube channel
+    links point at their Videos tab, videos opened from a playlist at the playlist"""
+    url = canonical_url(url)
+    parts = urllib.parse.urlsplit(url)
+    if parts.netloc == 'youtube.com' and parts.path == '/watch':
+        list_id = urllib.parse.parse_qs(parts.query).get('list', [''])[0]
+        if list_id:
+            return f'https://youtube.com/playlist?list={list_id}'
+    if parts.netloc == 'youtube.com' and not parts.query:
+        segments = parts.path.split('/')[1:]
+        if len(segments) == (1 if parts.path.startswith('/@') else 2) and \
+                parts.path.startswith(YOUTUBE_CHANNEL_PATHS):
+            return url + '/videos'
+    return url
+
+
+def is_newest_first(url):
+    """Whether a channel/playlist URL lists its newest items first (YouTube
+    channel tabs and uploads playlists); other lists are in playlist order"""
+    parts = urllib.parse.urlsplit(canonical_url(url))
+    if parts.netloc != 'youtube.com':
+        return False
+    list_id = urllib.parse.parse_qs(parts.query).get('list', [''])[0]
+    if list_id:
+        return list_id.startswith('UU')
+    return parts.path.startswith(YOUTUBE_CHANNEL_PATHS)
+
+
+_EXTRACTOR_CLASSES = None
+
+
+@functools.lru_cache(maxsize=4096)
+def archive_key(url):
+    """Archive key of a URL ('<extractor> <id>', as in yt-dlp's download
+    archive), worked out from the URL alone without any network request"""
+    global _EXTRACTOR_CLASSES
+    if _EXTRACTOR_CLASSES is None:
+        from yt_dlp.extractor import gen_extractor_classes
+        _EXTRACTOR_CLASSES = gen_extractor_classes()
+    parts = urllib.parse.urlsplit(canonical_url(url))
+    query = urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+    if parts.netloc == 'youtube.com' and parts.path == '/watch' and any(k == 'v' for k, _ in query):
+        # Downloaded with noplaylist: the video, not the list it was opened from
+        url = urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(
+            [(k, v) for k, v in query if k != 'list'])))
+    for ie in _EXTRACTOR_CLASSES:
+        if ie.suitable(url.strip()):
+            video_id = ie.get_temp_id(url.strip())
+            if video_id and ie.ie_key() != 'Generic':
+                return f'{ie.ie_key().lower()} {video_id}'
+            break
+    return f'url {canonical_url(url)}'
+
+
+def info_archive_keys(info):
+    """Archive keys of the videos in an info dict (or of a playlist's entries)"""
+    if not info:
+        return []
+    if info.get('_type') in PLAYLIST_TYPES:
+        try:
+            return [key for entry in info.get('entries') or [] for key in info_archive_keys(entry)]
+        except Exception:
+            return []
+    extractor = info.get('extractor_key') or info.get('ie_key')
+    if extractor and info.get('id'):
+        return [f"{extractor.lower()} {info['id']}"]
+    return []
+
+
+def stream_expiry(info):
+    """Earliest expiry timestamp of the signed media URLs in an info dict, if any"""
+    earliest = None
+    formats = list(info.get('formats') or [])
+    if info.get('url'):
+        formats.append(info)
+    for fmt in formats:
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(fmt.get('url') or '').query)
+        for name in ('expire', 'Expires', 'x-expires'):
+            try:
+                value = int(query[name][0])
+            except (KeyError, ValueError, IndexError):
+                continue
+            if earliest is None or value < earliest:
+                earliest = value
+    return earliest
+
+
+def info_is_fresh(info):
+    """Whether an info dict's stream URLs can still be used for downloading"""
+    now = time.time()
+    if info.get('epoch') and now - info['epoch'] > INFO_CACHE_TTL:
+        return False
+    expiry = stream_expiry(info)
+    return expiry is None or expiry - STREAM_EXPIRY_MARGIN > now
+
+
+class MetadataCache:
+    """On-disk cache of extract_info results with TTL and LRU eviction by size.
+
+    Each entry is one JSON file named after the hash of its key. Alias
+    entries (webpage URL, extractor ID) point at the primary file, and file
+    mtimes double as the LRU clock so recency survives restarts.
+    """
+
+    def __init__(self, directory, max_bytes=INFO_CACHE_MAX_BYTES, ttl=INFO_CACHE_TTL):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = collections.OrderedDict()  # file name -> size, oldest first
+        self._total = 0
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = sorted(self.directory.glob('*.json'), key=lambda p: p.stat().st_mtime)
+            for path in files:
+                size = path.stat().st_size
+                self._sizes[path.name] = size
+                self._total += size
+        except OSError:
+            pass
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+
+    def get(self, key):
+        with self._lock:
+            payload = self._read(self._name(key))
+            if payload and 'alias' in payload:
+                payload = self._read(payload['alias'])
+            if not payload or payload.get('expires', 0) <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return payload.get('info')
+
+    def put(self, key, info, aliases=()):
+        expires = time.time() + self.ttl
+        expiry = stream_expiry(info)
+        if expiry is not None:
+            expires = min(expires, expiry - STREAM_EXPIRY_MARGIN)
+        if expires <= time.time():
+            return
+        primary = self._name(key)
+        with self._lock:
+            self._write(primary, {'key': key, 'expires': expires, 'info': info})
+            for alias in aliases:
+                if alias and alias != key:
+                    self._write(self._name(alias), {'key': alias, 'alias': primary})
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'entries': len(self._sizes),
+                'bytes': self._total,
+            }
+
+    def clear(self):
+        with self._lock:
+            for name in list(self._sizes):
+                self._remove(name)
+
+    def _read(self, name):
+        path = self.directory / name
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+            os.utime(path)
+        except Exception:
+            return None
+        if name in self._sizes:
+            self._sizes.move_to_end(name)
+        return payload
+
+    def _write(self, name, payload):
+        path = self.directory / name
+        tmp = path.with_suffix('.tmp')
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(payload, f)
+            os.replace(tmp, path)
+            size = path.stat().st_size
+        except Exception:
+            return
+        self._total += size - self._sizes.pop(name, 0)
+        self._sizes[name] = size
+
+    def _remove(self, name):
+        self._total -= self._sizes.pop(name, 0)
+        try:
+            (self.directory / name).unlink()
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._sizes:
+            self._remove(next(iter(self._sizes)))
+
+
+def playlist_entry(entry):
+    """Compact record for one flat playlist entry, or None if it has no URL"""
+    if not entry:
+        return None
+    url = entry.get('url') or ''
+    if not url.startswith('http'):
+        url = entry.get('webpage_url') or ''
+    if not url.startswith('http'):
+        return None
+    return {
+        'url': url,
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'duration': entry.get('duration'),
+        'ie_key': entry.get('ie_key'),
+    }
+
+
+def estimate_size(info):
+    """Approximate download size in bytes of the format(s) yt-dlp selected, or None"""
+    if not info:
+        return None
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 1000 / 8 * info['duration']
+        if not size:
+            return None
+        total += size
+    return int(total)
+
+
+class MediaInfo:
+    """Compact record of what the preview, quality menu and download need.
+
+    yt-dlp's info dicts carry every format with its headers and fragment
+    lists; only this record is kept around, while the full dict stays in
+    the metadata cache, where downloads look it up by URL.
+    """
+
+    __slots__ = ('url', 'title', 'duration', 'uploader', 'view_count', 'thumbnail',
+                 'heights', 'max_fps', 'size', 'playlist', 'entries')
+
+    def __init__(self, url, title=None, duration=None, uploader=None, view_count=None, thumbnail=None,
+                 heights=(), max_fps=None, size=None, playlist=False, entries=()):
+        self.url = url
+        self.title = title
+        self.duration = duration
+        self.uploader = uploader
+        self.view_count = view_count
+        self.thumbnail = thumbnail
+        self.heights = heights  # available video heights, ascending
+        self.max_fps = max_fps
+        self.size = size  # estimated download size in bytes
+        self.playlist = playlist
+        self.entries = entries  # compact playlist entries (see playlist_entry)
+
+    @classmethod
+    def from_info(cls, info, url=None):
+        playlist = info.get('_type') in PLAYLIST_TYPES
+        formats = () if playlist else info.get('formats') or ()
+        return cls(
+            url=url or info.get('webpage_url') or info.get('original_url'),
+            title=info.get('title'),
+            duration=info.get('duration'),
+            uploader=info.get('uploader') or info.get('channel'),
+            view_count=info.get('view_count'),
+            thumbnail=info.get('thumbnail'),
+            heights=tuple(sorted({f['height'] for f in formats if f.get('height')})),
+            max_fps=max((f['fps'] for f in formats if f.get('fps')), default=None),
+            size=None if playlist else estimate_size(info),
+            playlist=playlist,
+            entries=tuple(info.get('entries') or ()) if playlist else (),
+        )
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into a single execution.
+
+    The leader's fn(publish) may publish(*args) partial results on the way;
+    the listener of every caller receives them, including those published
+    before it joined the flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, listener=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {
+                    'event': threading.Event(), 'result': None, 'error': None,
+                    'listeners': [], 'published': [], 'lock': threading.Lock(),
+                }
+        if listener is not None:
+            with call['lock']:
+                # Replay what a late joiner missed
+                for args in call['published']:
+                    listener(*args)
+                call['listeners'].append(listener)
+
+        if not leader:
+            # Someone else is already fetching this key; share their outcome
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        def publish(*args):
+            with call['lock']:
+                call['published'].append(args)
+                for each in call['listeners']:
+                    each(*args)
+
+        try:
+            call['result'] = fn(publish)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
+
+
+class _HookSlot:
+    """Stable progress hook of a pooled YoutubeDL that forwards to the current job"""
+
+    def __init__(self):
+        self.hook = None
+
+    def __call__(self, d):
+        hook = self.hook
+        if hook is not None:
+            hook(d)
+
+
+class YoutubeDLPool:
+    """Warm YoutubeDL instances keyed by option set.
+
+    Building a YoutubeDL initialises extractors, cookie jars and HTTP
+    handlers; reusing one keeps all of that (and open keep-alive
+    connections) across jobs. Progress hooks, retry hooks and the output
+    template are per-job and excluded from the key; an instance is only ever used by
+    one job at a time.
+    """
+
+    PER_JOB_KEYS = ('progress_hooks', 'outtmpl', 'retry_sleep_functions')
+
+    def __init__(self, max_idle=16):
+        self.max_idle = max_idle
+        self._idle = collections.OrderedDict()  # key -> [(ydl, slot), ...], least recently used first
+        self._idle_count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(ydl_opts):
+        shared = {k: v for k, v in ydl_opts.items() if k not in YoutubeDLPool.PER_JOB_KEYS}
+        return json.dumps(shared, sort_keys=True, default=str)
+
+    @contextlib.contextmanager
+    def acquire(self, ydl_opts):
+        """Check out a YoutubeDL configured with ydl_opts for one job"""
+        key = self._key(ydl_opts)
+        entry = None
+        with self._lock:
+            bucket = self._idle.get(key)
+            if bucket:
+                entry = bucket.pop()
+                self._idle_count -= 1
+                if not bucket:
+                    del self._idle[key]
+        if entry is None:
+            slot = _HookSlot()
+            params = dict(ydl_opts)
+            params['progress_hooks'] = [slot]
+            import yt_dlp
+            entry = (yt_dlp.YoutubeDL(params), slot)
+        ydl, slot = entry
+
+        hooks = list(ydl_opts.get('progress_hooks') or [])
+
+        def forward(d):
+            for hook in hooks:
+                hook(d)
+
+        slot.hook = forward if hooks else None
+        ydl.params['retry_sleep_functions'] = ydl_opts.get('retry_sleep_functions') or {}
+        if ydl_opts.get('outtmpl'):
+            ydl.params['outtmpl'] = {'default': ydl_opts['outtmpl']}
+            ydl._parse_outtmpl()
+        try:
+            yield ydl
+        finally:
+            slot.hook = None
+            ydl.params['retry_sleep_functions'] = {}
+            self._release(key, entry)
+
+    def _release(self, key, entry):
+        evicted = []
+        with self._lock:
+            self._idle.setdefault(key, []).append(entry)
+            self._idle.move_to_end(key)
+            self._idle_count += 1
+            while self._idle_count > self.max_idle:
+                oldest = next(iter(self._idle))
+                bucket = self._idle[oldest]
+                evicted.append(bucket.pop(0))
+                self._idle_count -= 1
+                if not bucket:
+                    del self._idle[oldest]
+        for ydl, _ in evicted:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            entries = [e for bucket in self._idle.values() for e in bucket]
+            self._idle.clear()
+            self._idle_count = 0
+        for ydl, _ in entries:
+            try:
+                ydl.close()
+            except Exception:
+                pass
+
+
+class MetadataService:
+    """Cached, de-duplicated access to yt-dlp's extract_info"""
+
+    EXTRACT_OPTS = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+        'extract_flat': 'in_playlist',
+        'noplaylist': True,
+    }
+
+    def __init__(self, cache=None, pool=None, prefetch_workers=PREFETCH_WORKERS):
+        self.cache = cache
+        self.pool = pool or YoutubeDLPool()
+        self.prefetch_workers = prefetch_workers
+        self._flights = SingleFlight()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(url):
+        return canonical_url(url)
+
+    def extract(self, url, refresh=False, on_entries=None):
+        """Return the (JSON-safe) info dict for url, from cache when fresh.
+
+        Playlists and channels are only enumerated flat: their info holds
+        compact entries (see playlist_entry) that are fully extracted when
+        downloaded. If given, on_entries(header, batch) receives entries as
+        they are enumerated.
+        """
+        key = self.cache_key(url)
+        if self.cache and not refresh:
+            info = self.cache.get(key)
+            if info is not None:
+                return info
+        # Entries go to every caller of the flight, not just to the one that started it
+        return self._flights.do(key, functools.partial(self._extract, url), listener=on_entries)
+
+    def prefetch(self, urls, on_result):
+        """Resolve urls concurrently on a bounded pool and return their futures.
+
+        on_result(url, info, error) is called from the pool as each URL
+        resolves; the results land in the cache for the download to reuse.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.prefetch_workers, thread_name_prefix='prefetch')
+
+        def resolve(url):
+            info, error = None, None
+            try:
+                info = self.extract(url)
+            except Exception as e:
+                error = e
+            on_result(url, info, error)
+            return info
+
+        return [self._executor.submit(resolve, url) for url in urls]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def lookup(self, url):
+        """Return a cached info dict without extracting, or None"""
+        if not self.cache:
+            return None
+        return self.cache.get(self.cache_key(url))
+
+    def warm_up(self):
+        """Build (and pool) the YoutubeDL used for lookups ahead of the first one"""
+        with self.pool.acquire(self.EXTRACT_OPTS):
+            pass
+
+    @staticmethod
+    def extract_raw(ydl, url):
+        """Unprocessed info for url, following redirects to other extractors.
+
+        process=False returns before entries are resolved or formats
+        sorted; a playlist's entries are enumerated lazily as they are read.
+        """
+        raw = ydl.extract_info(url, download=False, process=False)
+        for _ in range(5):
+            if not raw or raw.get('_type') not in ('url', 'url_transparent'):
+                break
+            raw = ydl.extract_info(raw['url'], download=False, process=False, ie_key=raw.get('ie_key'))
+        return raw
+
+    def _extract(self, url, on_entries):
+        with self.pool.acquire(self.EXTRACT_OPTS) as ydl:
+            raw = self.extract_raw(ydl, url)
+            if raw and raw.get('_type') in PLAYLIST_TYPES:
+                info = self._stream_entries(ydl, raw, on_entries)
+            else:
+                info = ydl.sanitize_info(ydl.process_ie_result(raw, download=False))
+        self.store(url, info)
+        return info
+
+    @staticmethod
+    def _stream_entries(ydl, raw, on_entries):
+        header = ydl.sanitize_info({k: v for k, v in raw.items() if k != 'entries'})
+        entries = []
+        batch = []
+        flushed = time.monotonic()
+        for entry in raw.get('entries') or []:
+            compact = playlist_entry(entry)
+            if compact is None:
+                continue
+            entries.append(compact)
+            batch.append(compact)
+            # First entry goes out immediately, then every batch or 0.25s
+            if on_entries and (len(entries) == 1 or len(batch) >= PLAYLIST_BATCH_SIZE
+                               or time.monotonic() - flushed > 0.25):
+                on_entries(header, batch)
+                batch = []
+                flushed = time.monotonic()
+        if on_entries and batch:
+            on_entries(header, batch)
+        header['entries'] = entries
+        return header
+
+    def store(self, url, info):
+        if not self.cache or not info:
+            return
+        aliases = []
+        if info.get('webpage_url'):
+            aliases.append(self.cache_key(info['webpage_url']))
+        if info.get('extractor_key') and info.get('id'):
+            aliases.append(f"{info['extractor_key']}:{info['id']}")
+        self.cache.put(self.cache_key(url), info, aliases)
+
+
+class ThumbnailLoader:
+    """Background thumbnail loader backed by a disk cache of downscaled images.
+
+    Downscaled thumbnails are stored content-addressed (named by the hash of
+    their bytes) with a small per-URL reference file pointing at the blob,
+    so identical thumbnails behind different URLs are stored once.
+    """
+
+    def __init__(self, directory, size=THUMBNAIL_SIZE, workers=2):
+        self.directory = Path(directory)
+        self.size = size
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        except OSError:
+            pass
+
+    def load(self, url, callback):
+        """Fetch url in the background and call callback(image or None) from the worker"""
+        self._executor.submit(self._load, url, callback)
+
+    def _load(self, url, callback):
+        try:
+            img = self._cached(url) or self._fetch(url)
+        except Exception:
+            img = None
+        callback(img)
+
+    def _ref_path(self, url):
+        return self.directory / (hashlib.sha1(url.encode('utf-8')).hexdigest() + '.ref')
+
+    def _cached(self, url):
+        from PIL import Image
+        try:
+            blob = self.directory / self._ref_path(url).read_text(encoding='utf-8').strip()
+            img = Image.open(blob)
+            img.load()
+            return img
+        except Exception:
+            return None
+
+    def _fetch(self, url):
+        from PIL import Image
+        with urllib.request.urlopen(url, timeout=10) as response:
+            img = Image.open(io.BytesIO(response.read()))
+        # JPEG can decode straight at 1/2..1/8 scale, skipping most of the IDCT work
+        if img.format == 'JPEG':
+            img.draft('RGB', self.size)
+        img = img.convert('RGB').resize(self.size, Image.Resampling.LANCZOS)
+
+        buf = io.BytesIO()
+        img.save(buf, format='JPEG', quality=90)
+        data = buf.getvalue()
+        name = hashlib.sha256(data).hexdigest() + '.jpg'
+        try:
+            blob = self.directory / name
+            if not blob.exists():
+                tmp = blob.with_suffix('.tmp')
+                tmp.write_bytes(data)
+                os.replace(tmp, blob)
+            self._ref_path(url).write_text(name, encoding='utf-8')
+        except OSError:
+            pass
+        return img
+
+
+class HistoryStore:
+    """Download history in SQLite (WAL mode), indexed by url, time, status and format.
+
+    Each entry is a single INSERT, so writes cost the same regardless of how
+    much history exists, and concurrent downloads cannot lose each other's
+    records. Entries from the legacy JSON history file are imported once.
+    """
+
+    COLUMNS = ('url', 'time', 'status', 'path', 'format', 'quality', 'error')
+
+    def __init__(self, path, legacy_path=None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                time INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                path TEXT,
+                format TEXT,
+                quality TEXT,
+                error TEXT,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS history_url ON history (url);
+            CREATE INDEX IF NOT EXISTS history_time ON history (time);
+            CREATE INDEX IF NOT EXISTS history_status ON history (status, time);
+            CREATE INDEX IF NOT EXISTS history_format ON history (format, time);
+        ''')
+        if legacy_path:
+            self._import_legacy(Path(legacy_path))
+
+    def _import_legacy(self, legacy_path):
+        if not legacy_path.exists():
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            if not isinstance(entries, list):
+                return
+            # Legacy file is newest-first; insert oldest-first so ids follow time.
+            # The connection context commits, or rolls back if the import fails
+            with self._lock, self._conn:
+                self._conn.execute('BEGIN')
+                for entry in reversed(entries):
+                    try:
+                        self._insert(entry)
+                    except Exception:
+                        # Skip malformed entries (not a dict, non-numeric time, ...)
+                        pass
+            legacy_path.replace(legacy_path.with_suffix('.json.bak'))
+        except Exception:
+            pass
+
+    def _insert(self, entry):
+        extra = {k: v for k, v in entry.items() if k not in self.COLUMNS}
+        return self._conn.execute(
+            'INSERT INTO history (url, time, status, path, format, quality, error, extra) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                entry.get('url', ''),
+                int(entry.get('time') or time.time()),
+                entry.get('status', 'unknown'),
+                entry.get('path'),
+                entry.get('format'),
+                entry.get('quality'),
+                entry.get('error'),
+                json.dumps(extra) if extra else None,
+            )
+        ).lastrowid
+
+    def add(self, entry):
+        """Append one entry and return its id"""
+        with self._lock:
+            return self._insert(entry)
+
+    @staticmethod
+    def _to_dict(row):
+        entry = {k: row[k] for k in ('id',) + HistoryStore.COLUMNS if row[k] is not None}
+        if row['extra']:
+            entry.update(json.loads(row['extra']))
+        return entry
+
+    @staticmethod
+    def _where(url=None, status=None, format=None, since=None, until=None):
+        clauses = []
+        params = []
+        if url:
+            clauses.append("url LIKE ? ESCAPE '\\'")
+            escaped = url.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f'%{escaped}%')
+        if status:
+            clauses.append('status = ?')
+            params.append(status)
+        if format:
+            clauses.append('format = ?')
+            params.append(format)
+        if since is not None:
+            clauses.append('time >= ?')
+            params.append(int(since))
+        if until is not None:
+            clauses.append('time < ?')
+            params.append(int(until))
+        return clauses, params
+
+    def query(self, limit=200, before=None, **filters):
+        """Newest-first page of entries matching filters.
+
+        Filters: url (substring), status, format, since/until (epoch seconds).
+        Pass the (time, id) of the last entry of a page as `before` to get
+        the next one; keyset paging keeps deep pages as cheap as the first.
+        """
+        clauses, params = self._where(**filters)
+        if before is not None:
+            clauses.append('(time < ? OR (time = ? AND id < ?))')
+            params.extend([before[0], before[0], before[1]])
+        sql = 'SELECT * FROM history'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY time DESC, id DESC LIMIT ?'
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit]).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def count(self, **filters):
+        clauses, params = self._where(**filters)
+        sql = 'SELECT COUNT(*) FROM history'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM history')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _try_lock(f):
+    """Take a non-blocking exclusive OS lock on open file f; False if another process holds it"""
+    try:
+        f.seek(0)
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class JobJournal:
+    """Crash-safe record of queued jobs and their resolved options.
+
+    Every job is written before it is handed to the scheduler and its state
+    (pending, running, done, failed, discarded) is updated as it moves on.
+    The app, batch mode and the daemon share the journal, so each row
+    records the process that owns it; that process holds a lock on its
+    owner file for as long as it runs. Jobs still pending or running whose
+    owner is gone were interrupted by a crash or shutdown; resubmitting
+    them with the same options resumes their .part files.
+    """
+
+    UNFINISHED = ('pending', 'running')
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL,
+                title TEXT,
+                options TEXT NOT NULL,
+                state TEXT NOT NULL,
+                error TEXT,
+                created INTEGER NOT NULL,
+                updated INTEGER NOT NULL,
+                owner TEXT
+            );
+            CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+        ''')
+        if 'owner' not in {r['name'] for r in self._conn.execute('PRAGMA table_info(jobs)')}:
+            try:
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+            except sqlite3.OperationalError:
+                pass  # added by another process meanwhile
+        self.owners_dir = Path(str(self.path) + '.owners')
+        self.owners_dir.mkdir(parents=True, exist_ok=True)
+        self.owner = f'{os.getpid()}-{os.urandom(4).hex()}'
+        self._owner_file = open(self.owners_dir / f'{self.owner}.lock', 'w')
+        _try_lock(self._owner_file)
+
+    def _owner_alive(self, owner):
+        """Whether the process that journaled as owner still runs; forgets it if not"""
+        if owner is None:
+            return False
+        path = self.owners_dir / f'{owner}.lock'
+        try:
+            with open(path, 'a') as f:
+                if not _try_lock(f):
+                    return True
+        except OSError:
+            return False
+        try:
+            path.unlink()
+        except OSError:
+            pass
+        return False
+
+    def add(self, jobs):
+        """Journal new jobs (in one transaction) and tag them with their row id"""
+        now = int(time.time())
+        with self._lock:
+            self._conn.execute('BEGIN')
+            for job in jobs:
+                if job.journal_id is not None:
+                    continue
+                job.journal_id = self._conn.execute(
+                    'INSERT INTO jobs (url, title, options, state, created, updated, owner) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (job.url, job.title, json.dumps(job.options), job.status, now, now, self.owner)
+                ).lastrowid
+            self._conn.execute('COMMIT')
+
+    def update(self, job):
+        if job.journal_id is None:
+            return
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated = ? WHERE id = ?',
+                (job.status, job.error, int(time.time()), job.journal_id)
+            )
+
+    def unfinished(self):
+        """Jobs that were queued or running when their process ended.
+
+        Rows of processes that are still running are left alone. The rest
+        are taken over by this process, so two new ones never both resume them.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            rows = self._conn.execute(
+                'SELECT * FROM jobs WHERE state IN (?, ?) AND owner IS NOT ? ORDER BY id',
+                self.UNFINISHED + (self.owner,)
+            ).fetchall()
+            alive = {owner: self._owner_alive(owner) for owner in {r['owner'] for r in rows}}
+            rows = [r for r in rows if not alive[r['owner']]]
+            self._conn.executemany('UPDATE jobs SET owner = ? WHERE id = ?', [(self.owner, r['id']) for r in rows])
+        return [
+            {'id': r['id'], 'url': r['url'], 'title': r['title'], 'options': json.loads(r['options'])}
+            for r in rows
+        ]
+
+    def discard(self, ids):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET state = 'discarded', updated = ? WHERE id = ?",
+                [(int(time.time()), i) for i in ids]
+            )
+
+    def prune(self, max_age=QUEUE_RETENTION):
+        """Forget finished jobs older than max_age seconds, and the owner
+        files left by crashed processes that journaled nothing unfinished"""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM jobs WHERE state NOT IN (?, ?) AND updated < ?',
+                self.UNFINISHED + (int(time.time() - max_age),)
+            )
+            owners = {r[0] for r in self._conn.execute(
+                'SELECT DISTINCT owner FROM jobs WHERE state IN (?, ?)', self.UNFINISHED)}
+        try:
+            stale = [p for p in self.owners_dir.glob('*.lock')
+                     if p.stem not in owners and time.time() - p.stat().st_mtime > 3600]
+        except OSError:
+            stale = []
+        for path in stale:
+            self._owner_alive(path.stem)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        self._owner_file.close()
+        try:
+            (self.owners_dir / f'{self.owner}.lock').unlink()
+        except OSError:
+            pass
+
+
+class DownloadArchive:
+    """Persistent set of downloaded items, keyed like yt-dlp's download archive.
+
+    Keys live in a WITHOUT ROWID primary-key table: a lookup is a single
+    index probe whether the archive holds ten entries or millions, and
+    nothing is loaded into memory up front.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS archive (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                title TEXT,
+                time INTEGER NOT NULL
+            ) WITHOUT ROWID
+        ''')
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM archive WHERE key = ?', (key,)).fetchone() is not None
+
+    def add(self, keys, url=None, title=None):
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO archive (key, url, title, time) VALUES (?, ?, ?, ?)',
+                [(key, url, title, now) for key in keys]
+            )
+
+    def remove(self, keys):
+        with self._lock:
+            self._conn.executemany('DELETE FROM archive WHERE key = ?', [(key,) for key in keys])
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM archive').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SubscriptionStore:
+    """Subscribed channels and playlists with their sync state.
+
+    Each subscription keeps the download options to use for its new items,
+    the IDs (and newest upload date) of the items already seen, and the
+    validators of its feed for conditional requests.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                title TEXT,
+                options TEXT NOT NULL,
+                interval INTEGER NOT NULL,
+                backlog INTEGER NOT NULL DEFAULT 0,
+                known_ids TEXT NOT NULL DEFAULT '[]',
+                last_upload TEXT,
+                feed_url TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                last_sync INTEGER,
+                error TEXT,
+                created INTEGER NOT NULL
+            );
+        ''')
+
+    @staticmethod
+    def _to_dict(row):
+        sub = dict(row)
+        sub['options'] = json.loads(sub['options'])
+        sub['known_ids'] = json.loads(sub['known_ids'])
+        return sub
+
+    def add(self, url, options, interval=SUBSCRIPTION_INTERVAL, title=None, backlog=0, known_ids=()):
+        """Subscribe to url (or update the options and interval of an existing
+        subscription) and return it.
+
+        known_ids are items already listed elsewhere, which are not new; the
+        first sync of a subscription without any only records what is there,
+        downloading the `backlog` newest items.
+        """
+        url = subscription_url(url)
+        known_ids = list(known_ids)
+        if is_newest_first(url):
+            known_ids = known_ids[:SUBSCRIPTION_KNOWN_IDS]
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO subscriptions (url, title, options, interval, backlog, known_ids, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (url) DO UPDATE SET '
+                'options = excluded.options, interval = excluded.interval, title = COALESCE(title, excluded.title)',
+                (url, title, json.dumps(options), int(interval), int(backlog), json.dumps(known_ids),
+                 int(time.time()))
+            )
+        return self.get(url)
+
+    def remove(self, key):
+        """Unsubscribe by id or URL; False if there was no such subscription"""
+        with self._lock:
+            if str(key).isdigit():
+                cursor = self._conn.execute('DELETE FROM subscriptions WHERE id = ?', (int(key),))
+            else:
+                cursor = self._conn.execute('DELETE FROM subscriptions WHERE url = ?', (subscription_url(key),))
+        return cursor.rowcount > 0
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM subscriptions WHERE url = ?', (subscription_url(url),)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def all(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM subscriptions ORDER BY id').fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def due(self, now=None):
+        """Subscriptions whose interval has passed since their last sync"""
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM subscriptions WHERE last_sync IS NULL OR last_sync + interval <= ? ORDER BY id',
+                (now,)
+            ).fetchall()
+        return [self._to_dict(r) for r in rows]
+
+    def save(self, sub):
+        """Store the sync state of a subscription"""
+        with self._lock:
+            self._conn.execute(
+                'UPDATE subscriptions SET title = ?, known_ids = ?, last_upload = ?, feed_url = ?, etag = ?, '
+                'last_modified = ?, last_sync = ?, error = ? WHERE id = ?',
+                (sub['title'], json.dumps(sub['known_ids']), sub['last_upload'], sub['feed_url'], sub['etag'],
+                 sub['last_modified'], sub['last_sync'], sub['error'], sub['id'])
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SubscriptionSync:
+    """Finds the items added to subscribed channels and playlists since their
+    last sync, touching as little of each list as possible.
+
+    Newest-first lists are read lazily and only up to the first item
+    already seen; YouTube channels are first asked for their Atom feed with
+    a conditional request, which is usually answered 304 or only holds
+    known items. Lists in playlist order are enumerated flat and known
+    items skipped.
+    """
+
+    FEED_NS = {'atom': 'http://www.w3.org/2005/Atom', 'yt': 'http://www.youtube.com/xml/schemas/2015'}
+
+    def __init__(self, store, pool, workers=SUBSCRIPTION_WORKERS):
+        self.store = store
+        self.pool = pool
+        self.workers = workers
+
+    def sync(self, subs):
+        """Sync subs concurrently and return [(subscription, new entries)],
+        oldest entry first; failures are recorded in the subscription's error"""
+        if not subs:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(self.workers, len(subs)), thread_name_prefix='subscriptions') as executor:
+            return list(zip(subs, executor.map(self._sync_one, subs)))
+
+    @staticmethod
+    def _key(entry):
+        return entry.get('id') or entry['url']
+
+    def _sync_one(self, sub):
+        newest_first = is_newest_first(sub['url'])
+        known = sub['known_ids']
+        entries, listed = None, []
+        try:
+            with self.pool.acquire(MetadataService.EXTRACT_OPTS) as ydl:
+                if known and sub['feed_url']:
+                    entries = self._check_feed(ydl, sub)
+                if entries is None:
+                    entries, listed = self._enumerate(ydl, sub, newest_first)
+        except Exception as e:
+            sub['error'], sub['last_sync'] = str(e), int(time.time())
+            self.store.save(sub)
+            return []
+        ids = [self._key(e) for e in entries]
+        if newest_first:
+            sub['known_ids'] = (ids + known)[:SUBSCRIPTION_KNOWN_IDS]
+            entries.reverse()
+        else:
+            # Everything listed now, plus the latest items that dropped out of
+            # the list (they may come back), so this does not grow forever
+            current = set(listed)
+            gone = [key for key in known if key not in current]
+            sub['known_ids'] = gone[-SUBSCRIPTION_KNOWN_IDS:] + listed
+        dates = [e['upload_date'] for e in entries if e.get('upload_date')]
+        if dates:
+            sub['last_upload'] = max(dates + [sub['last_upload'] or ''])
+        if not known:
+            # First sync: everything listed is the baseline
+            entries = entries[-sub['backlog']:] if sub['backlog'] else []
+        sub['error'], sub['last_sync'] = None, int(time.time())
+        self.store.save(sub)
+        return entries
+
+    def _enumerate(self, ydl, sub, newest_first):
+        """New entries of the list, and the keys of all entries listed in
+        playlist order (empty for newest-first lists, which are not read to the end)"""
+        # Subscriptions stored before watch?v=...&list=... links mapped to their playlist
+        raw = MetadataService.extract_raw(ydl, subscription_url(sub['url']))
+        if not raw or raw.get('_type') not in PLAYLIST_TYPES:
+            raise ValueError('Not a channel or playlist')
+        sub['title'] = sub['title'] or raw.get('title')
+        sub['feed_url'] = sub['feed_url'] or self._feed_url(sub['url'], raw)
+        known = set(sub['known_ids'])
+        limit = SUBSCRIPTION_MAX_NEW if known else SUBSCRIPTION_BASELINE
+        entries, listed = [], []
+        for entry in raw.get('entries') or []:
+            compact = playlist_entry(entry)
+            if compact is None:
+                continue
+            if not newest_first:
+                listed.append(self._key(compact))
+            if newest_first:
+                # Everything from here on was there at the last sync
+                if self._key(compact) in known:
+                    break
+                upload_date = entry.get('upload_date')
+                if upload_date and sub['last_upload'] and upload_date < sub['last_upload']:
+                    break
+            elif self._key(compact) in known:
+                continue
+            compact['upload_date'] = entry.get('upload_date')
+            entries.append(compact)
+            if newest_first and len(entries) >= limit:
+                break
+        return entries, listed
+
+    @staticmethod
+    def _feed_url(url, raw):
+        """Atom feed listing the newest items of a YouTube channel's Videos tab
+        or uploads playlist, or None"""
+        parts = urllib.parse.urlsplit(url)
+        if parts.netloc != 'youtube.com':
+            return None
+        list_id = urllib.parse.parse_qs(parts.query).get('list', [''])[0]
+        if list_id.startswith('UU'):
+            return f'{YOUTUBE_FEED_URL}?playlist_id={list_id}'
+        if parts.path.endswith('/videos') and raw.get('channel_id'):
+            return f"{YOUTUBE_FEED_URL}?channel_id={raw['channel_id']}"
+        return None
+
+    def _check_feed(self, ydl, sub):
+        """New entries according to the subscription's feed, or None when the
+        feed cannot tell (unavailable, or it holds no item seen before)"""
+        import xml.etree.ElementTree as ElementTree
+        from yt_dlp.networking import Request
+        from yt_dlp.networking.exceptions import HTTPError
+        headers = {}
+        if sub['etag']:
+            headers['If-None-Match'] = sub['etag']
+        if sub['last_modified']:
+            headers['If-Modified-Since'] = sub['last_modified']
+        try:
+            with ydl.urlopen(Request(sub['feed_url'], headers=headers)) as response:
+                if response.status == 304:
+                    return []
+                body = response.read()
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+            root = ElementTree.fromstring(body)
+        except HTTPError as e:
+            return [] if e.status == 304 else None
+        except Exception:
+            return None
+        known = set(sub['known_ids'])
+        videos_tab = sub['url'].endswith('/videos')
+        entries = []
+        for item in root.iterfind('atom:entry', self.FEED_NS):
+            video_id = item.findtext('yt:videoId', namespaces=self.FEED_NS)
+            if video_id in known:
+                break
+            link = item.find('atom:link', self.FEED_NS)
+            url = link.get('href') if link is not None else f'https://www.youtube.com/watch?v={video_id}'
+            if videos_tab and '/shorts/' in url:
+                # The channel feed also lists Shorts, which the Videos tab does not
+                continue
+            published = item.findtext('atom:published', namespaces=self.FEED_NS) or ''
+            entries.append({
+                'url': url,
+                'id': video_id,
+                'title': item.findtext('atom:title', namespaces=self.FEED_NS),
+                'duration': None,
+                'ie_key': 'Youtube',
+                'upload_date': published[:10].replace('-', '') or None,
+            })
+        else:
+            # No item seen before: more may be new than the feed holds
+            return None
+        sub['etag'], sub['last_modified'] = etag, last_modified
+        return entries
+
+
+class JobSkipped(Exception):
+    """Raised by a job runner when a job needs no download (duplicate or archived)"""
+
+
+class JobCancelled(Exception):
+    """Raised from a cancelled job's progress hook to abort its transfer"""
+
+
+class JobRetry(Exception):
+    """Raised by a job runner when a failed job should run again after `delay` seconds"""
+
+    def __init__(self, message, delay):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobMetrics:
+    """Per-job timings (seconds per phase), transferred bytes and retries.
+
+    A job is in one phase at a time; entering a phase closes the previous
+    one. Phases are entered from whichever thread is working on the job.
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.phase = None
+        self.bytes = 0
+        self.retries = 0
+        self.info_reused = False  # download skipped extraction thanks to cached info
+        self.observed = False  # counted in DownloadMetrics
+        self.submitted = None
+        self.finished = None
+        self._since = None
+        self._lock = threading.Lock()
+
+    def enter(self, phase):
+        with self._lock:
+            if phase == self.phase:
+                return
+            now = time.monotonic()
+            if self.phase is not None:
+                self.phases[self.phase] = self.phases.get(self.phase, 0.0) + now - self._since
+            elif self.submitted is None:
+                self.submitted = now
+            self.phase, self._since = phase, now
+
+    def stop(self):
+        self.enter(None)
+        with self._lock:
+            if self.finished is None:
+                self.finished = time.monotonic()
+
+    def retry(self, n=0):
+        """Count one HTTP, fragment or extractor retry (see DownloadEngine._retry_sleep)"""
+        with self._lock:
+            self.retries += 1
+        return 0
+
+    @property
+    def total(self):
+        if self.submitted is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.submitted
+
+    def to_dict(self):
+        with self._lock:
+            phases = dict(self.phases)
+            if self.phase is not None:
+                phases[self.phase] = phases.get(self.phase, 0.0) + time.monotonic() - self._since
+        return {
+            'timings': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+            'total': round(self.total, 3),
+            'bytes': self.bytes,
+            'retries': self.retries,
+        }
+
+
+class DownloadJob:
+    """A single URL queued for download together with its resolved options"""
+    _ids = itertools.count(1)
+
+    def __init__(self, url, options, title=None):
+        self.id = next(DownloadJob._ids)
+        self.url = url
+        self.title = title
+        self.options = options
+        self.host = host_of(url)
+        self.status = 'pending'  # pending -> running -> done / failed / skipped / cancelled
+        self.progress = 0.0
+        self.phase = None  # downloading / processing while running
+        self.downloaded_bytes = 0
+        self.total_bytes = None
+        self.speed = None  # bytes per second
+        self.eta = None  # seconds
+        self.error = None
+        self.journal_id = None  # row in the queue journal once submitted
+        self.archive_key = None  # download-archive key, resolved when the job starts
+        self.cancelled = False  # set by DownloadEngine.cancel
+        self.attempts = 0  # failed attempts that were retried
+        self.retry_at = 0.0  # monotonic time before which a retried job waits
+        self.failure = None  # 'transient', 'rate_limited' or 'permanent' once an attempt failed
+        self.metrics = JobMetrics()
+
+    def to_dict(self):
+        """JSON-safe snapshot of the job's state (daemon API)"""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'title': self.title,
+            'status': self.status,
+            'phase': self.phase,
+            'progress': round(self.progress, 4),
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'speed': self.speed,
+            'eta': self.eta,
+            'error': self.error,
+            'failure': self.failure,
+            'attempts': self.attempts,
+        }
+
+    @property
+    def extractor(self):
+        """Extractor name for metrics, from the archive key ('generic' for plain URLs)"""
+        if not self.archive_key:
+            return 'unknown'
+        name = self.archive_key.split(' ', 1)[0]
+        return 'generic' if name == 'url' else name
+
+
+def parse_retry_after(value):
+    """Seconds a Retry-After header (delta or HTTP date) asks to wait, or None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        import email.utils
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), RETRY_MAX_DELAY)
+
+
+def _error_chain(error):
+    """The error and every exception it wraps (causes, contexts and the
+    originals kept by yt-dlp's DownloadError/ExtractorError)"""
+    seen, stack = set(), [error]
+    while stack:
+        e = stack.pop()
+        if not isinstance(e, BaseException) or id(e) in seen:
+            continue
+        seen.add(id(e))
+        yield e
+        exc_info = getattr(e, 'exc_info', None)
+        stack.extend([e.__context__, e.__cause__, getattr(e, 'cause', None),
+                      exc_info[1] if isinstance(exc_info, tuple) and len(exc_info) > 1 else None])
+
+
+def _status_kind(status):
+    if status == 429:
+        return 'rate_limited'
+    if status == 408 or status >= 500:
+        return 'transient'
+    return 'permanent'
+
+
+def classify_error(error):
+    """Sort a failure into 'transient', 'rate_limited' or 'permanent'.
+
+    Returns (kind, seconds the server asked to wait or None). HTTP statuses
+    and network exceptions anywhere in the chain decide; errors yt-dlp only
+    reports as text are recognised by their message. Anything else
+    (unavailable videos, unsupported URLs, FFmpeg or disk errors) is permanent.
+    """
+    import http.client
+    from yt_dlp.networking.exceptions import HTTPError, TransportError
+    from yt_dlp.utils import ContentTooShortError
+    network = False
+    for e in _error_chain(error):
+        if isinstance(e, (HTTPError, urllib.error.HTTPError)):
+            status = e.status if isinstance(e, HTTPError) else e.code
+            headers = e.response.headers if isinstance(e, HTTPError) else e.headers
+            retry_after = parse_retry_after(headers.get('Retry-After') if headers else None)
+            kind = _status_kind(status)
+            if status == 503 and retry_after is not None:
+                kind = 'rate_limited'
+            return kind, retry_after if kind != 'permanent' else None
+        if isinstance(e, (TransportError, ContentTooShortError, ConnectionError, TimeoutError,
+                          urllib.error.URLError, http.client.IncompleteRead)):
+            network = True
+    message = str(error).lower()
+    if any(text in message for text in RATE_LIMIT_MESSAGES):
+        return 'rate_limited', None
+    if network:
+        return 'transient', None
+    marker = message.find('http error ')
+    if marker >= 0 and message[marker + 11:marker + 14].isdigit():
+        return _status_kind(int(message[marker + 11:marker + 14])), None
+    if any(text in message for text in TRANSIENT_MESSAGES):
+        return 'transient', None
+    return 'permanent', None
+
+
+class RetryPolicy:
+    """Decides, per host, whether and when failed jobs run again.
+
+    Transient and rate-limited failures are retried up to `retries` times
+    after an exponential delay with jitter, or after the delay the server
+    asked for in Retry-After. A host that rate-limits, or fails `threshold`
+    times in a row, has its circuit opened: the scheduler parks its jobs
+    for a cooldown that doubles while it keeps failing. One success closes it.
+    """
+
+    def __init__(self, retries=JOB_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 threshold=CIRCUIT_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.retries = max(0, int(retries))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = collections.Counter()  # host -> consecutive retryable failures
+        self._trips = collections.Counter()  # host -> circuit openings since its last success
+        self._open_until = {}  # host -> monotonic time its circuit closes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def backoff(attempt, base, cap):
+        """Jittered exponential delay before retry number `attempt` (from 1)"""
+        delay = min(cap, base * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    def failed(self, job, error):
+        """Record a failed attempt of job; seconds until it should run again,
+        or None if it has failed for good"""
+        kind, retry_after = classify_error(error)
+        job.failure = kind
+        if kind == 'permanent':
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._failures[job.host] += 1
+            open_until = self._open_until.get(job.host, 0.0)
+            if open_until <= now and (kind == 'rate_limited' or self._failures[job.host] >= self.threshold):
+                cooldown = retry_after or min(self.max_delay, self.cooldown * 2 ** self._trips[job.host])
+                self._trips[job.host] += 1
+                self._open_until[job.host] = now + cooldown
+            elif retry_after:
+                self._open_until[job.host] = max(open_until, now + retry_after)
+        if job.attempts >= self.retries:
+            return None
+        job.attempts += 1
+        if retry_after is not None:
+            return retry_after
+        return self.backoff(job.attempts, self.base_delay, self.max_delay)
+
+    def succeeded(self, host):
+        with self._lock:
+            self._failures.pop(host, None)
+            self._trips.pop(host, None)
+            self._open_until.pop(host, None)
+
+    def blocked_until(self, host):
+        """Monotonic time until which host's jobs are parked (0 if they are not)"""
+        with self._lock:
+            return self._open_until.get(host, 0.0)
+
+    def open_hosts(self):
+        """{host: seconds until its circuit closes} for the hosts parked now"""
+        now = time.monotonic()
+        with self._lock:
+            return {host: until - now for host, until in self._open_until.items() if until > now}
+
+
+def failure_summary(jobs):
+    """Failed jobs grouped by host and error: [(host, kind, error, count)], most frequent first"""
+    counts = collections.Counter(
+        (job.host, job.failure or 'permanent', ((job.error or '').strip() or 'Unknown error').splitlines()[0])
+        for job in jobs if job.status == 'failed'
+    )
+    return [(host, kind, error, n) for (host, kind, error), n in counts.most_common()]
+
+
+class SegmentedDownload:
+    """Fetch one progressive HTTP file over several ranged connections.
+
+    The file is split into equal byte ranges that are fetched in parallel
+    and written in place at their offsets in the .part file. Each range
+    retries on its own and its progress is checkpointed to a sidecar
+    .segments file, so an interrupted download resumes every range where it
+    stopped. Requests go through ydl.urlopen (proxies, cookies, pooled
+    connections of the pooled YoutubeDL instance).
+    """
+
+    def __init__(self, fd, filename, info_dict):
+        self.fd = fd
+        self.filename = filename
+        self.info = info_dict
+        self.url = info_dict['url']
+        self.headers = dict(info_dict.get('http_headers') or {})
+        self.connections = int(fd.params.get('http_connections') or 1)
+        # Sites such as YouTube throttle long ranges; keep their chunking
+        self.chunk_size = (info_dict.get('downloader_options') or {}).get('http_chunk_size') or 0
+        self.tmpfilename = fd.temp_name(filename)
+        self.state_path = self.tmpfilename + '.segments'
+        self.total = None
+        self.segments = []  # [start, end (inclusive), bytes done]
+        self.downloaded = 0
+        self._lock = threading.Lock()
+        self._hook_lock = threading.Lock()
+        self._abort = threading.Event()
+        self._last_checkpoint = 0.0
+
+    def _request(self, start, end):
+        from yt_dlp.networking import Request
+        return self.fd.ydl.urlopen(Request(self.url, headers={**self.headers, 'Range': f'bytes={start}-{end}'}))
+
+    @property
+    def splittable(self):
+        return self.connections >= 2 and self.filename != '-' and self.tmpfilename != self.filename and not self.fd.params.get('test')
+
+    def probe(self):
+        """Check that the server honours ranges and the file is worth splitting"""
+        # Files the extractor already reports as small are not worth a request
+        size = self.info.get('filesize') or self.info.get('filesize_approx')
+        if not self.splittable or (size and size < 2 * SEGMENT_MIN_SIZE):
+            return False
+        try:
+            response = self._request(0, 0)
+            try:
+                content_range = response.headers.get('Content-Range') or ''
+                if response.status != 206 or '/' not in content_range:
+                    return False
+                self.total = int(content_range.rsplit('/', 1)[1])
+            finally:
+                response.close()
+        except Exception:
+            # Let the plain downloader handle (and report) the URL
+            return False
+        return self.total >= 2 * SEGMENT_MIN_SIZE
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state['total'] != self.total or os.path.getsize(self.tmpfilename) != self.total:
+                return False
+            self.segments = [list(s) for s in state['segments']]
+            return True
+        except Exception:
+            return False
+
+    def _save_state(self):
+        with self._lock:
+            state = {'total': self.total, 'segments': [list(s) for s in self.segments]}
+        tmp = self.state_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def _plan(self):
+        count = max(1, min(self.connections, self.total // SEGMENT_MIN_SIZE))
+        size = -(-self.total // count)
+        # A .part left by the single-connection downloader holds a valid prefix
+        existing = 0
+        if self.fd.params.get('continuedl', True) and os.path.isfile(self.tmpfilename):
+            existing = min(os.path.getsize(self.tmpfilename), self.total)
+        self.segments = []
+        for start in range(0, self.total, size):
+            end = min(start + size, self.total) - 1
+            self.segments.append([start, end, max(0, min(existing - start, end - start + 1))])
+        with open(self.tmpfilename, 'r+b' if os.path.isfile(self.tmpfilename) else 'wb') as f:
+            f.truncate(self.total)
+
+    def run(self):
+        resumed = self.fd.params.get('continuedl', True) and self._load_state()
+        if not resumed:
+            self._plan()
+        self.downloaded = self.resumed_bytes = sum(s[2] for s in self.segments)
+        if self.resumed_bytes:
+            self.fd.report_resuming_byte(self.resumed_bytes)
+        self.start_time = time.time()
+        self._save_state()
+
+        todo = [s for s in self.segments if s[2] < s[1] - s[0] + 1]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(todo) or 1, thread_name_prefix='segment') as pool:
+            futures = [pool.submit(self._fetch, segment) for segment in todo]
+            errors = [f.exception() for f in futures]
+        errors = [e for e in errors if e is not None]
+        self._save_state()
+        if errors:
+            try:
+                raise errors[0]
+            except Exception as e:
+                # Reported with the original error attached, for RetryPolicy
+                self.fd.report_error(f'unable to download video data: {e}')
+            return False
+
+        self.fd.try_rename(self.tmpfilename, self.filename)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        self.fd._hook_progress({
+            'downloaded_bytes': self.total,
+            'total_bytes': self.total,
+            'filename': self.filename,
+            'status': 'finished',
+            'elapsed': time.time() - self.start_time,
+            'ctx_id': self.info.get('ctx_id'),
+        }, self.info)
+        return True
+
+    def _fetch(self, segment):
+        """Download one range, retrying from its last written byte"""
+        from yt_dlp.networking.exceptions import HTTPError, RequestError
+        from yt_dlp.utils import ContentTooShortError
+        retries = self.fd.params.get('retries', 10)
+        attempt = 0
+        with open(self.tmpfilename, 'r+b') as f:
+            while segment[2] < segment[1] - segment[0] + 1:
+                if self._abort.is_set():
+                    return
+                start = segment[0] + segment[2]
+                end = segment[1] if not self.chunk_size else min(segment[1], start + self.chunk_size - 1)
+                try:
+                    response = self._request(start, end)
+                    try:
+                        if response.status != 206:
+                            raise RequestError(f'server ignored the byte range (HTTP {response.status})')
+                        f.seek(start)
+                        position = start
+                        while position <= end:
+                            block = response.read(min(SEGMENT_BLOCK_SIZE, end - position + 1))
+                            if not block:
+                                break
+                            f.write(block)
+                            position += len(block)
+                            self._advance(segment, len(block))
+                            if self._abort.is_set():
+                                return
+                    finally:
+                        response.close()
+                    if position <= end:
+                        raise ContentTooShortError(position - start, end - start + 1)
+                    attempt = 0
+                except (RequestError, OSError, ContentTooShortError) as e:
+                    permanent = isinstance(e, HTTPError) and 400 <= e.status < 500 and e.status not in (408, 429)
+                    attempt += 1
+                    if permanent or attempt > retries:
+                        self._abort.set()
+                        raise
+                    # Sleeps through retry_sleep_functions (the engine's backoff and retry count)
+                    self.fd.report_retry(e, attempt, retries, fatal=False)
+                except Exception:
+                    # e.g. a cancelled job's progress hook: stop the other ranges too
+                    self._abort.set()
+                    raise
+
+    def _advance(self, segment, size):
+        with self._lock:
+            segment[2] += size
+            self.downloaded += size
+            now = time.time()
+            checkpoint = now - self._last_checkpoint >= SEGMENT_CHECKPOINT_INTERVAL
+            if checkpoint:
+                self._last_checkpoint = now
+        if checkpoint:
+            self._save_state()
+        # Hooks see a monotonic byte count, one at a time; bandwidth waits
+        # happen after the lock is released so other ranges keep reporting
+        with self._hook_lock:
+            with self._lock:
+                downloaded = self.downloaded
+            now = time.time()
+            speed = self.fd.calc_speed(self.start_time, now, downloaded - self.resumed_bytes)
+            status = {
+                'status': 'downloading',
+                'downloaded_bytes': downloaded,
+                'total_bytes': self.total,
+                'tmpfilename': self.tmpfilename,
+                'filename': self.filename,
+                'eta': self.fd.calc_eta(speed, self.total - downloaded) if speed else None,
+                'speed': speed,
+                'elapsed': now - self.start_time,
+                'ctx_id': self.info.get('ctx_id'),
+                'defer_throttle': True,
+            }
+            self.fd._hook_progress(status, self.info)
+        throttle = status.get('throttle')
+        if throttle:
+            throttle()
+
+
+_SEGMENTED_INSTALLED = False
+
+
+def install_segmented_downloader():
+    """Route yt-dlp's progressive HTTP downloads through SegmentedDownload"""
+    global _SEGMENTED_INSTALLED
+    if _SEGMENTED_INSTALLED:
+        return
+    from yt_dlp import downloader
+    from yt_dlp.downloader.http import HttpFD
+
+    class LargeFile(Exception):
+        pass
+
+    class SegmentedHttpFD(HttpFD):
+        _watch = False
+
+        def real_download(self, filename, info_dict):
+            segmented = SegmentedDownload(self, filename, info_dict)
+            known = info_dict.get('filesize') or info_dict.get('filesize_approx') or os.path.exists(segmented.state_path)
+            if segmented.splittable and not known:
+                # Don't delay the first byte with a probe: start plainly and
+                # switch over once the response turns out to be large
+                self._watch = True
+                try:
+                    return super().real_download(filename, info_dict)
+                except LargeFile:
+                    pass
+                finally:
+                    self._watch = False
+            if segmented.probe():
+                return segmented.run()
+            if os.path.exists(segmented.state_path):
+                # The .part of an unfinished segmented download is not a valid prefix
+                for path in (segmented.tmpfilename, segmented.state_path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            return super().real_download(filename, info_dict)
+
+        def _hook_progress(self, status, info_dict):
+            if self._watch and status.get('status') == 'downloading':
+                # The first block decides; what was written is a valid prefix
+                self._watch = False
+                if (status.get('total_bytes') or 0) >= 2 * SEGMENT_MIN_SIZE:
+                    raise LargeFile()
+            return super()._hook_progress(status, info_dict)
+
+    for protocol in ('http', 'https'):
+        downloader.PROTOCOL_MAP.setdefault(protocol, SegmentedHttpFD)
+    _SEGMENTED_INSTALLED = True
+
+
+@contextlib.contextmanager
+def deferred_postprocessing(ydl, everything=False):
+    """Collect ydl's FFmpeg postprocessing instead of running it inline.
+
+    Yields a list that receives one callable per downloaded file; calling it
+    runs the merge / conversion / fixups yt-dlp would have run right after
+    the transfer and returns the file's final info dict. Files with nothing
+    to postprocess are finished inline unless `everything` is set.
+    """
+    pending = []
+    post_process = type(ydl).post_process
+
+    def capture(filename, info, files_to_move=None):
+        if not (everything or info.get('__postprocessors') or ydl._pps['post_process']):
+            return post_process(ydl, filename, info, files_to_move)
+        info['filepath'] = filename
+        pending.append(functools.partial(post_process, ydl, filename, info, files_to_move))
+        return info
+
+    ydl.post_process = capture
+    try:
+        yield pending
+    finally:
+        del ydl.post_process
+
+
+class PostprocessStage:
+    """Bounded pool for postprocessing, fed by the download workers.
+
+    submit() blocks while the pool is busy and `queue_size` items are
+    already waiting, so finished transfers hold the download workers back
+    (backpressure) instead of piling up unprocessed files.
+    """
+
+    def __init__(self, workers=POSTPROCESS_WORKERS, queue_size=POSTPROCESS_QUEUE):
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='postprocess')
+
+    def submit(self, fn):
+        """Queue fn and return its future, waiting for room first"""
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def download_job(ydl, job, metadata=None):
+    """Download a job and return its final info dict.
+
+    A fresh info dict from the metadata cache (put there by Search or an
+    earlier download) is fed straight into format selection, skipping the
+    extractor round-trip.
+    Stale or rejected signed URLs fall back to a normal extraction.
+    """
+    import yt_dlp
+    info = metadata.lookup(job.url) if metadata is not None else None
+    if info is not None and info.get('_type', 'video') == 'video' and info_is_fresh(info):
+        try:
+            info = ydl.process_ie_result(ydl.sanitize_info(info, remove_private_keys=True), download=True)
+            job.metrics.info_reused = True
+            return info
+        except yt_dlp.utils.DownloadError as e:
+            # Expired signatures surface as HTTP 4xx; anything else is a real failure
+            if 'HTTP Error 4' not in str(e):
+                raise
+
+    info = ydl.extract_info(job.url, download=True)
+    if metadata is not None:
+        # Keep the metadata cache warm for later searches / re-runs
+        metadata.store(job.url, ydl.sanitize_info(info))
+    return info
+
+
+def parse_clock(text):
+    """'HH:MM' -> minutes after midnight"""
+    hours, _, minutes = text.strip().partition(':')
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(f"Invalid time of day: {text}")
+    return value
+
+
+def parse_limit(value):
+    """Mbit/s (number or string, 'unlimited'/0/None for no limit) -> bytes/s or None"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().lower().replace('mbit/s', '').replace('mbps', '').strip()
+        if value in ('', 'unlimited', 'none', 'off'):
+            return None
+    mbps = float(value)
+    if mbps < 0:
+        raise ValueError(f"Invalid bandwidth limit: {value}")
+    return mbps * 1_000_000 / 8 if mbps else None
+
+
+class BandwidthSchedule:
+    """Time-of-day bandwidth limits.
+
+    `windows` is a list of (start_minute, end_minute, bytes_per_second or
+    None); a window may wrap past midnight. Outside every window `default`
+    applies. Configured as, e.g.:
+
+        "bandwidth_limit": null,
+        "bandwidth_schedule": [{"start": "08:00", "end": "20:00", "limit": 20}]
+    """
+
+    def __init__(self, default=None, windows=()):
+        self.default = default
+        self.windows = list(windows)
+
+    @classmethod
+    def from_config(cls, config):
+        windows = []
+        for window in config.get('bandwidth_schedule') or []:
+            try:
+                windows.append((
+                    parse_clock(window['start']),
+                    parse_clock(window['end']),
+                    parse_limit(window.get('limit'))
+                ))
+            except Exception:
+                pass
+        try:
+            default = parse_limit(config.get('bandwidth_limit'))
+        except Exception:
+            default = None
+        return cls(default, windows)
+
+    @staticmethod
+    def parse_window(text):
+        """'HH:MM-HH:MM=MBPS' (command line form) -> schedule window"""
+        span, _, limit = text.partition('=')
+        start, _, end = span.partition('-')
+        if not limit or not end:
+            raise ValueError(f"Invalid schedule window: {text} (expected HH:MM-HH:MM=MBPS)")
+        return (parse_clock(start), parse_clock(end), parse_limit(limit))
+
+    def limit_at(self, now=None):
+        """Bytes/s allowed at the given time, None when unlimited"""
+        local = time.localtime(now)
+        minute = local.tm_hour * 60 + local.tm_min
+        for start, end, limit in self.windows:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return limit
+        return self.default
+
+
+class BandwidthLimiter:
+    """Global bandwidth budget split fairly across transferring jobs.
+
+    Each job owns a token bucket refilled at limit / active_jobs, where a
+    job counts as active while it keeps transferring; the share is
+    recomputed on every chunk, so jobs starting, finishing or stalling
+    (extraction, merging) re-balance the others straight away. Workers call
+    throttle() from their progress hook and sleep off any deficit.
+    """
+
+    def __init__(self, schedule=None):
+        self.schedule = schedule or BandwidthSchedule()
+        self._lock = threading.Lock()
+        self._jobs = {}  # job id -> [tokens, last refill, last transfer, bytes seen]
+
+    def set_schedule(self, schedule):
+        with self._lock:
+            self.schedule = schedule
+
+    def start(self, job):
+        with self._lock:
+            self._jobs[job.id] = [0.0, time.monotonic(), 0.0, 0]
+
+    def finish(self, job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def throttle(self, job, downloaded_bytes, wait=True):
+        """Account for a job's cumulative byte count and block while it is over
+        its share (unless `wait` is False; the caller then calls wait() itself)"""
+        with self._lock:
+            state = self._jobs.get(job.id)
+            if state is None:
+                return
+            # Counters restart for every file (video, audio, subtitles)
+            delta = downloaded_bytes - state[3] if downloaded_bytes >= state[3] else downloaded_bytes
+            state[3] = downloaded_bytes
+            if delta <= 0:
+                return
+            state[0] -= delta
+            state[2] = time.monotonic()
+        if wait:
+            self.wait(job)
+
+    def wait(self, job):
+        """Block while job is over its share"""
+        while True:
+            with self._lock:
+                state = self._jobs.get(job.id)
+                if state is None:
+                    return
+                now = time.monotonic()
+                share = self._share(now)
+                if share is None:
+                    state[0], state[1] = 0.0, now
+                    return
+                # Refill, allowing at most a second's worth of burst
+                state[0] = min(share, state[0] + (now - state[1]) * share)
+                state[1] = now
+                if state[0] >= 0:
+                    return
+                wait = min(-state[0] / share, BANDWIDTH_MAX_SLEEP)
+            time.sleep(wait)
+
+    def _share(self, now):
+        # Called with the lock held
+        limit = self.schedule.limit_at()
+        if not limit:
+            return None
+        active = sum(1 for s in self._jobs.values() if now - s[2] < BANDWIDTH_IDLE_SECONDS)
+        return limit / max(1, active)
+
+
+class ProgressBus:
+    """Thread-safe progress channel from download workers to a consumer.
+
+    Workers publish raw fields for a job as often as they like; events for
+    the same job are merged so a consumer draining at a fixed rate only
+    sees the latest state of each job that changed since the last drain.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # job id -> (job, merged fields)
+
+    def publish(self, job, **fields):
+        with self._lock:
+            entry = self._pending.get(job.id)
+            if entry is None:
+                self._pending[job.id] = (job, fields)
+            else:
+                entry[1].update(fields)
+
+    def drain(self):
+        """Apply accumulated fields to their jobs and return [(job, fields), ...]"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        updates = list(pending.values())
+        for job, fields in updates:
+            for name, value in fields.items():
+                setattr(job, name, value)
+            if job.status == 'running' and job.total_bytes:
+                job.progress = min(1.0, job.downloaded_bytes / job.total_bytes)
+        return updates
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty sequence"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class DownloadMetrics:
+    """Aggregates finished jobs' metrics per extractor and renders them in
+    the Prometheus text format (throughput, latency quantiles, phase times,
+    retries and cache hit rates)"""
+
+    QUANTILES = (0.5, 0.95)
+
+    def __init__(self, cache=None, samples=METRICS_SAMPLES):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._jobs = collections.Counter()  # (extractor, status) -> jobs
+        self._phase_seconds = collections.Counter()  # (extractor, phase) -> seconds
+        self._bytes = collections.Counter()  # extractor -> bytes
+        self._retries = collections.Counter()  # extractor -> retries
+        self._job_retries = collections.Counter()  # extractor -> failed attempts run again
+        self._info_reused = collections.Counter()  # extractor -> downloads without re-extraction
+        self._latencies = collections.defaultdict(lambda: collections.deque(maxlen=samples))
+
+    def observe(self, job):
+        """Add a finished job (once) to the aggregates"""
+        job.metrics.stop()
+        extractor = job.extractor
+        with self._lock:
+            if job.metrics.observed:
+                return
+            job.metrics.observed = True
+            self._jobs[extractor, job.status] += 1
+            for phase, seconds in job.metrics.phases.items():
+                self._phase_seconds[extractor, phase] += seconds
+            self._bytes[extractor] += job.metrics.bytes
+            self._retries[extractor] += job.metrics.retries
+            self._job_retries[extractor] += job.attempts
+            self._info_reused[extractor] += job.metrics.info_reused
+            if job.status == 'done':
+                self._latencies[extractor].append(job.metrics.total)
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP mediafetch_{name} {help_text}')
+            lines.append(f'# TYPE mediafetch_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                value = value if isinstance(value, int) else round(value, 6)
+                lines.append(f'mediafetch_{name}{{{label_text}}} {value}' if label_text
+                             else f'mediafetch_{name} {value}')
+
+        with self._lock:
+            metric('jobs_total', 'counter', 'Finished jobs by extractor and final status.',
+                   [({'extractor': e, 'status': s}, n) for (e, s), n in sorted(self._jobs.items())])
+            metric('phase_seconds_total', 'counter', 'Time jobs spent in each phase.',
+                   [({'extractor': e, 'phase': p}, n) for (e, p), n in sorted(self._phase_seconds.items())])
+            metric('bytes_total', 'counter', 'Bytes transferred.',
+                   [({'extractor': e}, n) for e, n in sorted(self._bytes.items())])
+            throughput = []
+            for e, n in sorted(self._bytes.items()):
+                seconds = self._phase_seconds.get((e, 'downloading'))
+                if seconds:
+                    throughput.append(({'extractor': e}, n / seconds))
+            metric('throughput_bytes_per_second', 'gauge', 'Bytes per second spent downloading.', throughput)
+            metric('retries_total', 'counter', 'HTTP, fragment and extractor retries.',
+                   [({'extractor': e}, n) for e, n in sorted(self._retries.items())])
+            metric('job_retries_total', 'counter', 'Failed job attempts that were run again.',
+                   [({'extractor': e}, n) for e, n in sorted(self._job_retries.items())])
+            metric('info_reused_total', 'counter', 'Downloads that reused pre-extracted metadata.',
+                   [({'extractor': e}, n) for e, n in sorted(self._info_reused.items())])
+            lines.append('# HELP mediafetch_job_seconds Submit-to-finish time of successful jobs (recent samples).')
+            lines.append('# TYPE mediafetch_job_seconds summary')
+            for e, samples in sorted(self._latencies.items()):
+                for q in self.QUANTILES:
+                    lines.append(f'mediafetch_job_seconds{{extractor="{e}",quantile="{q}"}} {round(percentile(samples, q), 6)}')
+                lines.append(f'mediafetch_job_seconds_sum{{extractor="{e}"}} {round(sum(samples), 6)}')
+                lines.append(f'mediafetch_job_seconds_count{{extractor="{e}"}} {len(samples)}')
+        if self.cache is not None:
+            stats = self.cache.stats()
+            metric('info_cache_requests_total', 'counter', 'Metadata cache lookups.',
+                   [({'result': 'hit'}, stats['hits']), ({'result': 'miss'}, stats['misses'])])
+            metric('info_cache_hit_ratio', 'gauge', 'Share of metadata lookups served from the cache.',
+                   [({}, stats['hit_rate'])])
+            metric('info_cache_bytes', 'gauge', 'Size of the metadata cache on disk.', [({}, stats['bytes'])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Atomically replace path with the current metrics"""
+        path = Path(path)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+class MetricsServer:
+    """Serves DownloadMetrics at http://127.0.0.1:<port>/metrics from a daemon thread"""
+
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        import http.server
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='metrics').start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class DownloadEngine:
+    """Download machinery shared by the desktop app and headless batch mode.
+
+    Job state changes and raw progress are published on `progress` (a
+    ProgressBus) for the front end to drain at its own pace;
+    `on_job_update(job)` and `on_idle()` are called from worker threads.
+    """
+
+    def __init__(self, config=None, on_job_update=None, on_idle=None):
+        config = config or {}
+        self.history = HistoryStore(HISTORY_PATH, legacy_path=LEGACY_HISTORY_PATH)
+        self.journal = JobJournal(QUEUE_PATH)
+        self.journal.prune()
+        self.archive = DownloadArchive(ARCHIVE_PATH)
+        self._claims = set()  # archive keys of running jobs
+        self._claims_lock = threading.Lock()
+        self.ydl_pool = YoutubeDLPool()
+        self.metadata = MetadataService(MetadataCache(
+            CACHE_DIR / "info",
+            max_bytes=config.get('info_cache_max_bytes', INFO_CACHE_MAX_BYTES)
+        ), pool=self.ydl_pool)
+        self.subscriptions = SubscriptionStore(SUBSCRIPTIONS_PATH)
+        self.subscription_sync = SubscriptionSync(
+            self.subscriptions, self.ydl_pool, config.get('subscription_workers', SUBSCRIPTION_WORKERS))
+        self._sync_lock = threading.Lock()
+        self.progress = ProgressBus()
+        self.bandwidth = BandwidthLimiter(BandwidthSchedule.from_config(config))
+        self.postprocessing = PostprocessStage(config.get('postprocess_workers', POSTPROCESS_WORKERS))
+        self.metrics = DownloadMetrics(self.metadata.cache)
+        self._metrics_written = 0.0
+        self.metrics_server = None
+        if config.get('metrics_port') is not None:
+            try:
+                self.metrics_server = MetricsServer(self.metrics, int(config['metrics_port']))
+            except (OSError, ValueError):
+                pass
+        self.on_job_update = on_job_update
+        self.on_idle = on_idle
+        self.retry_policy = RetryPolicy(config.get('job_retries', JOB_RETRIES))
+        self.scheduler = DownloadScheduler(
+            self.run_job,
+            max_workers=config.get('max_workers', DEFAULT_MAX_WORKERS),
+            per_host_limit=config.get('per_host_limit', DEFAULT_PER_HOST_LIMIT),
+            on_update=self._job_updated,
+            on_idle=self._idle,
+            policy=self.retry_policy
+        )
+
+    def submit(self, jobs):
+        """Drop repeated URLs, journal the remaining jobs and queue them.
+
+        Already-downloaded items are skipped by the workers (see _claim),
+        still before any network request.
+        """
+        queued, seen = [], set()
+        for job in jobs:
+            job.metrics.enter('queued')
+            url = canonical_url(job.url)
+            if url in seen:
+                job.status, job.error, job.progress = 'skipped', 'Duplicate URL in this batch', 1.0
+                self._job_updated(job)
+                continue
+            seen.add(url)
+            queued.append(job)
+        try:
+            self.journal.add(queued)
+        except Exception:
+            pass
+        if queued:
+            self.scheduler.submit(queued)
+        elif not self.scheduler.busy:
+            self._idle()
+
+    def resumable_jobs(self):
+        """Rebuild the jobs that ended processes left pending or running"""
+        jobs = []
+        for row in self.journal.unfinished():
+            job = DownloadJob(row['url'], row['options'], title=row['title'])
+            job.journal_id = row['id']
+            jobs.append(job)
+        return jobs
+
+    def sync_subscriptions(self, subs=None):
+        """Check subscriptions (default: the due ones) for new items.
+
+        Returns [(subscription, jobs for its new items)] without queueing
+        the jobs; an empty list while another sync is running.
+        """
+        if not self._sync_lock.acquire(blocking=False):
+            return []
+        try:
+            results = self.subscription_sync.sync(self.subscriptions.due() if subs is None else subs)
+        finally:
+            self._sync_lock.release()
+        return [
+            (sub, [DownloadJob(e['url'], sub['options'], title=e.get('title')) for e in entries])
+            for sub, entries in results
+        ]
+
+    def warm_up(self, trace=None):
+        """Load yt-dlp, its extractors and Pillow off the UI thread"""
+        import yt_dlp  # noqa: F401
+        if trace:
+            trace.mark('import yt_dlp')
+        self.metadata.warm_up()
+        if trace:
+            trace.mark('yt-dlp extractors ready')
+        from PIL import Image  # noqa: F401
+        if trace:
+            trace.mark('import Pillow')
+
+    def cancel(self, job):
+        """Cancel a queued or downloading job; False if it is already
+        postprocessing or finished"""
+        if job.status in FINISHED_STATES or (job.status == 'running' and job.phase == 'processing'):
+            return False
+        job.cancelled = True
+        if self.scheduler.cancel(job):
+            job.status, job.error = 'cancelled', 'Cancelled'
+            self._job_updated(job)
+            if not self.scheduler.busy:
+                self._idle()
+        return True
+
+    def set_bandwidth(self, config):
+        """Apply the bandwidth limit / schedule from config to running jobs too"""
+        self.bandwidth.set_schedule(BandwidthSchedule.from_config(config))
+
+    def progress_hook(self, job, d):
+        # Runs on the worker thread for every chunk: only publish raw numbers,
+        # consumers coalesce and render them at their own rate
+        if job.cancelled:
+            raise JobCancelled('Cancelled')
+        status = d.get('status')
+        if status == 'downloading':
+            if job.metrics.phase != 'downloading':
+                job.metrics.enter('downloading')
+            if d.get('defer_throttle'):
+                # The downloader holds a lock around its hooks and waits after releasing it
+                self.bandwidth.throttle(job, d.get('downloaded_bytes') or 0, wait=False)
+                d['throttle'] = functools.partial(self.bandwidth.wait, job)
+            else:
+                self.bandwidth.throttle(job, d.get('downloaded_bytes') or 0)
+            self.progress.publish(
+                job,
+                downloaded_bytes=d.get('downloaded_bytes') or 0,
+                total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+                speed=d.get('speed'),
+                eta=d.get('eta'),
+                phase='downloading'
+            )
+        elif status == 'finished':
+            total = d.get('total_bytes') or d.get('downloaded_bytes')
+            job.metrics.bytes += total or 0
+            self.progress.publish(
+                job, downloaded_bytes=total, total_bytes=total, speed=None, eta=None, phase='processing'
+            )
+
+    def _claim(self, job):
+        """Reserve the job's archive key; raise JobSkipped if it is known or in flight"""
+        key = job.archive_key = job.archive_key or archive_key(job.url)
+        with self._claims_lock:
+            if key in self._claims:
+                raise JobSkipped('Duplicate of a running download')
+            if not job.options.get('redownload') and key in self.archive:
+                raise JobSkipped('Already downloaded')
+            self._claims.add(key)
+
+    def _archive_filter(self, info, incomplete=False):
+        """yt-dlp match_filter: skip playlist entries that are already archived"""
+        if any(key in self.archive for key in info_archive_keys(info)):
+            return f"{info.get('title') or info.get('id')} is already downloaded"
+        return None
+
+    def _archive(self, job, info):
+        keys = info_archive_keys(info)
+        if (info or {}).get('_type') not in PLAYLIST_TYPES:
+            keys.append(job.archive_key)
+        try:
+            self.archive.add(set(keys), url=job.url, title=job.title or (info or {}).get('title'))
+        except Exception:
+            pass
+
+    def run_job(self, job):
+        """Scheduler runner: download a single job (executes on a worker thread).
+
+        FFmpeg postprocessing is handed to the postprocessing stage and the
+        returned future completes once the job's files are final, so this
+        worker can start the next transfer meanwhile.
+        """
+        job.metrics.enter('extracting')
+        self._claim(job)
+        self.bandwidth.start(job)
+        checkout = contextlib.ExitStack()
+        # Everything after the claim runs inside the try, whose _finish releases it
+        try:
+            formats = output_formats(job.options)
+            if len(formats) > 1:
+                ydl_opts = build_source_opts(job.options, formats)
+            else:
+                ydl_opts = build_ydl_opts(job.options)
+            ydl_opts['progress_hooks'] = [functools.partial(self.progress_hook, job)]
+            ydl_opts['retry_sleep_functions'] = {
+                kind: functools.partial(self._retry_sleep, job) for kind in ('http', 'fragment', 'extractor')
+            }
+            if not job.options.get('redownload'):
+                ydl_opts['match_filter'] = self._archive_filter
+            install_segmented_downloader()
+            ydl = checkout.enter_context(self.ydl_pool.acquire(ydl_opts))
+            with deferred_postprocessing(ydl, everything=len(formats) > 1) as pending:
+                info = download_job(ydl, job, self.metadata)
+            if len(formats) > 1:
+                # Merging the source is a stream copy: finish it here
+                job.metrics.enter('merging')
+                sources = [run() for run in pending]
+        except Exception as e:
+            checkout.close()
+            if job.cancelled:
+                # The abort may surface wrapped in a yt-dlp DownloadError
+                self._finish(job, error=e, record=False)
+                raise JobCancelled('Cancelled') from e
+            delay = self.retry_policy.failed(job, e)
+            if delay is not None:
+                self._finish(job, error=e, record=False)
+                raise JobRetry(str(e), delay) from e
+            self._finish(job, error=e)
+            raise
+        finally:
+            self.bandwidth.finish(job)
+        self.retry_policy.succeeded(job.host)
+        if len(formats) > 1:
+            return self._fan_out(job, ydl, info, sources, formats, checkout)
+        if not pending:
+            checkout.close()
+            self._finish(job, info)
+            return None
+
+        def postprocess():
+            # The YoutubeDL instance stays checked out until its files are final
+            job.metrics.enter('postprocessing')
+            try:
+                with checkout:
+                    for run in pending:
+                        run()
+            except Exception as e:
+                self._finish(job, error=e)
+                raise
+            self._finish(job, info)
+
+        job.metrics.enter('waiting')
+        return self.postprocessing.submit(postprocess)
+
+    @staticmethod
+    def _retry_sleep(job, n=0):
+        """yt-dlp retry_sleep_functions hook: count the retry and back off"""
+        job.metrics.retry(n)
+        return RetryPolicy.backoff(n + 1, DOWNLOAD_RETRY_DELAY, DOWNLOAD_RETRY_MAX_DELAY)
+
+    def _fan_out(self, job, ydl, info, sources, formats, checkout):
+        """Derive every output format from the downloaded source(s) on the
+        postprocessing stage; the returned future completes when all are done"""
+        quality = job.options.get('quality', 'Best')
+
+        def derive(source, format_choice):
+            job.metrics.enter('postprocessing')
+            entry = {'url': job.url, 'path': job.options.get('path'), 'format': format_choice, 'quality': quality}
+            try:
+                path = derive_output(ydl, source, format_choice, quality)
+            except Exception as e:
+                self._record({**entry, 'time': int(time.time()), 'status': 'error', 'error': str(e),
+                              'metrics': job.metrics.to_dict()})
+                raise
+            self._record({**entry, 'time': int(time.time()), 'status': 'success', 'file': path,
+                          'metrics': job.metrics.to_dict()})
+            return path
+
+        job.metrics.enter('waiting')
+        derivations = [
+            self.postprocessing.submit(functools.partial(derive, source, format_choice))
+            for source in sources for format_choice in formats
+        ]
+        outputs = gather_futures(derivations)
+
+        def complete(_):
+            checkout.close()
+            if outputs.cancelled():
+                # Shut down: sources are kept so a resume only redoes the derivations
+                self._finish(job, error=concurrent.futures.CancelledError(), record=False)
+                return
+            if outputs.exception() is not None:
+                # Job-level failure record next to the per-format ones
+                self._finish(job, error=outputs.exception())
+                return
+            for source in sources:
+                if source['filepath'] not in outputs.result():
+                    try:
+                        os.remove(source['filepath'])
+                    except OSError:
+                        pass
+            self._finish(job, info, record=False)
+
+        outputs.add_done_callback(complete)
+        return outputs
+
+    def _finish(self, job, info=None, error=None, record=True):
+        """Archive and record a finished job in history, then release its archive key.
+
+        Multi-format jobs record each output themselves (record=False).
+        """
+        if error is None:
+            self._archive(job, info)
+            if record:
+                self._record({
+                    'url': job.url,
+                    'time': int(time.time()),
+                    'status': 'success',
+                    'path': job.options.get('path'),
+                    'format': job.options.get('format'),
+                    'quality': job.options.get('quality'),
+                    'metrics': job.metrics.to_dict()
+                })
+        elif record:
+            self._record({
+                'url': job.url,
+                'time': int(time.time()),
+                'status': 'error',
+                'error': str(error),
+                'metrics': job.metrics.to_dict()
+            })
+        with self._claims_lock:
+            self._claims.discard(job.archive_key)
+
+    def _record(self, entry):
+        try:
+            self.history.add(entry)
+        except Exception:
+            pass
+
+    def _job_updated(self, job):
+        try:
+            self.journal.update(job)
+        except Exception:
+            pass
+        if job.status in FINISHED_STATES:
+            self.metrics.observe(job)
+            self._write_metrics()
+        self.progress.publish(job)
+        if self.on_job_update:
+            self.on_job_update(job)
+
+    def _idle(self):
+        self._write_metrics(force=True)
+        if self.on_idle:
+            self.on_idle()
+
+    def _write_metrics(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._metrics_written < METRICS_WRITE_INTERVAL:
+            return
+        self._metrics_written = now
+        try:
+            self.metrics.write(METRICS_PATH)
+        except Exception:
+            pass
 
-# App version
-VERSION = "0.1.3"
-# Accent color: try to derive from `icon.ico` if available, else fallback
-def _hex_from_rgb(rgb):
-    return '#{:02x}{:02x}{:02x}'.format(*rgb)
+    def close(self):
+        self._write_metrics(force=True)
+        if self.metrics_server:
+            self.metrics_server.close()
+        self.postprocessing.close()
+        self.metadata.close()
+        self.ydl_pool.close()
+        self.history.close()
+        self.journal.close()
+        self.archive.close()
+        self.subscriptions.close()
 
-def _darken(hex_color, amount=0.2):
-    # Darken a hex color by amount (0..1)
-    hex_color = hex_color.lstrip('#')
-    r = int(hex_color[0:2], 16)
-    g = int(hex_color[2:4], 16)
-    b = int(hex_color[4:6], 16)
-    r = max(0, int(r * (1 - amount)))
-    g = max(0, int(g * (1 - amount)))
-    b = max(0, int(b * (1 - amount)))
-    return _hex_from_rgb((r, g, b))
 
-ACCENT_COLOR = "#b30000"
-HOVER_COLOR = _darken(ACCENT_COLOR, 0.2)
+def format_speed(speed):
+    if not speed:
+        return 'N/A'
+    for unit in ('B/s', 'KiB/s', 'MiB/s'):
+        if speed < 1024:
+            return f"{speed:.1f}{unit}"
+        speed /= 1024
+    return f"{speed:.2f}GiB/s"
+
+
+def format_size(size):
+    if not size:
+        return 'N/A'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.2f}TiB"
+
+
+def format_eta(eta):
+    if eta is None:
+        return 'N/A'
+    minutes, seconds = divmod(int(eta), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+class DownloadScheduler:
+    """Runs download jobs on a worker pool, capping concurrent jobs per host.
+
+    `runner(job)` performs the actual download and raises on failure. It
+    may return a Future for work that continues elsewhere (postprocessing):
+    the worker is freed for the next job and the job finishes with the
+    future. If it raises JobRetry the job waits in the queue and runs again;
+    jobs of hosts the optional `policy` (a RetryPolicy) has parked are held
+    back meanwhile. `on_update(job)` and `on_idle()` are called from worker
+    threads.
+    """
+
+    def __init__(self, runner, max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                 on_update=None, on_idle=None, policy=None):
+        self.runner = runner
+        self.policy = policy
+        self.max_workers = max(1, int(max_workers))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.on_update = on_update
+        self.on_idle = on_idle
+        self._pending = collections.deque()
+        self._active_hosts = collections.Counter()
+        self._running = 0
+        self._deferred = 0  # jobs whose runner handed off to a future
+        self._workers = []
+        self._cond = threading.Condition()
+
+    def configure(self, max_workers=None, per_host_limit=None):
+        with self._cond:
+            if max_workers:
+                self.max_workers = max(1, int(max_workers))
+            if per_host_limit:
+                self.per_host_limit = max(1, int(per_host_limit))
+            self._spawn_workers()
+            self._cond.notify_all()
+
+    def submit(self, jobs):
+        with self._cond:
+            self._pending.extend(jobs)
+            self._spawn_workers()
+            self._cond.notify_all()
+
+    def cancel_pending(self):
+        """Drop jobs that have not started yet and return them"""
+        with self._cond:
+            dropped = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        return dropped
+
+    def cancel(self, job):
+        """Drop one job that has not started yet; False if it is not pending"""
+        with self._cond:
+            try:
+                self._pending.remove(job)
+            except ValueError:
+                return False
+            self._cond.notify_all()
+            return True
+
+    @property
+    def busy(self):
+        with self._cond:
+            return bool(self._pending) or self._running > 0 or self._deferred > 0
 
-# Set appearance
-ctk.set_appearance_mode("dark")
-ctk.set_default_color_theme("blue")
+    def _spawn_workers(self):
+        # Called with the condition held; workers are long-lived daemon threads
+        self._workers = [w for w in self._workers if w.is_alive()]
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            self._workers.append(worker)
+            worker.start()
 
+    def _take_job(self):
+        """First pending job that is due, on a host below its cap and not
+        parked (keeps FIFO order per host). Otherwise (None, seconds until
+        a waiting job is due, or None to wait for the next state change)."""
+        now = time.monotonic()
+        wake = None
+        for job in self._pending:
+            ready = max(job.retry_at, self.policy.blocked_until(job.host) if self.policy else 0.0)
+            if ready > now:
+                wake = ready if wake is None else min(wake, ready)
+            elif self._active_hosts[job.host] < self.per_host_limit:
+                self._pending.remove(job)
+                return job, None
+        return None, None if wake is None else wake - now
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                job = None
+                while job is None:
+                    if self._running >= self.max_workers:
+                        # Pool was shrunk; let surplus workers stand by
+                        self._cond.wait()
+                        continue
+                    job, timeout = self._take_job()
+                    if job is None:
+                        self._cond.wait(timeout)
+                self._active_hosts[job.host] += 1
+                self._running += 1
+
+            job.status = 'running'
+            self._notify(job)
+            deferred = None
+            retry = False
+            try:
+                result = self.runner(job)
+                if isinstance(result, concurrent.futures.Future):
+                    deferred = result
+                else:
+                    job.status = 'done'
+                    job.progress = 1.0
+            except JobSkipped as e:
+                job.status = 'skipped'
+                job.error = str(e)
+                job.progress = 1.0
+            except JobCancelled as e:
+                job.status = 'cancelled'
+                job.error = str(e)
+            except JobRetry as e:
+                job.status = 'pending'
+                job.error = str(e)
+                job.retry_at = time.monotonic() + e.delay
+                job.metrics.enter('backoff')
+                retry = True
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+
+            with self._cond:
+                self._active_hosts[job.host] -= 1
+                if self._active_hosts[job.host] <= 0:
+                    del self._active_hosts[job.host]
+                self._running -= 1
+                if retry:
+                    self._pending.append(job)
+                if deferred is not None:
+                    self._deferred += 1
+                idle = self._is_idle()
+                self._cond.notify_all()
+
+            if deferred is not None:
+                deferred.add_done_callback(functools.partial(self._deferred_done, job))
+                continue
+            self._settle(job, idle)
+
+    def _deferred_done(self, job, future):
+        if not future.cancelled():
+            error = future.exception()
+            if error is None:
+                job.status = 'done'
+                job.progress = 1.0
+            else:
+                job.status = 'failed'
+                job.error = str(error)
+        with self._cond:
+            self._deferred -= 1
+            idle = self._is_idle()
+            self._cond.notify_all()
+        if not future.cancelled():
+            # Cancelled on shutdown: left 'running' so the journal resumes it
+            self._settle(job, idle)
+
+    def _is_idle(self):
+        # Called with the condition held
+        return not self._pending and self._running == 0 and self._deferred == 0
+
+    def _settle(self, job, idle):
+        self._notify(job)
+        if idle and self.on_idle:
+            try:
+                self.on_idle()
+            except Exception:
+                pass
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job)
+            except Exception:
+                pass
+
+
+# ------------------ Desktop app ------------------
+def load_gui_toolkit():
+    """Import customtkinter/tkinter and set the theme; only the desktop app
+    needs them, so headless modes run without Tk"""
+    global ctk, tk, filedialog, messagebox
+    import customtkinter as ctk
+    import tkinter as tk
+    from tkinter import filedialog, messagebox
+    STARTUP_TRACE.mark('import customtkinter')
+    ctk.set_appearance_mode("dark")
+    ctk.set_default_color_theme("blue")
+
+
+def create_app():
+    """Build the main window (DownloaderApp on top of ctk.CTk)"""
+    load_gui_toolkit()
+
+    class App(DownloaderApp, ctk.CTk):
+        pass
+
+    return App()
+
+
+class DownloaderApp:
+    """The main window's behaviour; create_app() mixes it into ctk.CTk"""
 
-class DownloaderApp(ctk.CTk):
     def __init__(self):
         super().__init__()
+        STARTUP_TRACE.mark('window created')
         
         # Window setup
         self.title("MediaFetch")
@@ -52,17 +3327,121 @@ class DownloaderApp(ctk.CTk):
         # Variables
         self.download_path = str(Path.home() / "Downloads")
         self.is_downloading = False
-        self.config_path = Path.home() / ".mediafetch_config.json"
-        self.history_path = Path.home() / ".mediafetch_history.json"
+        self.config_path = CONFIG_PATH
+        self.history_path = HISTORY_PATH
+        self.cache_dir = CACHE_DIR
         self.config = self.load_config()
+
+        # Download engine: scheduler, warm YoutubeDL pool, metadata cache and
+        # history, shared by search, format detection and downloads. Opening
+        # its databases and cache waits until the window is on screen (see
+        # _warm_up_thread); the controls that need it are enabled then.
+        self.engine = None
+        self.history = None
+        self.ydl_pool = None
+        self.metadata = None
+        self.scheduler = None
+        self.progress_bus = None
         
         # Preview state
         self.current_media_info = None
+        self.current_media_url = None
+        # Multi-link Search results by canonical URL, reused by the download
+        self.searched_infos = {}
+        self.search_errors = {}
+        self._search_id = 0
+        self._batch_rows = {}  # canonical URL -> row in the preview list
+        self._batch_pending = 0
+        self.playlist_entries = []
+        self._playlist_header_shown = False
+        self._playlist_feed = None  # options of a batch consuming a still-streaming playlist
+        self.thumbnails = ThumbnailLoader(self.cache_dir / "thumbnails")
+        self._thumbnail_url = None
         self.preview_visible = False
         self.is_searching = False
+
+        # Current batch (per-job state lives on DownloadJob)
+        self.batch_jobs = []
+        self.job_rows = {}
         
-        # Setup UI
+        # Setup UI: visible widgets now, hidden panels and yt-dlp once painted
         self.setup_ui()
+        STARTUP_TRACE.mark('setup_ui')
+        self._started = False
+        self.bind('<Map>', self._on_first_map, add='+')
+        # Fallback in case the window is created without ever being mapped
+        self.after(1500, self._on_first_map)
+        self.after(1000 // PROGRESS_FPS, self._drain_progress)
+
+    def _on_first_map(self, event=None):
+        if self._started or (event is not None and event.widget is not self):
+            return
+        self._started = True
+        self.after(0, self._finish_startup)
+
+    def _finish_startup(self):
+        # Flush pending redraws so the window is on screen before more work
+        self.update_idletasks()
+        STARTUP_TRACE.mark('first paint')
+        self._setup_deferred_ui()
+        STARTUP_TRACE.mark('deferred ui')
+        thread = threading.Thread(target=self._warm_up_thread, daemon=True)
+        thread.start()
+
+    def _offer_resume(self):
+        """Offer to continue downloads a previous session did not finish"""
+        threading.Thread(target=self._offer_resume_thread, daemon=True).start()
+
+    def _offer_resume_thread(self):
+        try:
+            if self.config.get('use_daemon', True) and \
+                    DaemonClient(self.config.get('daemon_port', DAEMON_PORT)).available():
+                return  # the daemon owns the queue meanwhile; `--daemon --resume` continues it
+            jobs = self.engine.resumable_jobs()
+        except Exception:
+            return
+        if jobs:
+            self.after(0, lambda: self._ask_resume(jobs))
+
+    def _ask_resume(self, jobs):
+        if self.is_downloading:
+            return
+        if messagebox.askyesno(
+            'Resume downloads',
+            f'{len(jobs)} download(s) from a previous session did not finish.\n'
+            'Resume them? Partially downloaded files will be continued.'
+        ):
+            self._start_jobs(jobs, local=True)
+        else:
+            self.engine.journal.discard([job.journal_id for job in jobs])
+
+    def _warm_up_thread(self):
+        try:
+            engine = DownloadEngine(self.config, on_idle=self._on_scheduler_idle)
+        except Exception as e:
+            error_msg = str(e)
+            self.after(0, lambda: self.status_label.configure(text=f"Could not start: {error_msg}"))
+            return
+        STARTUP_TRACE.mark('download engine')
+        self.after(0, lambda: self._on_engine_ready(engine))
+        try:
+            engine.warm_up(STARTUP_TRACE)
+        except Exception:
+            pass
+        STARTUP_TRACE.report()
+
+    def _on_engine_ready(self, engine):
+        """Hook up the engine built in the background and enable its controls"""
+        self.engine = engine
+        self.history = engine.history
+        self.ydl_pool = engine.ydl_pool
+        self.metadata = engine.metadata
+        self.scheduler = engine.scheduler
+        self.progress_bus = engine.progress
+        self.search_btn.configure(state="normal")
+        self.history_btn.configure(state="normal")
+        self.after(200, self._offer_resume)
+        self.after(10_000, self._sync_subscriptions)
         
     def setup_ui(self):
         # Main container
@@ -72,6 +3451,7 @@ class DownloaderApp(ctk.CTk):
         # Main scrollable frame
         main_frame = ctk.CTkScrollableFrame(self, corner_radius=0, fg_color="transparent")
         main_frame.grid(row=0, column=0, sticky="nsew", padx=20, pady=20)
+        self.main_frame = main_frame
         main_frame.grid_columnconfigure(0, weight=1)
         
         # Title
@@ -132,62 +3512,11 @@ class DownloaderApp(ctk.CTk):
             command=self.search_url,
             font=ctk.CTkFont(size=14, weight="bold"),
             fg_color=ACCENT_COLOR,
-            hover_color=HOVER_COLOR
+            hover_color=HOVER_COLOR,
+            state="disabled"  # enabled once the download engine is ready
         )
         self.search_btn.grid(row=0, column=1, sticky="ns")
         
-        # Preview Panel (hidden by default)
-        self.preview_frame = ctk.CTkFrame(main_frame)
-        self.preview_frame.grid(row=4, column=0, pady=(0, 20), sticky="ew", padx=20)
-        self.preview_frame.grid_columnconfigure(1, weight=1)
-        self.preview_frame.grid_remove()  # Hide initially
-        
-        # Thumbnail placeholder
-        self.thumbnail_label = ctk.CTkLabel(
-            self.preview_frame,
-            text="",
-            width=160,
-            height=90
-        )
-        self.thumbnail_label.grid(row=0, column=0, rowspan=5, padx=15, pady=15, sticky="nw")
-        
-        # Media info labels
-        self.title_label = ctk.CTkLabel(
-            self.preview_frame,
-            text="",
-            font=ctk.CTkFont(size=14, weight="bold"),
-            anchor="w",
-            wraplength=500
-        )
-        self.title_label.grid(row=0, column=1, sticky="w", padx=(0, 15), pady=(15, 5))
-        
-        self.duration_label = ctk.CTkLabel(
-            self.preview_frame,
-            text="",
-            font=ctk.CTkFont(size=11),
-            anchor="w",
-            text_color="gray"
-        )
-        self.duration_label.grid(row=1, column=1, sticky="w", padx=(0, 15), pady=2)
-        
-        self.uploader_label = ctk.CTkLabel(
-            self.preview_frame,
-            text="",
-            font=ctk.CTkFont(size=11),
-            anchor="w",
-            text_color="gray"
-        )
-        self.uploader_label.grid(row=2, column=1, sticky="w", padx=(0, 15), pady=2)
-        
-        self.views_label = ctk.CTkLabel(
-            self.preview_frame,
-            text="",
-            font=ctk.CTkFont(size=11),
-            anchor="w",
-            text_color="gray"
-        )
-        self.views_label.grid(row=3, column=1, sticky="w", padx=(0, 15), pady=(2, 15))
-        
         # Options Frame
         options_frame = ctk.CTkFrame(main_frame, fg_color="transparent")
         options_frame.grid(row=5, column=0, pady=(0, 20), sticky="ew", padx=20)
@@ -204,14 +3533,7 @@ class DownloaderApp(ctk.CTk):
         self.format_var = ctk.StringVar(value="Video (MP4)")
         self.format_menu = ctk.CTkOptionMenu(
             options_frame,
-            values=[
-                "Video (MP4)",
-                "Video (MKV)",
-                "Audio (MP3)",
-                "Audio (FLAC)",
-                "Audio (WAV)",
-                "Audio (M4A)"
-            ],
+            values=FORMAT_CHOICES,
             variable=self.format_var,
             command=self.update_quality_options,
             height=40,
@@ -309,11 +3631,73 @@ class DownloaderApp(ctk.CTk):
         theme_btn.grid(row=1, column=0, pady=(8,0), sticky="w")
 
         # History and Update buttons
-        history_btn = ctk.CTkButton(extra_frame, text="History", width=100, command=self.show_history, fg_color=ACCENT_COLOR, hover_color=HOVER_COLOR)
-        history_btn.grid(row=1, column=1, pady=(8,0))
+        self.history_btn = ctk.CTkButton(extra_frame, text="History", width=100, command=self.show_history, fg_color=ACCENT_COLOR, hover_color=HOVER_COLOR, state="disabled")
+        self.history_btn.grid(row=1, column=1, pady=(8,0))
 
         update_btn = ctk.CTkButton(extra_frame, text="Check for updates", width=160, command=lambda: self.check_for_updates(show_popup=True), fg_color=ACCENT_COLOR, hover_color=HOVER_COLOR)
         update_btn.grid(row=1, column=2, pady=(8,0), sticky="e")
+
+        # Parallel downloads (worker pool size)
+        workers_label = ctk.CTkLabel(extra_frame, text="Parallel downloads:")
+        workers_label.grid(row=2, column=0, pady=(8,0), sticky="w")
+        self.workers_var = ctk.StringVar(value=str(self.config.get('max_workers', DEFAULT_MAX_WORKERS)))
+        workers_menu = ctk.CTkOptionMenu(
+            extra_frame,
+            values=[str(n) for n in range(1, 9)],
+            variable=self.workers_var,
+            command=self.set_max_workers,
+            width=120,
+            fg_color=ACCENT_COLOR,
+            button_color=ACCENT_COLOR
+        )
+        workers_menu.grid(row=2, column=1, pady=(8,0), sticky="w")
+
+        # Global bandwidth limit (time-of-day windows come from the config file)
+        bandwidth_label = ctk.CTkLabel(extra_frame, text="Bandwidth (Mbit/s):")
+        bandwidth_label.grid(row=3, column=0, pady=(8,0), sticky="w")
+        try:
+            limit = parse_limit(self.config.get('bandwidth_limit'))
+        except (TypeError, ValueError):
+            limit = None
+        self.bandwidth_var = ctk.StringVar(value=f"{limit * 8 / 1_000_000:g}" if limit else "Unlimited")
+        bandwidth_menu = ctk.CTkOptionMenu(
+            extra_frame,
+            values=BANDWIDTH_CHOICES,
+            variable=self.bandwidth_var,
+            command=self.set_bandwidth_limit,
+            width=120,
+            fg_color=ACCENT_COLOR,
+            button_color=ACCENT_COLOR
+        )
+        bandwidth_menu.grid(row=3, column=1, pady=(8,0), sticky="w")
+
+        # Connections per download (byte ranges / stream fragments)
+        connections_label = ctk.CTkLabel(extra_frame, text="Connections per download:")
+        connections_label.grid(row=4, column=0, pady=(8,0), sticky="w")
+        self.connections_var = ctk.StringVar(value=str(self.config.get('connections', DEFAULT_CONNECTIONS)))
+        connections_menu = ctk.CTkOptionMenu(
+            extra_frame,
+            values=CONNECTION_CHOICES,
+            variable=self.connections_var,
+            command=self.set_connections,
+            width=120,
+            fg_color=ACCENT_COLOR,
+            button_color=ACCENT_COLOR
+        )
+        connections_menu.grid(row=4, column=1, pady=(8,0), sticky="w")
+
+        # Extra output formats derived from the same download
+        also_label = ctk.CTkLabel(extra_frame, text="Also save as:")
+        also_label.grid(row=5, column=0, pady=(8,0), sticky="w")
+        also_frame = ctk.CTkFrame(extra_frame, fg_color="transparent")
+        also_frame.grid(row=5, column=1, columnspan=2, pady=(8,0), sticky="w")
+        self.extra_format_vars = {}
+        for choice, ext in OUTPUT_EXTENSIONS.items():
+            var = ctk.BooleanVar(value=choice in self.config.get('extra_formats', []))
+            ctk.CTkCheckBox(
+                also_frame, text=ext.upper(), variable=var, width=70, command=self.save_extra_formats
+            ).pack(side="left", padx=(0, 6))
+            self.extra_format_vars[choice] = var
         
         # Progress Section
         self.progress_frame = ctk.CTkFrame(main_frame)
@@ -341,6 +3725,7 @@ class DownloaderApp(ctk.CTk):
             font=ctk.CTkFont(size=12)
         )
         self.progress_label.grid(row=2, column=0, pady=(0, 15), sticky="w", padx=15)
+
         
         # Download Button (hidden until search completes)
         self.download_btn = ctk.CTkButton(
@@ -367,6 +3752,95 @@ class DownloaderApp(ctk.CTk):
         )
         about_btn.grid(row=10, column=0, pady=(0, 10), sticky="e", padx=20)
         
+    def _setup_deferred_ui(self):
+        """Panels that start hidden; built right after the first paint"""
+        # Preview Panel (hidden by default)
+        self.preview_frame = ctk.CTkFrame(self.main_frame)
+        self.preview_frame.grid(row=4, column=0, pady=(0, 20), sticky="ew", padx=20)
+        self.preview_frame.grid_columnconfigure(1, weight=1)
+        self.preview_frame.grid_remove()  # Hide initially
+        
+        # Thumbnail placeholder
+        self.thumbnail_label = ctk.CTkLabel(
+            self.preview_frame,
+            text="",
+            width=160,
+            height=90
+        )
+        self.thumbnail_label.grid(row=0, column=0, rowspan=5, padx=15, pady=15, sticky="nw")
+        
+        # Media info labels
+        self.title_label = ctk.CTkLabel(
+            self.preview_frame,
+            text="",
+            font=ctk.CTkFont(size=14, weight="bold"),
+            anchor="w",
+            wraplength=500
+        )
+        self.title_label.grid(row=0, column=1, sticky="w", padx=(0, 15), pady=(15, 5))
+        
+        self.duration_label = ctk.CTkLabel(
+            self.preview_frame,
+            text="",
+            font=ctk.CTkFont(size=11),
+            anchor="w",
+            text_color="gray"
+        )
+        self.duration_label.grid(row=1, column=1, sticky="w", padx=(0, 15), pady=2)
+        
+        self.uploader_label = ctk.CTkLabel(
+            self.preview_frame,
+            text="",
+            font=ctk.CTkFont(size=11),
+            anchor="w",
+            text_color="gray"
+        )
+        self.uploader_label.grid(row=2, column=1, sticky="w", padx=(0, 15), pady=2)
+        
+        self.views_label = ctk.CTkLabel(
+            self.preview_frame,
+            text="",
+            font=ctk.CTkFont(size=11),
+            anchor="w",
+            text_color="gray"
+        )
+        self.views_label.grid(row=3, column=1, sticky="w", padx=(0, 15), pady=(2, 15))
+
+        # Subscribe to the previewed playlist or channel
+        self.subscribe_btn = ctk.CTkButton(
+            self.preview_frame,
+            text="🔔 Subscribe",
+            width=140,
+            command=self.toggle_subscription,
+            fg_color=ACCENT_COLOR,
+            hover_color=HOVER_COLOR
+        )
+        self.subscribe_btn.grid(row=4, column=1, sticky="w", padx=(0, 15), pady=(0, 15))
+        self.subscribe_btn.grid_remove()
+
+        # Playlist entries (filled as they are enumerated)
+        self.entries_list = tk.Listbox(self.preview_frame, height=8, font=("Courier New", 10), activestyle='none')
+        self.entries_list.grid(row=5, column=0, columnspan=2, sticky="ew", padx=15, pady=(0, 15))
+        self.entries_list.grid_remove()
+
+        # Per-job list (shown for multi-URL batches)
+        self.jobs_frame = ctk.CTkScrollableFrame(self.progress_frame, height=140)
+        self.jobs_frame.grid(row=3, column=0, pady=(0, 15), sticky="ew", padx=15)
+        self.jobs_frame.grid_remove()
+
+        # Failures of the last batch, grouped by site and error
+        self.failures_label = ctk.CTkLabel(
+            self.progress_frame,
+            text="",
+            font=ctk.CTkFont(size=11),
+            text_color=ACCENT_COLOR,
+            anchor="w",
+            justify="left",
+            wraplength=700
+        )
+        self.failures_label.grid(row=4, column=0, pady=(0, 15), sticky="w", padx=15)
+        self.failures_label.grid_remove()
+
     def browse_folder(self):
         folder = filedialog.askdirectory(initialdir=self.download_path)
         if folder:
@@ -375,65 +3849,148 @@ class DownloaderApp(ctk.CTk):
     
     def search_url(self):
         """Initiate URL search to fetch media info"""
+        if self.engine is None:
+            return
         if self.is_searching or self.is_downloading:
             messagebox.showwarning("Busy", "Please wait for the current operation to finish.")
             return
         
-        # Get first URL from textbox
         text = self.url_text.get("0.0", "end").strip()
         if getattr(self, 'url_placeholder_active', False) or not text:
             messagebox.showwarning("No URL", "Please enter a URL first!")
             return
-        
-        # Get first non-empty URL
-        first_url = None
-        for line in text.splitlines():
-            line = line.strip()
-            if line:
-                first_url = line
-                break
-        
-        if not first_url or not first_url.startswith("http"):
+
+        urls = [line.strip() for line in text.splitlines() if line.strip()]
+        if not any(url.startswith("http") for url in urls):
             messagebox.showwarning("Invalid URL", "Please enter a valid URL starting with http:// or https://")
             return
-        
+
         # Start search in background
+        self._search_id += 1
+        self._reset_playlist_view()
+        self.current_media_info = None
+        self.searched_infos = {}
+        self.search_errors = {}
         self.is_searching = True
         self.search_btn.configure(text="⏳ Searching...", state="disabled")
         self.status_label.configure(text="Fetching media information...")
-        
-        thread = threading.Thread(target=self.search_url_thread, args=(first_url,))
+
+        if len(urls) > 1:
+            self.search_batch(urls)
+            return
+        self.current_media_url = urls[0]
+        thread = threading.Thread(target=self.search_url_thread, args=(urls[0],))
         thread.daemon = True
         thread.start()
+
+    def search_batch(self, urls):
+        """Resolve every link of a batch concurrently, filling the preview list as results arrive"""
+        self.current_media_url = None
+        self._batch_rows = {}
+        unique = []
+        for url in urls:
+            key = canonical_url(url)
+            if key not in self._batch_rows:
+                self._batch_rows[key] = len(unique)
+                unique.append(url)
+
+        self.title_label.configure(text=f"Batch of {len(unique)} links")
+        self.duration_label.configure(text="⏱️ Total duration: N/A")
+        self.uploader_label.configure(text=f"🔎 Resolving 0/{len(unique)}...")
+        self.views_label.configure(text="")
+        self._thumbnail_url = None
+        self.thumbnail_label.configure(text="🖼️\nBatch", font=ctk.CTkFont(size=12))
+        self.entries_list.insert('end', *(f"{n:>5}. [{'...':^8}] {url}" for n, url in enumerate(unique, 1)))
+        self.entries_list.grid()
+        self.preview_frame.grid()
+        self.download_btn.grid()
+        self.preview_visible = True
+
+        self._batch_pending = len(unique)
+        search_id = self._search_id
+        for url in unique:
+            if not url.startswith("http"):
+                self._on_batch_result(search_id, url, None, "Not a valid URL")
+
+        def on_result(url, info, error):
+            # Only the compact record crosses over; the full dict is in the cache
+            record = MediaInfo.from_info(info, url) if info else None
+            self.after(0, lambda: self._on_batch_result(search_id, url, record, error))
+
+        self.metadata.prefetch([url for url in unique if url.startswith("http")], on_result)
+
+    def _on_batch_result(self, search_id, url, info, error):
+        """One link of a batch search resolved to a MediaInfo or an error (main thread)"""
+        if search_id != self._search_id:
+            return
+        key = canonical_url(url)
+        index = self._batch_rows.get(key)
+        if index is None:
+            return
+        n = index + 1
+        if error is not None or not info:
+            message = str(error or "No media found").replace("ERROR: ", "", 1)
+            self.search_errors[key] = message
+            line = f"{n:>5}. [{'failed':^8}] {url} · {message}"
+        elif info.playlist:
+            self.searched_infos[key] = info
+            line = f"{n:>5}. [playlist] {info.title or url} · {len(info.entries)} entries"
+        else:
+            self.searched_infos[key] = info
+            length = format_eta(info.duration) if info.duration else '--:--'
+            line = f"{n:>5}. [{length:>8}] {info.title or url} · {format_size(info.size)}"
+        self.entries_list.delete(index)
+        self.entries_list.insert(index, line)
+        if key in self.search_errors:
+            self.entries_list.itemconfigure(index, foreground=ACCENT_COLOR)
+
+        self._batch_pending -= 1
+        videos = [i for i in self.searched_infos.values() if not i.playlist]
+        total_duration = sum(i.duration or 0 for i in videos)
+        sizes = [i.size for i in videos]
+        resolved = len(self.searched_infos) + len(self.search_errors)
+        self.duration_label.configure(
+            text=f"⏱️ Total duration: {format_eta(total_duration) if total_duration else 'N/A'}")
+        known = sum(size for size in sizes if size)
+        self.views_label.configure(
+            text=f"💾 Estimated size: {'≥ ' if known and None in sizes else ''}{format_size(known)}")
+        self.uploader_label.configure(
+            text=f"🔎 Resolved {resolved}/{len(self._batch_rows)} · {len(self.search_errors)} failed")
+        if self._batch_pending <= 0 and self.is_searching:
+            self.is_searching = False
+            self.search_btn.configure(text="🔍 Search", state="normal")
+            failed = len(self.search_errors)
+            self.status_label.configure(
+                text=f"Ready to download ({failed} link(s) failed and will be skipped)" if failed
+                else "Ready to download")
     
     def search_url_thread(self, url):
         """Background thread to fetch media info"""
-        try:
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'skip_download': True,
-                'extract_flat': False,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if info:
-                    # Store media info
-                    self.current_media_info = info
-                    
-                    # Update UI on main thread
-                    self.after(0, lambda: self.show_preview(info))
-                else:
-                    self.after(0, lambda: self._search_failed("Could not fetch media information"))
-                    
+        def on_entries(header, batch):
+            record = MediaInfo.from_info(header, url)
+            self.after(0, lambda: self._on_playlist_entries(url, record, batch))
+
+        try:
+            info = self.metadata.extract(url, on_entries=on_entries)
+
+            if info:
+                # Keep only the compact record; the full dict is in the cache
+                info = MediaInfo.from_info(info, url)
+                self.current_media_info = info
+                self.current_media_url = url
+
+                # Update UI on main thread
+                self.after(0, lambda: self.show_preview(info))
+            else:
+                self.after(0, lambda: self._search_failed("Could not fetch media information"))
+
         except Exception as e:
             error_msg = str(e)
             self.after(0, lambda: self._search_failed(error_msg))
     
     def _search_failed(self, error_msg):
         """Handle search failure"""
+        self._close_playlist_feed()
         self.is_searching = False
         self.search_btn.configure(text="🔍 Search", state="normal")
         self.status_label.configure(text="Search failed")
@@ -442,12 +3999,24 @@ class DownloaderApp(ctk.CTk):
     def show_preview(self, info):
         """Display media preview with thumbnail and metadata"""
         try:
+            if info.playlist:
+                self._show_playlist_header(info)
+                self._append_playlist_entries(info.entries[len(self.playlist_entries):])
+                self._close_playlist_feed()
+                self.is_searching = False
+                self.search_btn.configure(text="🔍 Search", state="normal")
+                self.status_label.configure(text=f"Ready to download ({len(self.playlist_entries)} entries)")
+                return
+
             # Extract info
-            title = info.get('title', 'Unknown Title')
-            duration = info.get('duration', 0)
-            uploader = info.get('uploader', 'Unknown')
-            view_count = info.get('view_count', 0)
-            thumbnail_url = info.get('thumbnail', '')
+            self._reset_playlist_view()
+            self._apply_formats(info)
+
+            title = info.title or 'Unknown Title'
+            duration = info.duration or 0
+            uploader = info.uploader or 'Unknown'
+            view_count = info.view_count or 0
+            thumbnail_url = info.thumbnail or ''
             
             # Format duration
             if duration:
@@ -474,18 +4043,14 @@ class DownloaderApp(ctk.CTk):
             self.uploader_label.configure(text=f"📤 Uploader: {uploader}")
             self.views_label.configure(text=views_str)
             
-            # Try to fetch and display thumbnail
+            # Thumbnail fills in once the background loader has it
+            self._thumbnail_url = thumbnail_url
             if thumbnail_url:
-                try:
-                    with urllib.request.urlopen(thumbnail_url, timeout=5) as response:
-                        img_data = response.read()
-                        img = Image.open(io.BytesIO(img_data))
-                        img = img.resize((160, 90), Image.Resampling.LANCZOS)
-                        photo = ctk.CTkImage(light_image=img, dark_image=img, size=(160, 90))
-                        self.thumbnail_label.configure(image=photo, text="")
-                        self.thumbnail_label.image = photo  # Keep reference
-                except Exception:
-                    self.thumbnail_label.configure(text="🖼️\nNo Preview", font=ctk.CTkFont(size=12))
+                self.thumbnail_label.configure(text="🖼️\nLoading...", font=ctk.CTkFont(size=12))
+                self.thumbnails.load(
+                    thumbnail_url,
+                    lambda img: self.after(0, lambda: self._set_thumbnail(thumbnail_url, img))
+                )
             else:
                 self.thumbnail_label.configure(text="🖼️\nNo Preview", font=ctk.CTkFont(size=12))
             
@@ -502,10 +4067,139 @@ class DownloaderApp(ctk.CTk):
         except Exception as e:
             self._search_failed(f"Error displaying preview: {str(e)}")
             
+    def _reset_playlist_view(self):
+        self.playlist_entries = []
+        self._playlist_header_shown = False
+        self.entries_list.delete(0, 'end')
+        self.entries_list.grid_remove()
+        self.subscribe_btn.grid_remove()
+
+    def _on_playlist_entries(self, url, header, batch):
+        """A batch of flat playlist entries arrived from the search thread"""
+        if url != self.current_media_url:
+            return
+        self._show_playlist_header(header)
+        self._append_playlist_entries(batch)
+        if self.is_searching:
+            self.status_label.configure(text=f"Listing playlist... {len(self.playlist_entries)} entries so far")
+
+    def _show_playlist_header(self, info):
+        if self._playlist_header_shown:
+            return
+        self._playlist_header_shown = True
+        self.title_label.configure(text=info.title or 'Untitled playlist')
+        self.duration_label.configure(text="📃 Playlist")
+        self.uploader_label.configure(text=f"📤 Uploader: {info.uploader or 'Unknown'}")
+        self.views_label.configure(text="")
+        self._thumbnail_url = None
+        self.thumbnail_label.configure(text="🖼️\nPlaylist", font=ctk.CTkFont(size=12))
+        self.entries_list.grid()
+        self._update_subscribe_button()
+        self.subscribe_btn.grid()
+        # Downloads may start while later entries are still being listed
+        self.preview_frame.grid()
+        self.download_btn.grid()
+        self.preview_visible = True
+
+    def _append_playlist_entries(self, entries):
+        if not entries:
+            return
+        start = len(self.playlist_entries)
+        self.playlist_entries.extend(entries)
+        lines = []
+        for n, entry in enumerate(entries, start + 1):
+            duration = entry.get('duration')
+            length = format_eta(duration) if duration else '--:--'
+            lines.append(f"{n:>5}. [{length:>8}] {entry.get('title') or entry['url']}")
+        self.entries_list.insert('end', *lines)
+        self.duration_label.configure(text=f"📃 Playlist · {len(self.playlist_entries)} entries")
+
+        # Feed a download that was started before enumeration finished
+        if self._playlist_feed is not None:
+            jobs = [DownloadJob(e['url'], self._playlist_feed, title=e.get('title')) for e in entries]
+            self.batch_jobs.extend(jobs)
+            self.engine.submit(jobs)
+            self.jobs_frame.grid()
+
+    def _close_playlist_feed(self):
+        """Playlist enumeration ended; let a consuming batch finish normally"""
+        if self._playlist_feed is None:
+            return
+        self._playlist_feed = None
+        if self.is_downloading and not self.scheduler.busy:
+            self._finish_batch()
+
+    def _update_subscribe_button(self):
+        subscribed = self.engine.subscriptions.get(self.current_media_url) is not None
+        self.subscribe_btn.configure(text="🔕 Unsubscribe" if subscribed else "🔔 Subscribe")
+
+    def toggle_subscription(self):
+        """Subscribe to (or unsubscribe from) the previewed playlist or channel"""
+        url = self.current_media_url
+        if not url:
+            return
+        sub = self.engine.subscriptions.get(url)
+        if sub:
+            self.engine.subscriptions.remove(sub['id'])
+            self.status_label.configure(text="Unsubscribed")
+        else:
+            # Entries listed by the search are not new; a channel link that
+            # maps to another tab is listed on its first sync instead
+            known = []
+            if not self.is_searching and subscription_url(url) == canonical_url(url):
+                known = [e.get('id') or e['url'] for e in self.playlist_entries]
+            title = self.current_media_info.title if self.current_media_info else None
+            self.engine.subscriptions.add(url, self._current_options(), title=title, known_ids=known)
+            self.status_label.configure(text="Subscribed: new items will be downloaded with the current settings")
+        self._update_subscribe_button()
+
+    def _sync_subscriptions(self):
+        """Check due subscriptions in the background, and again every few minutes"""
+        self.after(SUBSCRIPTION_POLL * 1000, self._sync_subscriptions)
+        threading.Thread(target=self._sync_subscriptions_thread, daemon=True).start()
+
+    def _sync_subscriptions_thread(self):
+        try:
+            if not self.engine.subscriptions.due():
+                return
+            if self.config.get('use_daemon', True) and \
+                    DaemonClient(self.config.get('daemon_port', DAEMON_PORT)).available():
+                return  # the daemon syncs them and downloads the new items itself
+            jobs = [job for _, sub_jobs in self.engine.sync_subscriptions() for job in sub_jobs]
+        except Exception:
+            return
+        if jobs:
+            self.after(0, lambda: self._queue_subscription_jobs(jobs))
+
+    def _queue_subscription_jobs(self, jobs):
+        """Download the new items of subscriptions, joining a running batch"""
+        if self.is_downloading:
+            self.batch_jobs.extend(jobs)
+            self.jobs_frame.grid()
+            self.engine.submit(jobs)
+        else:
+            self._start_jobs(jobs, local=True)
+
+    def _set_thumbnail(self, thumbnail_url, img):
+        """Show a loaded thumbnail unless the preview has moved on"""
+        if thumbnail_url != self._thumbnail_url:
+            return
+        if img is None:
+            self.thumbnail_label.configure(text="🖼️\nNo Preview", font=ctk.CTkFont(size=12))
+            return
+        photo = ctk.CTkImage(light_image=img, dark_image=img, size=THUMBNAIL_SIZE)
+        self.thumbnail_label.configure(image=photo, text="")
+        self.thumbnail_label.image = photo  # Keep reference
+
     def show_about(self):
         """Show About dialog with app name and version"""
         try:
-            message = f"MediaFetch\nVersion: {VERSION}\n\nA simple media downloader powered by yt-dlp."
+            stats = self.metadata.cache.stats()
+            message = (
+                f"MediaFetch\nVersion: {VERSION}\n\nA simple media downloader powered by yt-dlp.\n\n"
+                f"Metadata cache: {stats['entries']} entries, {stats['bytes'] / 1_048_576:.1f} MB\n"
+                f"Hits: {stats['hits']} | Misses: {stats['misses']} ({stats['hit_rate'] * 100:.0f}% hit rate)"
+            )
             messagebox.showinfo("About MediaFetch", message)
         except Exception:
             messagebox.showinfo("About", "MediaFetch")
@@ -549,7 +4243,7 @@ class DownloaderApp(ctk.CTk):
             if line:
                 first_url = line
                 break
-        if not first_url or not first_url.startswith("http"):
+        if not first_url or not first_url.startswith("http") or self.metadata is None:
             return
             
         # Run detection in background
@@ -559,66 +4253,61 @@ class DownloaderApp(ctk.CTk):
         
     def detect_formats_thread(self, url):
         """Background thread to detect available formats"""
+        self.after(0, lambda: self.status_label.configure(text="Detecting available formats..."))
         try:
-            self.status_label.configure(text="Detecting available formats...")
-            
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'skip_download': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-                if info:
-                    # Get available video qualities
-                    available_heights = set()
-                    available_fps = set()
-                    
-                    if 'formats' in info:
-                        for fmt in info['formats']:
-                            if fmt.get('height'):
-                                available_heights.add(fmt['height'])
-                            if fmt.get('fps'):
-                                available_fps.add(fmt['fps'])
-                    
-                    # Build quality list based on available formats
-                    video_qualities = ["Best"]
-                    
-                    # Check for 60fps support
-                    has_60fps = any(fps >= 60 for fps in available_fps)
-                    
-                    # Add qualities that are available
-                    if 2160 in available_heights:
-                        if has_60fps:
-                            video_qualities.append("4K 60fps")
-                        video_qualities.append("4K (2160p)")
-                    if 1440 in available_heights:
-                        if has_60fps:
-                            video_qualities.append("1440p 60fps")
-                        video_qualities.append("1440p")
-                    if 1080 in available_heights:
-                        if has_60fps:
-                            video_qualities.append("1080p 60fps")
-                        video_qualities.append("1080p")
-                    if 720 in available_heights:
-                        if has_60fps:
-                            video_qualities.append("720p 60fps")
-                        video_qualities.append("720p")
-                    if 480 in available_heights:
-                        video_qualities.append("480p")
-                    if 360 in available_heights or 240 in available_heights:
-                        video_qualities.append("360p")
-                    
-                    # Update quality menu if video format is selected
-                    if "Video" in self.format_var.get():
-                        self.quality_menu.configure(values=video_qualities)
-                        self.quality_var.set("Best")
-                    
-                    self.status_label.configure(text=f"Ready to download (Max: {max(available_heights) if available_heights else 'Unknown'}p)")
-                else:
+            # Shares the extraction with a concurrent Search for the same URL
+            info = MediaInfo.from_info(self.metadata.extract(url), url)
+        except Exception:
+            info = None
+        self.after(0, lambda: self._apply_formats(info))
+
+    def _apply_formats(self, info):
+        """Fill the quality menu from a MediaInfo (runs on the main thread)"""
+        try:
+            if info and info.playlist:
+                # Qualities are per entry; keep the generic menu
+                if not self.is_searching:
                     self.status_label.configure(text="Ready to download")
+            elif info:
+                # Get available video qualities
+                available_heights = set(info.heights)
+
+                # Build quality list based on available formats
+                video_qualities = ["Best"]
+
+                # Check for 60fps support
+                has_60fps = (info.max_fps or 0) >= 60
+                
+                # Add qualities that are available
+                if 2160 in available_heights:
+                    if has_60fps:
+                        video_qualities.append("4K 60fps")
+                    video_qualities.append("4K (2160p)")
+                if 1440 in available_heights:
+                    if has_60fps:
+                        video_qualities.append("1440p 60fps")
+                    video_qualities.append("1440p")
+                if 1080 in available_heights:
+                    if has_60fps:
+                        video_qualities.append("1080p 60fps")
+                    video_qualities.append("1080p")
+                if 720 in available_heights:
+                    if has_60fps:
+                        video_qualities.append("720p 60fps")
+                    video_qualities.append("720p")
+                if 480 in available_heights:
+                    video_qualities.append("480p")
+                if 360 in available_heights or 240 in available_heights:
+                    video_qualities.append("360p")
+                
+                # Update quality menu if video format is selected
+                if "Video" in self.format_var.get():
+                    self.quality_menu.configure(values=video_qualities)
+                    self.quality_var.set("Best")
+                
+                self.status_label.configure(text=f"Ready to download (Max: {max(available_heights) if available_heights else 'Unknown'}p)")
+            else:
+                self.status_label.configure(text="Ready to download")
                     
         except Exception as e:
             # If detection fails, just keep default options
@@ -659,161 +4348,96 @@ class DownloaderApp(ctk.CTk):
         except Exception:
             pass
             
-    def progress_hook(self, d):
-        if d['status'] == 'downloading':
-            # Extract percentage
-            percentage_str = d.get('_percent_str', '0%').strip()
-            try:
-                percentage = float(percentage_str.replace('%', ''))
-                self.progress_bar.set(percentage / 100)
-                self.progress_label.configure(text=f"{percentage:.1f}%")
-                
-                # Update status with speed and ETA
-                speed = d.get('_speed_str', 'N/A')
-                eta = d.get('_eta_str', 'N/A')
-                self.status_label.configure(
-                    text=f"Downloading... Speed: {speed} | ETA: {eta}"
-                )
-            except:
-                pass
-                
-        elif d['status'] == 'finished':
-            self.progress_bar.set(1.0)
-            self.progress_label.configure(text="100%")
-            self.status_label.configure(text="Processing... Almost done!")
-            
-    def download_thread(self, url):
-        # Support downloading a single url (string) or an iterable of urls
-        urls = []
-        if isinstance(url, (list, tuple)):
-            urls = url
-        else:
-            urls = [url]
+    def _on_scheduler_idle(self):
+        self.after(0, self._finish_batch)
 
-        for single_url in urls:
-            try:
-                # Determine format and quality options
-                format_choice = self.format_var.get()
-                quality = self.quality_var.get()
-
-                # Base options
-                ydl_opts = {
-                    'outtmpl': os.path.join(self.download_path, '%(title)s.%(ext)s'),
-                    'progress_hooks': [self.progress_hook],
-                    'quiet': False,
-                    'no_warnings': False,
-                }
+    def _drain_progress(self):
+        """Apply coalesced progress events to the UI (main thread, fixed rate)"""
+        try:
+            updates = self.progress_bus.drain() if self.progress_bus else []
+            for job, _ in updates:
+                self._render_job(job)
+            if updates:
+                self._render_batch(updates[-1][0])
+        except Exception:
+            pass
+        self.after(1000 // PROGRESS_FPS, self._drain_progress)
 
-                # Subtitles
-                if self.subs_var.get():
-                    lang = self.subs_lang_var.get().strip() or 'en'
-                    ydl_opts['writesubtitles'] = True
-                    ydl_opts['subtitleslangs'] = [lang]
-                    ydl_opts['writeautomaticsub'] = True
-
-                # Thumbnail
-                if self.thumb_var.get():
-                    ydl_opts['writethumbnail'] = True
-
-                # Format-specific options (audio/video)
-                if "Audio" in format_choice:
-                    audio_quality = '320'
-                    if 'kbps' in quality:
-                        audio_quality = quality.split()[0]
-
-                    if "MP3" in format_choice:
-                        ydl_opts.update({
-                            'format': 'bestaudio/best',
-                            'postprocessors': [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'mp3',
-                                'preferredquality': audio_quality,
-                            }],
-                        })
-                    elif "FLAC" in format_choice:
-                        ydl_opts.update({
-                            'format': 'bestaudio/best',
-                            'postprocessors': [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'flac',
-                            }],
-                        })
-                    elif "WAV" in format_choice:
-                        ydl_opts.update({
-                            'format': 'bestaudio/best',
-                            'postprocessors': [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'wav',
-                            }],
-                        })
-                    elif "M4A" in format_choice:
-                        ydl_opts.update({
-                            'format': 'bestaudio/best',
-                            'postprocessors': [{
-                                'key': 'FFmpegExtractAudio',
-                                'preferredcodec': 'm4a',
-                                'preferredquality': audio_quality,
-                            }],
-                        })
-                else:
-                    # Video download with fps handling (same logic as before)
-                    if quality == "Best":
-                        ydl_opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-                    elif "60fps" in quality:
-                        if "4K" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=2160][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]'
-                        elif "1440p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=1440][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]'
-                        elif "1080p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=1080][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]'
-                        elif "720p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=720][fps>=60][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]'
-                    else:
-                        if "4K" in quality or "2160p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]/best[height<=2160]'
-                        elif "1440p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]/best[height<=1440]'
-                        elif "1080p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080]'
-                        elif "720p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720]'
-                        elif "480p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480]'
-                        elif "360p" in quality:
-                            ydl_opts['format'] = 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[height<=360]'
-
-                    if "MKV" in format_choice:
-                        ydl_opts['merge_output_format'] = 'mkv'
-                    else:
-                        ydl_opts['merge_output_format'] = 'mp4'
-
-                # Download
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([single_url])
-
-                # Success: record history entry
-                self.save_history_entry({
-                    'url': single_url,
-                    'time': int(time.time()),
-                    'status': 'success',
-                    'path': self.download_path,
-                    'format': format_choice,
-                    'quality': quality
-                })
-                self.status_label.configure(text="Download completed successfully!")
-                self.progress_bar.set(1.0)
-                self.progress_label.configure(text="100%")
+    def _render_job(self, job):
+        row = self.job_rows.get(job.id)
+        if not row:
+            # Rows are created when a job starts, so huge batches stay cheap
+            if job.status == 'pending' or len(self.batch_jobs) < 2:
+                return
+            row = self._add_job_row(job)
+        _, _, bar, state_label = row
+        bar.set(job.progress)
+        if job.status == 'running' and job.phase == 'downloading':
+            state_label.configure(
+                text=f"{job.progress * 100:.0f}% | {format_speed(job.speed)} | ETA {format_eta(job.eta)}"
+            )
+        elif job.status == 'running' and job.phase == 'processing':
+            state_label.configure(text="Processing")
+        elif job.status == 'failed':
+            state_label.configure(text="Failed", text_color=ACCENT_COLOR)
+        elif job.status == 'pending' and job.attempts:
+            state_label.configure(text=f"Retrying ({(job.failure or 'error').replace('_', ' ')})")
+        else:
+            state_label.configure(text=job.status.capitalize())
 
-            except Exception as e:
-                # Record failure in history
-                self.save_history_entry({
-                    'url': single_url,
-                    'time': int(time.time()),
-                    'status': 'error',
-                    'error': str(e)
-                })
-                self.status_label.configure(text=f"Error: {str(e)}")
-                messagebox.showerror("Error", f"Download failed:\n{str(e)}")
+    def _render_batch(self, job):
+        """Render the aggregate progress of the current batch"""
+        if not self.batch_jobs:
+            return
+        total = len(self.batch_jobs)
+        finished = 0
+        active = 0
+        overall = 0.0
+        for j in self.batch_jobs:
+            if j.status in FINISHED_STATES:
+                finished += 1
+                overall += 1.0
+            else:
+                active += j.status == 'running'
+                overall += j.progress
+        overall /= total
+        self.progress_bar.set(overall)
+        self.progress_label.configure(text=f"{overall * 100:.1f}%")
+        if finished < total:
+            if total == 1 and job.phase == 'downloading':
+                text = f"Downloading... Speed: {format_speed(job.speed)} | ETA: {format_eta(job.eta)}"
+            elif total == 1 and job.phase == 'processing':
+                text = "Processing... Almost done!"
+            else:
+                text = f"Downloading {finished}/{total} done ({active} active)..."
+            parked = self.engine.retry_policy.open_hosts()
+            if parked:
+                text += f" · paused after errors: {', '.join(sorted(parked))}"
+            self.status_label.configure(text=text)
+
+    def _finish_batch(self):
+        if self._playlist_feed is not None:
+            # More playlist entries are still on their way
+            return
+        failed = [j for j in self.batch_jobs if j.status == 'failed']
+        skipped = [j for j in self.batch_jobs if j.status == 'skipped']
+        if len(self.batch_jobs) == 1 and skipped:
+            self.status_label.configure(text=f"Skipped: {skipped[0].error}")
+        elif not failed:
+            text = "Download completed successfully!"
+            if skipped:
+                text += f" ({len(skipped)} skipped as already downloaded or duplicate)"
+            self.status_label.configure(text=text)
+            self.progress_bar.set(1.0)
+            self.progress_label.configure(text="100%")
+        elif len(self.batch_jobs) == 1:
+            self.status_label.configure(text=f"Error: {failed[0].error}")
+        else:
+            done = len(self.batch_jobs) - len(failed) - len(skipped)
+            self.status_label.configure(
+                text=f"Finished: {done} succeeded, {len(skipped)} skipped, {len(failed)} failed"
+            )
+            self._show_failures()
 
         # Finalize
         self.is_downloading = False
@@ -821,7 +4445,152 @@ class DownloaderApp(ctk.CTk):
             text="Start Download",
             state="normal"
         )
-            
+
+    def _show_failures(self):
+        """List the batch's failures by site and error below the progress"""
+        groups = failure_summary(self.batch_jobs)
+        lines = []
+        for host, kind, error, n in groups[:FAILURE_SUMMARY_LINES]:
+            error = error if len(error) <= 120 else error[:117] + "..."
+            lines.append(f"{host or 'unknown'}: {error}" + (f" (×{n})" if n > 1 else ""))
+        hidden = sum(n for _, _, _, n in groups[FAILURE_SUMMARY_LINES:])
+        if hidden:
+            lines.append(f"... and {hidden} more")
+        self.failures_label.configure(text="\n".join(lines))
+        self.failures_label.grid()
+
+    def _add_job_row(self, job):
+        # Drop the oldest finished rows once the panel is full
+        if len(self.job_rows) >= MAX_JOB_ROWS:
+            for job_id, (old_job, old_row, _, _) in list(self.job_rows.items()):
+                if old_job.status in FINISHED_STATES:
+                    old_row.destroy()
+                    del self.job_rows[job_id]
+                    if len(self.job_rows) < MAX_JOB_ROWS:
+                        break
+        row = ctk.CTkFrame(self.jobs_frame, fg_color="transparent")
+        row.pack(fill="x", pady=2)
+        row.grid_columnconfigure(0, weight=1)
+        name = job.title or job.url
+        name = name if len(name) <= 60 else name[:57] + "..."
+        ctk.CTkLabel(row, text=name, font=ctk.CTkFont(size=11), anchor="w").grid(row=0, column=0, sticky="w")
+        state_label = ctk.CTkLabel(row, text="Pending", font=ctk.CTkFont(size=11), text_color="gray", anchor="e")
+        state_label.grid(row=0, column=1, sticky="e", padx=(10, 0))
+        bar = ctk.CTkProgressBar(row, height=6, progress_color=ACCENT_COLOR)
+        bar.grid(row=1, column=0, columnspan=2, sticky="ew")
+        bar.set(0)
+        self.job_rows[job.id] = (job, row, bar, state_label)
+        return self.job_rows[job.id]
+
+    def _current_options(self):
+        """Snapshot the UI selections (must be called on the main thread)"""
+        return {
+            'format': self.format_var.get(),
+            'quality': self.quality_var.get(),
+            'path': self.download_path,
+            'subs': self.subs_var.get(),
+            'subs_lang': self.subs_lang_var.get(),
+            'thumbnail': self.thumb_var.get(),
+            'connections': int(self.connections_var.get()),
+            'extra_formats': [c for c, var in self.extra_format_vars.items() if var.get()],
+        }
+
+    def _start_batch(self, urls, options=None, titles=None, local=False):
+        """Queue URLs on the scheduler with the given (default: current) options"""
+        options = options or self._current_options()
+        titles = titles or [None] * len(urls)
+        jobs = [DownloadJob(u, options, title=t) for u, t in zip(urls, titles)]
+        # Searched links are not extracted again (see download_job); links
+        # whose search failed are reported right away instead of retried
+        searched = dict(self.searched_infos)
+        if self.current_media_info and self.current_media_url:
+            searched[canonical_url(self.current_media_url)] = self.current_media_info
+        for job in jobs:
+            key = canonical_url(job.url)
+            if key in searched:
+                # The worker picks the full info dict up from the metadata cache
+                job.title = job.title or searched[key].title
+            elif key in self.search_errors:
+                job.status, job.error, job.progress = 'failed', self.search_errors[key], 1.0
+        self._start_jobs(jobs, local)
+
+    def _start_jobs(self, jobs, local=False):
+        """Make jobs the current batch and hand them to a running daemon, or
+        to the in-process engine if there is none (or `local` is set)"""
+        # Reset progress
+        self.progress_bar.set(0)
+        self.progress_label.configure(text="0%")
+        self.status_label.configure(text="Starting download...")
+
+        # Disable button
+        self.download_btn.configure(
+            text="Downloading...",
+            state="disabled"
+        )
+
+        self.is_downloading = True
+
+        # Fresh job list for this batch
+        for child in self.jobs_frame.winfo_children():
+            child.destroy()
+        self.job_rows = {}
+        self.failures_label.grid_remove()
+        self.batch_jobs = list(jobs)
+        if len(self.batch_jobs) > 1:
+            self.jobs_frame.grid()
+        else:
+            self.jobs_frame.grid_remove()
+
+        for job in self.batch_jobs:
+            if job.status == 'failed':
+                self.progress_bus.publish(job)
+        pending = [job for job in self.batch_jobs if job.status == 'pending']
+        if local or not pending or not self.config.get('use_daemon', True):
+            self.engine.submit(pending)
+            return
+        client = DaemonClient(self.config.get('daemon_port', DAEMON_PORT))
+        threading.Thread(target=self._run_on_daemon, args=(client, pending), daemon=True).start()
+
+    def _run_on_daemon(self, client, jobs):
+        """Hand jobs to the daemon and mirror their progress onto them
+        (background thread); runs them in-process if no daemon answers"""
+        events = None
+        try:
+            if not client.available():
+                raise OSError('No daemon running')
+            events = client.events()
+            remote = client.submit(jobs)
+        except Exception:
+            if events is not None:
+                events.close()
+            self.after(0, lambda: self.engine.submit(jobs))
+            return
+        self.after(0, lambda: self.status_label.configure(text="Queued on the MediaFetch daemon..."))
+        mirrors = {state['id']: job for state, job in zip(remote, jobs)}
+        unfinished = set(mirrors)
+        try:
+            for state in itertools.chain(remote, events):
+                job = mirrors.get(state['id'])
+                if job is None:
+                    continue
+                self.progress_bus.publish(job, **{k: state[k] for k in DaemonClient.MIRRORED})
+                if state['status'] in FINISHED_STATES:
+                    unfinished.discard(state['id'])
+                    if not unfinished:
+                        break
+        except Exception:
+            for job_id in unfinished:
+                self.progress_bus.publish(mirrors[job_id], status='failed', error='Lost connection to the daemon')
+        finally:
+            events.close()
+        self.after(0, self._finish_daemon_batch)
+
+    def _finish_daemon_batch(self):
+        # Apply the last mirrored states before counting them
+        for job, _ in self.progress_bus.drain():
+            self._render_job(job)
+        self._finish_batch()
+
     def start_download(self):
         # Gather URLs from multiline textbox
         text = self.url_text.get("0.0", "end").strip()
@@ -834,24 +4603,42 @@ class DownloaderApp(ctk.CTk):
         if self.is_downloading:
             messagebox.showwarning("Warning", "Download already in progress!")
             return
-        
-        # Reset progress
-        self.progress_bar.set(0)
-        self.progress_label.configure(text="0%")
-        self.status_label.configure(text="Starting download...")
-        
-        # Disable button
-        self.download_btn.configure(
-            text="Downloading...",
-            state="disabled"
-        )
-        
-        self.is_downloading = True
-        
-        # Start download in separate thread (pass the list)
-        thread = threading.Thread(target=self.download_thread, args=(urls,))
-        thread.daemon = True
-        thread.start()
+
+        # A searched playlist is expanded into one job per entry; each entry is
+        # fully extracted only when a worker picks it up
+        if (len(urls) == 1 and self.playlist_entries and self.current_media_url
+                and canonical_url(urls[0]) == canonical_url(self.current_media_url)):
+            entries = list(self.playlist_entries)
+            options = self._current_options()
+            # Entries still being listed feed the in-process engine
+            self._start_batch([e['url'] for e in entries], options, [e.get('title') for e in entries],
+                              local=self.is_searching)
+            if self.is_searching:
+                self._playlist_feed = options
+                self.jobs_frame.grid()
+            return
+
+        self._start_batch(urls)
+
+    def set_max_workers(self, choice):
+        self.config['max_workers'] = int(choice)
+        self.save_config()
+        if self.scheduler:
+            self.scheduler.configure(max_workers=int(choice))
+
+    def save_extra_formats(self):
+        self.config['extra_formats'] = [c for c, var in self.extra_format_vars.items() if var.get()]
+        self.save_config()
+
+    def set_connections(self, choice):
+        self.config['connections'] = int(choice)
+        self.save_config()
+
+    def set_bandwidth_limit(self, choice):
+        self.config['bandwidth_limit'] = None if choice == "Unlimited" else float(choice)
+        self.save_config()
+        if self.engine:
+            self.engine.set_bandwidth(self.config)
 
     # ------------------ Configuration, history, and utilities ------------------
     def load_config(self):
@@ -877,116 +4664,177 @@ class DownloaderApp(ctk.CTk):
         self.config['theme'] = new
         self.save_config()
 
-    def load_history(self):
+    def load_history(self, limit=200):
         try:
-            if self.history_path.exists():
-                with open(self.history_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            return self.history.query(limit=limit)
         except Exception:
-            pass
-        return []
+            return []
 
     def save_history_entry(self, entry):
-        hist = self.load_history()
-        hist.insert(0, entry)
-        # Keep only last 200 entries
-        hist = hist[:200]
         try:
-            with open(self.history_path, 'w', encoding='utf-8') as f:
-                json.dump(hist, f, indent=2)
+            self.history.add(entry)
         except Exception:
             pass
 
     def show_history(self):
-        hist = self.load_history()
         win = ctk.CTkToplevel(self)
         win.title('Download History')
-        win.geometry('700x400')
+        win.geometry('760x460')
+
+        # Filter bar: URL substring, status, format and date range
+        filter_frame = ctk.CTkFrame(win, fg_color='transparent')
+        filter_frame.pack(fill='x', padx=10, pady=(10, 0))
+        filter_frame.grid_columnconfigure(0, weight=1)
+
+        url_filter = ctk.CTkEntry(filter_frame, placeholder_text='Filter by URL')
+        url_filter.grid(row=0, column=0, sticky='ew', padx=(0, 6))
+        status_filter = ctk.StringVar(value='All statuses')
+        ctk.CTkOptionMenu(
+            filter_frame, values=['All statuses', 'success', 'error'], variable=status_filter, width=120,
+            command=lambda _: schedule_reload(0), fg_color=ACCENT_COLOR, button_color=ACCENT_COLOR
+        ).grid(row=0, column=1, padx=(0, 6))
+        format_filter = ctk.StringVar(value='All formats')
+        ctk.CTkOptionMenu(
+            filter_frame, values=['All formats'] + FORMAT_CHOICES, variable=format_filter, width=130,
+            command=lambda _: schedule_reload(0), fg_color=ACCENT_COLOR, button_color=ACCENT_COLOR
+        ).grid(row=0, column=2, padx=(0, 6))
+        since_filter = ctk.CTkEntry(filter_frame, placeholder_text='From YYYY-MM-DD', width=120)
+        since_filter.grid(row=0, column=3, padx=(0, 6))
+        until_filter = ctk.CTkEntry(filter_frame, placeholder_text='To YYYY-MM-DD', width=120)
+        until_filter.grid(row=0, column=4)
+
         # Use a selectable Listbox (monospace) so user can highlight and re-run entries
         frame = ctk.CTkFrame(win, fg_color='transparent')
-        frame.pack(fill='both', expand=True, padx=10, pady=(10, 6))
+        frame.pack(fill='both', expand=True, padx=10, pady=(6, 6))
 
         # Use native tkinter Listbox for selection behavior
         listbox = tk.Listbox(frame, font=("Courier New", 11), activestyle='none')
         scrollbar = tk.Scrollbar(frame, orient='vertical', command=listbox.yview)
-        listbox.config(yscrollcommand=scrollbar.set)
         listbox.pack(side='left', fill='both', expand=True)
         scrollbar.pack(side='right', fill='y')
 
-        if not hist:
-            listbox.insert('end', 'No history yet.')
-            listbox.configure(state='disabled')
-            return
+        count_label = ctk.CTkLabel(win, text='', font=ctk.CTkFont(size=11), text_color='gray', anchor='w')
+        count_label.pack(fill='x', padx=12)
+
+        # Rows are fetched a page at a time as the list is scrolled; `records`
+        # mirrors the listbox lines so actions use the stored entry directly
+        state = {'records': [], 'filters': {}, 'exhausted': False, 'pending': None}
+
+        def parse_day(text, end=False):
+            text = text.strip()
+            if not text:
+                return None
+            try:
+                t = time.mktime(time.strptime(text, '%Y-%m-%d'))
+            except ValueError:
+                return None
+            return t + 86400 if end else t
 
-        # Populate listbox with history lines
-        for item in hist:
+        def format_line(item):
             t = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(item.get('time', 0)))
-            status = item.get('status', 'unknown')
             url = item.get('url', '')
-            path = item.get('path', '')
-            fmt = item.get('format', '')
-            q = item.get('quality', '')
-            if status == 'success':
-                listbox.insert('end', f"[{t}] OK  {url} -> {path} ({fmt} {q})")
-            else:
-                err = item.get('error', '')
-                listbox.insert('end', f"[{t}] ERR {url} -> {err}")
+            if item.get('status') == 'success':
+                return f"[{t}] OK  {url} -> {item.get('path', '')} ({item.get('format', '')} {item.get('quality', '')})"
+            return f"[{t}] ERR {url} -> {item.get('error', '')}"
+
+        def load_page():
+            if state['exhausted']:
+                return
+            records = state['records']
+            before = (records[-1]['time'], records[-1]['id']) if records else None
+            try:
+                page = self.history.query(limit=HISTORY_PAGE_SIZE, before=before, **state['filters'])
+            except Exception:
+                page = []
+            if len(page) < HISTORY_PAGE_SIZE:
+                state['exhausted'] = True
+            records.extend(page)
+            if page:
+                listbox.insert('end', *[format_line(item) for item in page])
+
+        def reload():
+            state['pending'] = None
+            status = status_filter.get()
+            fmt = format_filter.get()
+            state['filters'] = {
+                'url': url_filter.get().strip() or None,
+                'status': None if status == 'All statuses' else status,
+                'format': None if fmt == 'All formats' else fmt,
+                'since': parse_day(since_filter.get()),
+                'until': parse_day(until_filter.get(), end=True),
+            }
+            state['records'] = []
+            state['exhausted'] = False
+            listbox.configure(state='normal')
+            listbox.delete(0, 'end')
+            load_page()
+            try:
+                total = self.history.count(**state['filters'])
+            except Exception:
+                total = 0
+            if not state['records']:
+                any_filter = any(v is not None for v in state['filters'].values())
+                listbox.insert('end', 'No matching entries.' if any_filter else 'No history yet.')
+                listbox.configure(state='disabled')
+            count_label.configure(text=f"{total:,} entries")
+
+        def schedule_reload(delay=250):
+            # Debounce keystrokes so typing doesn't run a query per character
+            if state['pending'] is not None:
+                win.after_cancel(state['pending'])
+            state['pending'] = win.after(delay, reload)
 
-        # Selected URL storage
-        selected = {'url': None}
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) > 0.9 and not state['exhausted']:
+                load_page()
 
-        import re
-        def parse_url_from_line(line):
-            m = re.search(r"(https?://\S+)", line)
-            if m:
-                return m.group(1)
+        listbox.config(yscrollcommand=on_scroll)
+        for entry in (url_filter, since_filter, until_filter):
+            entry.bind('<KeyRelease>', lambda e: schedule_reload())
+
+        def selected_record(index=None):
+            if index is None:
+                sel = listbox.curselection()
+                if not sel:
+                    return None
+                index = sel[0]
+            if 0 <= index < len(state['records']):
+                return state['records'][index]
             return None
 
+        def confirm_rerun(record):
+            if messagebox.askyesno('Re-run', f"Re-run this URL?\n{record['url']}"):
+                self._rerun_entry(record)
+
         def on_double_click(event=None):
             try:
-                idx = listbox.nearest(event.y)
-                line = listbox.get(idx)
-                url = parse_url_from_line(line)
-                if url:
-                    selected['url'] = url
-                    if messagebox.askyesno('Re-run', f'Re-run this URL?\n{url}'):
-                        self._run_url(url)
+                record = selected_record(listbox.nearest(event.y))
+                if record:
+                    confirm_rerun(record)
             except Exception:
                 pass
 
-        def on_select(event=None):
-            sel = listbox.curselection()
-            if sel:
-                line = listbox.get(sel[0])
-                selected['url'] = parse_url_from_line(line)
-            else:
-                selected['url'] = None
-
         listbox.bind('<Double-Button-1>', on_double_click)
-        listbox.bind('<<ListboxSelect>>', on_select)
 
         # Buttons: Re-run selected, Clear history
         btn_frame = ctk.CTkFrame(win, fg_color='transparent')
         btn_frame.pack(fill='x', padx=10, pady=(6,10))
 
         def on_rerun_btn():
-            url = selected.get('url')
-            if url:
-                if messagebox.askyesno('Re-run', f'Re-run this URL?\n{url}'):
-                    self._run_url(url)
+            record = selected_record()
+            if record:
+                confirm_rerun(record)
             else:
                 messagebox.showinfo('No selection', 'Select a history line to re-run.')
 
         def on_clear_btn():
             if messagebox.askyesno('Clear history', 'Clear all download history?'):
                 try:
-                    if self.history_path.exists():
-                        self.history_path.unlink()
+                    self.history.clear()
                 except Exception:
                     pass
-                listbox.delete(0, 'end')
-                listbox.insert('end', 'No history yet.')
-                listbox.configure(state='disabled')
+                reload()
 
         rerun_btn = ctk.CTkButton(btn_frame, text='Re-run Selected', width=140, command=on_rerun_btn, fg_color=ACCENT_COLOR, hover_color=HOVER_COLOR)
         rerun_btn.pack(side='left', padx=(0,8))
@@ -994,6 +4842,8 @@ class DownloaderApp(ctk.CTk):
         clear_btn = ctk.CTkButton(btn_frame, text='Clear History', width=120, command=on_clear_btn, fg_color=ACCENT_COLOR, hover_color=HOVER_COLOR)
         clear_btn.pack(side='left')
 
+        reload()
+
     def check_for_updates(self, show_popup=False):
         # Check GitHub releases for a newer tag
         try:
@@ -1019,24 +4869,627 @@ class DownloaderApp(ctk.CTk):
                 messagebox.showwarning('Update check failed', 'Could not check for updates (network error).')
             return False, None
 
-    def _run_url(self, url):
+    def _run_url(self, url, options=None):
         # Helper to run a single URL download (invoked from history)
         if self.is_downloading:
             messagebox.showwarning('Busy', 'A download is already in progress.')
             return
 
-        # Reset progress and UI like start_download
-        self.progress_bar.set(0)
-        self.progress_label.configure(text='0%')
-        self.status_label.configure(text='Starting download...')
-        self.download_btn.configure(text='Downloading...', state='disabled')
-        self.is_downloading = True
+        self._start_batch([url], options)
+
+    def _rerun_entry(self, record):
+        """Re-run a history entry with the format/quality/path it was stored with"""
+        options = self._current_options()
+        for key in ('format', 'quality', 'path'):
+            if record.get(key):
+                options[key] = record[key]
+        # An explicit re-run downloads again even if the item is archived
+        options['redownload'] = True
+        self._run_url(record['url'], options)
+
+
+# ------------------ Headless batch mode ------------------
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='mediafetch',
+        description='MediaFetch media downloader. Starts the desktop app unless --batch, --sync or --daemon is given.'
+    )
+    parser.add_argument('--batch', metavar='FILE',
+                        help="download the URLs in FILE (one per line, '-' for stdin) without a GUI, "
+                             "streaming NDJSON events to stdout")
+    parser.add_argument('--format', default='mp4',
+                        help='mp4, mkv, mp3, flac, wav or m4a (default: mp4); a comma-separated list such as '
+                             'mkv,mp3,flac downloads once and derives every format from that file')
+    parser.add_argument('--quality', default='Best',
+                        help="Best, 4K, 1440p, 1080p, 720p, 480p, 360p (add ' 60fps' for 60fps) "
+                             "or an audio bitrate such as 320")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_MAX_WORKERS, help='parallel downloads')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT, help='parallel downloads per site')
+    parser.add_argument('--output', default=str(Path.home() / "Downloads"), help='download folder')
+    parser.add_argument('--subs', metavar='LANG', help='download subtitles in LANG')
+    parser.add_argument('--thumbnail', action='store_true', help='also save the thumbnail')
+    parser.add_argument('--progress-interval', type=float, default=1.0, metavar='SECONDS',
+                        help='minimum time between progress events per job')
+    parser.add_argument('--connections', type=int, default=DEFAULT_CONNECTIONS,
+                        help='parallel connections per download (byte ranges or stream fragments)')
+    parser.add_argument('--limit-rate', metavar='MBPS',
+                        help='total bandwidth for all downloads in Mbit/s (default: unlimited)')
+    parser.add_argument('--schedule', action='append', default=[], metavar='HH:MM-HH:MM=MBPS',
+                        help='bandwidth limit for a time-of-day window, may be repeated '
+                             '(e.g. 08:00-20:00=20); --limit-rate applies outside the windows')
+    parser.add_argument('--retries', type=int, default=JOB_RETRIES, metavar='N',
+                        help=f'run downloads that fail with a network error, server error or rate limit '
+                             f'up to N more times (default: {JOB_RETRIES})')
+    parser.add_argument('--redownload', action='store_true',
+                        help='download items again even if they are in the download archive')
+    parser.add_argument('--resume', action='store_true',
+                        help='also run downloads left unfinished by a previous session (headless)')
+    parser.add_argument('--subscribe', action='append', default=[], metavar='URL',
+                        help='subscribe to a channel or playlist: new items are downloaded (with the '
+                             'download options given here) by --sync and while the app or daemon runs')
+    parser.add_argument('--every', type=float, default=SUBSCRIPTION_INTERVAL / 3600, metavar='HOURS',
+                        help='time between syncs of the subscriptions added with --subscribe (default: 24)')
+    parser.add_argument('--backlog', type=int, default=0, metavar='N',
+                        help='with --subscribe, also download the N newest items already there')
+    parser.add_argument('--unsubscribe', action='append', default=[], metavar='URL|ID',
+                        help='remove a subscription')
+    parser.add_argument('--subscriptions', action='store_true', help='list subscriptions as NDJSON')
+    parser.add_argument('--sync', action='store_true',
+                        help='check every subscription now and download its new items (headless)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='run as a background service with a local HTTP/JSON API that the app, '
+                             'scripts and browser extensions submit downloads to')
+    parser.add_argument('--port', type=int, default=DAEMON_PORT,
+                        help=f'daemon API port on 127.0.0.1 (default: {DAEMON_PORT})')
+    parser.add_argument('--allow-origin', action='append', default=[], metavar='ORIGIN',
+                        help='browser origin allowed to call the daemon API, e.g. chrome-extension://<id> '
+                             '(may be repeated)')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='serve Prometheus metrics at http://127.0.0.1:PORT/metrics while running')
+    parser.add_argument('--trace-startup', action='store_true',
+                        help='print import and UI construction timings to stderr')
+    return parser.parse_args(argv)
+
+
+def resolve_cli_options(args):
+    """Map command line arguments onto the options used by build_ydl_opts"""
+    formats = []
+    for name in args.format.split(','):
+        format_choice = FORMAT_ALIASES.get(name.strip().lower(), name.strip())
+        if format_choice not in FORMAT_CHOICES:
+            raise ValueError(f"Unknown format: {name}")
+        formats.append(format_choice)
+    format_choice = formats[0]
+    quality = args.quality
+    if "Audio" in format_choice and quality.isdigit():
+        quality = f"{quality} kbps"
+    return {
+        'format': format_choice,
+        'extra_formats': formats[1:],
+        'quality': quality,
+        'path': os.path.abspath(args.output),
+        'subs': bool(args.subs),
+        'subs_lang': args.subs or '',
+        'thumbnail': args.thumbnail,
+        'connections': args.connections,
+        'redownload': args.redownload,
+        'quiet': True,
+    }
+
+
+class NDJSONReporter:
+    """Writes one JSON event per line, safe to call from any thread"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({'event': event, 'time': round(time.time(), 3), **fields})
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def run_batch(args):
+    """Headless entry point: download a URL list and report NDJSON events"""
+    reporter = NDJSONReporter()
+    lines = []
+    try:
+        options = resolve_cli_options(args)
+        schedule = BandwidthSchedule(
+            parse_limit(args.limit_rate),
+            [BandwidthSchedule.parse_window(w) for w in args.schedule]
+        )
+        if args.batch == '-':
+            lines = sys.stdin.read().splitlines()
+        elif args.batch:
+            with open(args.batch, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+    except (OSError, ValueError) as e:
+        reporter.emit('error', error=str(e))
+        return 2
+    urls = [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+    def on_job_update(job):
+        if job.status == 'running':
+            reporter.emit('started', job=job.id, url=job.url)
+        elif job.status == 'done':
+            reporter.emit('done', job=job.id, url=job.url, metrics=job.metrics.to_dict())
+        elif job.status == 'failed':
+            reporter.emit('failed', job=job.id, url=job.url, error=job.error, reason=job.failure,
+                          metrics=job.metrics.to_dict())
+        elif job.status == 'skipped':
+            reporter.emit('skipped', job=job.id, url=job.url, reason=job.error)
+        elif job.status == 'pending' and job.attempts:
+            reporter.emit('retrying', job=job.id, url=job.url, error=job.error, reason=job.failure,
+                          attempt=job.attempts, delay=round(max(0.0, job.retry_at - time.monotonic()), 1))
+
+    idle = threading.Event()
+    engine = DownloadEngine(
+        {'max_workers': args.jobs, 'per_host_limit': args.per_host, 'metrics_port': args.metrics_port,
+         'job_retries': args.retries},
+        on_job_update=on_job_update,
+        on_idle=idle.set
+    )
+    engine.bandwidth.set_schedule(schedule)
+    jobs = engine.resumable_jobs() if args.resume else []
+    for job in jobs:
+        # Jobs queued from the GUI would otherwise log to stdout
+        job.options = {**job.options, 'quiet': True}
+    jobs += [DownloadJob(url, options) for url in urls]
+    if args.sync:
+        for sub, sub_jobs in engine.sync_subscriptions(engine.subscriptions.all()):
+            reporter.emit('synced', subscription=sub['id'], url=sub['url'], new=len(sub_jobs), error=sub['error'])
+            jobs += sub_jobs
+    for job in jobs:
+        reporter.emit('queued', job=job.id, url=job.url)
+    started = time.time()
+    if jobs:
+        engine.submit(jobs)
+    else:
+        idle.set()
+
+    exit_code = 0
+    try:
+        while not idle.wait(args.progress_interval):
+            for job, _ in engine.progress.drain():
+                if job.status == 'running' and job.phase:
+                    reporter.emit(
+                        'progress', job=job.id, phase=job.phase,
+                        downloaded_bytes=job.downloaded_bytes, total_bytes=job.total_bytes,
+                        speed=job.speed, eta=job.eta
+                    )
+    except KeyboardInterrupt:
+        for job in engine.scheduler.cancel_pending():
+            reporter.emit('cancelled', job=job.id, url=job.url)
+        exit_code = 130
+
+    failed = sum(1 for j in jobs if j.status == 'failed')
+    done = sum(1 for j in jobs if j.status == 'done')
+    skipped = sum(1 for j in jobs if j.status == 'skipped')
+    failures = [{'host': host, 'reason': kind, 'error': error, 'count': n}
+                for host, kind, error, n in failure_summary(jobs)]
+    reporter.emit('summary', total=len(jobs), done=done, skipped=skipped, failed=failed,
+                  retried=sum(1 for j in jobs if j.attempts), failures=failures,
+                  elapsed=round(time.time() - started, 3))
+    engine.close()
+    return exit_code or (1 if failed else 0)
+
+
+def manage_subscriptions(args):
+    """Add, remove and list subscriptions (--subscribe, --unsubscribe, --subscriptions)"""
+    reporter = NDJSONReporter()
+    try:
+        options = resolve_cli_options(args) if args.subscribe else None
+    except ValueError as e:
+        reporter.emit('error', error=str(e))
+        return 2
+    store = SubscriptionStore(SUBSCRIPTIONS_PATH)
+    exit_code = 0
+    try:
+        for url in args.subscribe:
+            if not url.startswith('http'):
+                reporter.emit('error', error=f'Not a valid URL: {url!r}')
+                exit_code = 2
+                continue
+            sub = store.add(url, options, interval=args.every * 3600, backlog=args.backlog)
+            reporter.emit('subscribed', subscription=sub['id'], url=sub['url'])
+        for key in args.unsubscribe:
+            if store.remove(key):
+                reporter.emit('unsubscribed', subscription=key)
+            else:
+                reporter.emit('error', error=f'No such subscription: {key}')
+                exit_code = 1
+        if args.subscriptions:
+            for sub in store.all():
+                reporter.emit(
+                    'subscription', subscription=sub['id'], url=sub['url'], title=sub['title'],
+                    interval=sub['interval'], last_sync=sub['last_sync'], known=len(sub['known_ids']),
+                    error=sub['error']
+                )
+    finally:
+        store.close()
+    return exit_code
 
-        thread = threading.Thread(target=self.download_thread, args=([url],))
-        thread.daemon = True
-        thread.start()
+
+# ------------------ Daemon mode ------------------
+def api_options(options):
+    """Resolve the options of an API submission the way the command line does"""
+    args = parse_args([])
+    fmt = options.get('format')
+    if isinstance(fmt, (list, tuple)):
+        fmt = ','.join(fmt)
+    for name, value in (('format', fmt), ('quality', options.get('quality')), ('output', options.get('output')),
+                        ('subs', options.get('subs')), ('thumbnail', options.get('thumbnail')),
+                        ('connections', options.get('connections')), ('redownload', options.get('redownload'))):
+        if value is not None:
+            setattr(args, name, value)
+    args.connections = int(args.connections)
+    args.thumbnail = bool(args.thumbnail)
+    args.redownload = bool(args.redownload)
+    return resolve_cli_options(args)
+
+
+class EventHub:
+    """Fans job events out to any number of subscribers (SSE clients).
+
+    Every subscriber gets a bounded queue; one that falls that far behind
+    misses events instead of holding up the others.
+    """
+
+    def __init__(self, queue_size=DAEMON_EVENT_QUEUE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self):
+        q = queue.Queue(self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class Daemon:
+    """Long-running download service: one engine and worker pool shared by
+    every client of its local HTTP/JSON API.
+
+    POST /jobs            {"urls": [url or {"url", "title"}, ...], "options": {...}}
+    GET  /jobs[/<id>]     job states
+    DELETE /jobs/<id>     cancel a queued or downloading job
+    GET  /events          server-sent events, one 'job' event per state change
+    GET  /health, /metrics
+
+    Only browser origins listed in allowed_origins (e.g. an extension's
+    chrome-extension://<id>) may call it from a web context.
+    """
+
+    def __init__(self, engine, port=DAEMON_PORT, host='127.0.0.1', allowed_origins=()):
+        import http.server
+        self.engine = engine
+        self.hub = EventHub()
+        self.allowed_origins = set(allowed_origins)
+        self.jobs = collections.OrderedDict()  # id -> DownloadJob, oldest first
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._server = http.server.ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self.hosts = {f'127.0.0.1:{self.port}', f'localhost:{self.port}', f'[::1]:{self.port}'}
+        threading.Thread(target=self._server.serve_forever, daemon=True, name='daemon-api').start()
+
+    def add(self, jobs):
+        """Track jobs (dropping the oldest finished ones) and queue them"""
+        with self._lock:
+            for job in jobs:
+                # Jobs queued from the app would otherwise log to stdout
+                job.options = {**job.options, 'quiet': True}
+                self.jobs[job.id] = job
+            finished = [i for i, j in self.jobs.items() if j.status in FINISHED_STATES]
+            for job_id in finished[:max(0, len(self.jobs) - DAEMON_MAX_JOBS)]:
+                del self.jobs[job_id]
+        self.engine.submit(jobs)
+
+    def submit(self, payload):
+        """Create and queue the jobs of a POST /jobs payload; ValueError if it is malformed"""
+        if not isinstance(payload, dict):
+            raise ValueError('Expected a JSON object')
+        items = payload.get('urls') or ([payload['url']] if payload.get('url') else [])
+        if not isinstance(items, list) or not items:
+            raise ValueError("'urls' must be a non-empty list")
+        options = api_options(payload.get('options') or {})
+        jobs = []
+        for item in items:
+            url, title = (item.get('url'), item.get('title')) if isinstance(item, dict) else (item, None)
+            if not isinstance(url, str) or not url.startswith('http'):
+                raise ValueError(f'Not a valid URL: {url!r}')
+            jobs.append(DownloadJob(url.strip(), options, title=title))
+        self.add(jobs)
+        return jobs
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def pump(self, interval=1.0 / PROGRESS_FPS):
+        """Forward coalesced engine updates to event subscribers until stop()"""
+        while not self._stopped.wait(interval):
+            for job, _ in self.engine.progress.drain():
+                self.hub.publish(job.to_dict())
+
+    def sync_subscriptions(self, interval=SUBSCRIPTION_POLL):
+        """Queue the new items of due subscriptions, checking every interval
+        seconds until stop()"""
+        while True:
+            try:
+                jobs = [job for _, sub_jobs in self.engine.sync_subscriptions() for job in sub_jobs]
+                if jobs:
+                    self.add(jobs)
+            except Exception:
+                pass
+            if self._stopped.wait(interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        self.stop()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        import http.server
+        daemon = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _cors(self):
+                origin = self.headers.get('Origin')
+                if origin in daemon.allowed_origins:
+                    self.send_header('Access-Control-Allow-Origin', origin)
+                    self.send_header('Vary', 'Origin')
+
+            def _send(self, status, body, content_type='application/json'):
+                data = (json.dumps(body) if content_type == 'application/json' else body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self._cors()
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _allowed(self):
+                """Answer 403 unless the request is addressed to the loopback
+                daemon (Host, against DNS rebinding) from an allowed origin"""
+                if self.headers.get('Host') not in daemon.hosts:
+                    self._send(403, {'error': 'Host not allowed'})
+                    return False
+                origin = self.headers.get('Origin')
+                if origin is not None and origin not in daemon.allowed_origins:
+                    self._send(403, {'error': 'Origin not allowed'})
+                    return False
+                return True
+
+            def _route(self):
+                """(path parts, job or None); answers 403 for foreign hosts and origins"""
+                if not self._allowed():
+                    return None, None
+                parts = [p for p in urllib.parse.urlsplit(self.path).path.split('/') if p]
+                job = None
+                if len(parts) == 2 and parts[0] == 'jobs':
+                    job = daemon.get(int(parts[1])) if parts[1].isdigit() else None
+                    if job is None:
+                        self._send(404, {'error': 'No such job'})
+                        return None, None
+                return parts, job
+
+            def do_OPTIONS(self):
+                # CORS preflight; _cors() only answers allowed origins
+                if not self._allowed():
+                    return
+                self.send_response(204)
+                self._cors()
+                self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE')
+                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+                self.end_headers()
+
+            def do_GET(self):
+                parts, job = self._route()
+                if parts is None:
+                    return
+                if job is not None:
+                    self._send(200, job.to_dict())
+                elif parts == ['jobs']:
+                    self._send(200, {'jobs': [j.to_dict() for j in daemon.snapshot()]})
+                elif parts == ['events']:
+                    self._stream_events()
+                elif parts == ['health']:
+                    self._send(200, {'status': 'ok', 'version': VERSION, 'busy': daemon.engine.scheduler.busy})
+                elif parts == ['metrics']:
+                    self._send(200, daemon.engine.metrics.render(), 'text/plain; version=0.0.4; charset=utf-8')
+                else:
+                    self._send(404, {'error': 'Not found'})
+
+            def do_POST(self):
+                parts, _ = self._route()
+                if parts is None:
+                    return
+                if parts != ['jobs']:
+                    self._send(404, {'error': 'Not found'})
+                    return
+                # Requiring JSON makes cross-site form posts impossible
+                if not (self.headers.get('Content-Type') or '').startswith('application/json'):
+                    self._send(415, {'error': 'Content-Type must be application/json'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length') or 0)
+                    jobs = daemon.submit(json.loads(self.rfile.read(length) or b'null'))
+                except ValueError as e:
+                    self._send(400, {'error': str(e)})
+                    return
+                self._send(201, {'jobs': [j.to_dict() for j in jobs]})
+
+            def do_DELETE(self):
+                parts, job = self._route()
+                if parts is None:
+                    return
+                if job is None:
+                    self._send(404, {'error': 'Not found'})
+                elif daemon.engine.cancel(job):
+                    self._send(200, job.to_dict())
+                else:
+                    self._send(409, {'error': f'Job is {job.phase if job.status == "running" else job.status}',
+                                     'job': job.to_dict()})
+
+            def _stream_events(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self._cors()
+                self.end_headers()
+                events = daemon.hub.subscribe()
+                try:
+                    # Current state first, then every change
+                    for job in daemon.snapshot():
+                        self._write_event(job.to_dict())
+                    while not daemon._stopped.is_set():
+                        try:
+                            self._write_event(events.get(timeout=DAEMON_KEEPALIVE))
+                        except queue.Empty:
+                            self.wfile.write(b': keep-alive\n\n')
+                            self.wfile.flush()
+                except OSError:
+                    pass
+                finally:
+                    daemon.hub.unsubscribe(events)
+
+            def _write_event(self, state):
+                self.wfile.write(f'event: job\ndata: {json.dumps(state)}\n\n'.encode('utf-8'))
+                self.wfile.flush()
+
+        return Handler
+
+
+class DaemonClient:
+    """Client of a running daemon's API, used by the desktop app to hand its
+    downloads to the shared queue"""
+
+    # Job fields mirrored from the daemon onto the app's local DownloadJob
+    MIRRORED = ('title', 'status', 'phase', 'progress', 'downloaded_bytes', 'total_bytes', 'speed', 'eta', 'error',
+                'failure', 'attempts')
+
+    def __init__(self, port=DAEMON_PORT, host='127.0.0.1'):
+        self.base = f'http://{host}:{port}'
+
+    def available(self, timeout=0.3):
+        try:
+            with urllib.request.urlopen(self.base + '/health', timeout=timeout) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    def submit(self, jobs):
+        """Queue jobs (sharing the app's options) on the daemon; returns their remote states"""
+        options = jobs[0].options
+        payload = {
+            'urls': [{'url': job.url, 'title': job.title} for job in jobs],
+            'options': {
+                'format': [options['format']] + list(options.get('extra_formats') or []),
+                'quality': options.get('quality'),
+                'output': options.get('path'),
+                'subs': options.get('subs_lang') if options.get('subs') else None,
+                'thumbnail': options.get('thumbnail'),
+                'connections': options.get('connections'),
+                'redownload': options.get('redownload'),
+            },
+        }
+        request = urllib.request.Request(
+            self.base + '/jobs', data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)['jobs']
+
+    def events(self):
+        """Open the event stream now (so no update is missed) and return it"""
+        return DaemonEvents(urllib.request.urlopen(self.base + '/events', timeout=DAEMON_KEEPALIVE * 2))
+
+
+class DaemonEvents:
+    """Open event stream of a daemon: iterate for job states, close() when done"""
+
+    def __init__(self, response):
+        self.response = response
+
+    def __iter__(self):
+        for line in self.response:
+            if line.startswith(b'data: '):
+                yield json.loads(line[6:])
+
+    def close(self):
+        self.response.close()
+
+
+def run_daemon(args):
+    """Daemon entry point: serve the API until interrupted"""
+    try:
+        schedule = BandwidthSchedule(
+            parse_limit(args.limit_rate),
+            [BandwidthSchedule.parse_window(w) for w in args.schedule]
+        )
+    except ValueError as e:
+        print(f'mediafetch: {e}', file=sys.stderr)
+        return 2
+    engine = DownloadEngine({'max_workers': args.jobs, 'per_host_limit': args.per_host,
+                             'metrics_port': args.metrics_port, 'job_retries': args.retries})
+    engine.bandwidth.set_schedule(schedule)
+    try:
+        daemon = Daemon(engine, args.port, allowed_origins=args.allow_origin)
+    except OSError as e:
+        print(f'mediafetch: cannot listen on port {args.port}: {e}', file=sys.stderr)
+        engine.close()
+        return 2
+    print(f'MediaFetch daemon listening on http://127.0.0.1:{daemon.port}', file=sys.stderr, flush=True)
+    if args.resume:
+        daemon.add(engine.resumable_jobs())
+    threading.Thread(target=daemon.sync_subscriptions, daemon=True, name='subscriptions').start()
+    try:
+        daemon.pump()
+    except KeyboardInterrupt:
+        pass
+    daemon.close()
+    engine.close()
+    return 0
 
 
 if __name__ == "__main__":
-    app = DownloaderApp()
+    cli_args = parse_args()
+    if cli_args.daemon:
+        sys.exit(run_daemon(cli_args))
+    if cli_args.subscribe or cli_args.unsubscribe or cli_args.subscriptions:
+        sys.exit(manage_subscriptions(cli_args))
+    if cli_args.batch or cli_args.resume or cli_args.sync:
+        sys.exit(run_batch(cli_args))
+    app = create_app()
     app.mainloop()
+